@@ -5,24 +5,26 @@ from time import time
 from tornado.web import Application, RequestHandler, stream_request_body
 from tornado.ioloop import IOLoop
 
-from streaming_form_data import StreamingFormDataParser
 from streaming_form_data.targets import ValueTarget, FileTarget
+from streaming_form_data.tornado import StreamingFormDataMixin
 
 
 @stream_request_body
-class UploadHandler(RequestHandler):
+class UploadHandler(StreamingFormDataMixin, RequestHandler):
+    max_body_size = 1024 * 1024 * 1024
+
+    # FileTarget writes to the disk, off the IOLoop
+    blocking_targets = True
+
     def prepare(self):
+        super().prepare()
+
         self.value = ValueTarget()
         name = 'uploaded-file-tornado-{}.dat'.format(int(time()))
         self.file_ = FileTarget(os.path.join(tempfile.gettempdir(), name))
 
-        self._parser = StreamingFormDataParser(headers=self.request.headers)
-
-        self._parser.register('name', self.value)
-        self._parser.register('file', self.file_)
-
-    def data_received(self, chunk):
-        self._parser.data_received(chunk)
+        self.register('name', self.value)
+        self.register('file', self.file_)
 
     def post(self):
         self.render('upload.html', name=self.value.value,
@@ -1,3 +1,5 @@
+import platform
+
 from setuptools import setup, Extension
 
 
@@ -8,12 +10,19 @@ try:
 except ImportError:
     pass
 
-if cythonize:
+if platform.python_implementation() == 'PyPy':
+    # the pure Python parser is used on PyPy
+    extensions = []
+elif cythonize:
     extensions = cythonize('streaming_form_data/_parser.pyx')
 else:
     extensions = [Extension('streaming_form_data._parser',
                             ['streaming_form_data/_parser.c'])]
 
+# fall back to the pure Python parser if the extension fails to build
+for extension in extensions:
+    extension.optional = True
+
 
 with open('README.rst') as f:
     long_description = f.read()
@@ -1,2 +1,5 @@
 from streaming_form_data.parser import (StreamingFormDataParser,  # NOQA
-                                        ParseFailedException)  # NOQA
+                                        ParseFailedException,  # NOQA
+                                        ParserPool,  # NOQA
+                                        parse_file)  # NOQA
+from streaming_form_data.index import parse_bytes  # NOQA
@@ -1,6 +1,18 @@
-import cgi
+from fnmatch import fnmatchcase
+from time import perf_counter
 
-from streaming_form_data.targets import NullTarget
+from cpython.bytearray cimport PyByteArray_AS_STRING, \
+    PyByteArray_FromStringAndSize
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from libc.string cimport memchr, memcmp, memmove, memset
+
+from streaming_form_data.targets import NullTarget, ValueTarget, \
+    FileTarget, SHA256Target
+
+# Checked by parser.py so that an extension built from an older version of
+# this file is not used: to be increased whenever the interface of _Parser or
+# of the module changes.
+INTERFACE_VERSION = 3
 
 ctypedef unsigned char Byte
 
@@ -9,6 +21,7 @@ cdef enum Constants:
     CR     = 13
     LF     = 10
     MinFileBodyChunkSize = 1024
+    ReadBufferSize = 65536
 
 
 cdef enum FinderState:
@@ -77,28 +90,187 @@ cdef class Finder:
         return self.index
 
 
-class Part:
+cpdef tuple parse_header(str line):
+    """Value and parameters of a header like Content-Type or
+    Content-Disposition, parsed the same way as by cgi.parse_header().
+    """
+
+    cdef list parts
+    cdef dict params = {}
+    cdef str part, name, separator, value
+
+    if '"' in line:
+        parts = _split_params(line)
+    else:
+        parts = line.split(';')
+
+    for part in parts[1:]:
+        name, separator, value = part.partition('=')
+        if separator:
+            value = value.strip()
+            if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+                value = value[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+            params[name.strip().lower()] = value
+
+    return parts[0].strip(), params
+
+
+cdef list _split_params(str line):
+    # split the header at the semicolons which are not in quoted strings
+    cdef list parts = []
+    cdef Py_ssize_t start = 0, end
+
+    while True:
+        end = line.find(';', start)
+        while end > start and (line.count('"', start, end) -
+                               line.count('\\"', start, end)) % 2:
+            end = line.find(';', end + 1)
+
+        if end < 0:
+            parts.append(line[start:])
+            return parts
+
+        parts.append(line[start:end])
+        start = end + 1
+
+
+def find_all(buffer, bytes target, size_t start, size_t end):
+    """Offsets of the occurrences of target starting in [start, end) in an
+    object supporting the buffer protocol. The search runs without the GIL,
+    so that threads can search several regions of a buffer concurrently.
+    """
+
+    cdef const Byte[::1] view = buffer
+    cdef const Byte *data
+    cdef const Byte *target_ptr = target
+    cdef size_t target_len = len(target)
+    cdef size_t limit
+    cdef Py_ssize_t found
+    cdef list offsets = []
+
+    # occurrences starting before end may continue after it
+    limit = min(end + target_len - 1, <size_t> view.shape[0])
+
+    if target_len == 0 or start >= limit:
+        return offsets
+
+    data = &view[0]
+
+    while True:
+        with nogil:
+            found = _find(data, start, limit, target_ptr, target_len)
+
+        if found < 0:
+            return offsets
+
+        offsets.append(found)
+        start = found + 1
+
+
+cdef Py_ssize_t _find(const Byte *data, size_t start, size_t limit,
+                      const Byte *target, size_t target_len) nogil:
+    # offset of the first occurrence of target in data[start:limit], or -1
+    cdef const Byte *ptr = data + start
+    cdef const Byte *last
+
+    if start + target_len > limit:
+        return -1
+
+    # the last position an occurrence can start at
+    last = data + limit - target_len
+
+    while ptr <= last:
+        ptr = <const Byte *> memchr(ptr, target[0], last - ptr + 1)
+        if ptr == NULL:
+            return -1
+
+        if memcmp(ptr, target, target_len) == 0:
+            return ptr - data
+
+        ptr += 1
+
+    return -1
+
+
+cdef class Part:
     """One part of a multipart/form-data request
     """
 
-    def __init__(self, name, target):
+    cdef readonly str name
+    cdef readonly object target
+
+    # Callable receiving the body chunks, None when they are discarded
+    cdef object _sink
+
+    # whether the value returned by _sink may ask the parser to pause, which
+    # is not the case for the builtin fast paths
+    cdef bint _pausable
+
+    # whether the part has been received completely at least once
+    cdef bint done
+
+    # whether the part has been registered, as opposed to parts created for
+    # unexpected names
+    cdef bint expected
+
+    def __init__(self, name, target, expected=False):
         self.name = name
         self.target = target
+        self._sink = None
+        self._pausable = False
+        self.done = False
+        self.expected = expected
 
-    def set_multipart_filename(self, value):
+    cdef set_multipart_filename(self, value):
         self.target.multipart_filename = value
 
-    def start(self):
+    cdef start(self):
+        cdef object target_type
+
         self.target.start()
         self.target._started = True
 
-    def data_received(self, chunk):
-        self.target.data_received(chunk)
+        # The built-in targets (but not their subclasses, which may override
+        # data_received) are fed through the builtin method they would call
+        # anyway, so that no Python level function is called per chunk.
+        target_type = type(self.target)
+
+        self._pausable = False
+
+        if target_type is NullTarget:
+            self._sink = None
+        elif target_type is ValueTarget:
+            self._sink = self.target._values.append
+        elif target_type is SHA256Target:
+            self._sink = self.target._hash.update
+        elif target_type is FileTarget:
+            self._sink = self.target._fd.write
+        else:
+            self._sink = self.target.data_received
+            self._pausable = True
+
+    cdef inline bint discards(self):
+        return self._sink is None
+
+    cdef data_received(self, object chunk):
+        # returns the value the target asks the parser to pause with, if any
+        if self._sink is None:
+            return None
+
+        if self._pausable:
+            return self._sink(chunk)
+
+        self._sink(chunk)
+        return None
+
+    cdef finish(self):
+        self._sink = None
 
-    def finish(self):
         self.target.finish()
         self.target._finished = True
 
+        self.done = True
+
 
 cdef enum ParserState:
     PS_START,
@@ -112,16 +284,100 @@ cdef enum ParserState:
     PS_END
 
 
+# names used for reporting, in ParserState order
+STATE_NAMES = (
+    'start',
+    'starting_boundary', 'reading_boundary', 'ending_boundary',
+    'reading_header', 'ending_header', 'ended_header', 'ending_all_headers',
+    'reading_body',
+    'end',
+)
+
+
+cdef enum TargetAction:
+    TA_START, TA_DATA_RECEIVED, TA_FINISH
+
+
+TARGET_ACTION_NAMES = ('start', 'data_received', 'finish')
+
+
+# Hot path counters, only updated when the parser collects statistics
+cdef struct ParserStats:
+    unsigned long long bytes_received
+    unsigned long long bytes_fed
+    unsigned long long bytes_skipped
+    unsigned long long leftover_copies
+    unsigned long long leftover_bytes
+    unsigned long long parts
+    unsigned long long body_chunks
+    unsigned long long body_bytes
+    unsigned long long body_chunk_min
+    unsigned long long body_chunk_max
+    double header_seconds
+    double target_seconds
+
+
 cdef class _Parser:
     cdef ParserState state
     cdef Finder delimiter_finder, ender_finder
     cdef size_t delimiter_length, ender_length
-    cdef object expected_parts
-    cdef object active_part, default_part
-
-    cdef bytes _leftover_buffer
-
-    def __init__(self, delimiter, ender):
+    cdef list expected_parts
+    cdef Part active_part, default_part
+
+    # name the active part has been sent with
+    cdef str _active_name
+
+    # part being described by the headers which are currently parsed
+    cdef str _part_name
+    cdef object _part_filename
+    cdef dict _part_headers
+
+    # optional callbacks notified about the progress of the whole request
+    cdef public object on_part_begin, on_part_end, on_all_registered_complete
+
+    # (pattern, factory) pairs creating a new target for every occurrence of
+    # a part whose name matches the pattern and has not been registered
+    cdef list factories
+
+    cdef bytearray _leftover_buffer
+
+    # buffer handed out by get_buffer() for reading data into, which starts
+    # with the _carry bytes left over from the previous read
+    cdef bytearray _read_buffer
+    cdef size_t _carry
+
+    # memoryview of the buffer being parsed by parse_buffer(), whose slices
+    # are passed on to the targets instead of copies
+    cdef object _emit_view
+
+    # stop parsing once every registered part has been received
+    cdef bint stop_when_done
+    cdef size_t _parts_pending
+
+    # value returned by a target's data_received to pause the parser, and
+    # the input left unparsed (from _retained_index on) until resume()
+    cdef readonly object pause_reason
+    cdef object _retained
+    cdef size_t _retained_index, _retained_end
+
+    # offsets in the request body of the delimiter line starting the current
+    # part, of its data and of the end of the data of the last part
+    cdef readonly unsigned long long part_offset, body_offset, body_end
+    cdef unsigned long long _received
+
+    cdef bint collect_stats
+    cdef ParserStats _stats
+
+    cdef bint profiling
+    cdef ParserState _profile_state
+    cdef double _profile_mark
+    cdef double _state_seconds[PS_END + 1]
+    cdef double _header_seconds
+    cdef dict _target_seconds
+
+    def __init__(self, delimiter, ender, collect_stats=False, profile=False,
+                 stop_when_done=False, on_part_begin=None, on_part_end=None,
+                 on_all_registered_complete=None):
         self.delimiter_finder = Finder(delimiter)
         self.ender_finder = Finder(ender)
 
@@ -131,66 +387,515 @@ cdef class _Parser:
         self.state = ParserState.PS_START
 
         self.expected_parts = []
+        self.factories = []
 
         self.active_part = None
         self.default_part = Part('_default', NullTarget())
 
+        self._active_name = None
+
+        self._part_name = None
+        self._part_filename = None
+        self._part_headers = {}
+
+        self.on_part_begin = on_part_begin
+        self.on_part_end = on_part_end
+        self.on_all_registered_complete = on_all_registered_complete
+
         self._leftover_buffer = None
 
+        self._read_buffer = None
+        self._carry = 0
+
+        self._emit_view = None
+
+        self.stop_when_done = stop_when_done
+        self._parts_pending = 0
+
+        self.pause_reason = None
+        self._retained = None
+        self._retained_index = 0
+        self._retained_end = 0
+
+        self.part_offset = 0
+        self.body_offset = 0
+        self.body_end = 0
+        self._received = 0
+
+        self.collect_stats = collect_stats
+        self.reset_stats()
+
+        self.profiling = profile
+        self.reset_profile()
+
+    def reset(self, delimiter, ender):
+        """Bring the parser back to its initial state, possibly for another
+        delimiter, keeping the already allocated objects where possible.
+        """
+
+        if self.delimiter_finder.target != delimiter:
+            self.delimiter_finder = Finder(delimiter)
+        else:
+            self.delimiter_finder.reset()
+
+        if self.ender_finder.target != ender:
+            self.ender_finder = Finder(ender)
+        else:
+            self.ender_finder.reset()
+
+        self.delimiter_length = len(delimiter)
+        self.ender_length = len(ender)
+
+        self.state = ParserState.PS_START
+
+        del self.expected_parts[:]
+        del self.factories[:]
+        self._parts_pending = 0
+
+        self.active_part = None
+        self._active_name = None
+
+        self._part_name = None
+        self._part_filename = None
+        self._part_headers = {}
+
+        self._leftover_buffer = None
+        self._carry = 0
+
+        self.pause_reason = None
+        self._retained = None
+        self._retained_index = 0
+        self._retained_end = 0
+
+        self.part_offset = 0
+        self.body_offset = 0
+        self.body_end = 0
+        self._received = 0
+
+        self.reset_stats()
+        self.reset_profile()
+
+    @property
+    def stats(self):
+        return {
+            'bytes_received': self._stats.bytes_received,
+            'bytes_fed': self._stats.bytes_fed,
+            'bytes_skipped': self._stats.bytes_skipped,
+            'leftover_copies': self._stats.leftover_copies,
+            'leftover_bytes': self._stats.leftover_bytes,
+            'parts': self._stats.parts,
+            'body_chunks': self._stats.body_chunks,
+            'body_bytes': self._stats.body_bytes,
+            'body_chunk_min': self._stats.body_chunk_min,
+            'body_chunk_max': self._stats.body_chunk_max,
+            'header_seconds': self._stats.header_seconds,
+            'target_seconds': self._stats.target_seconds,
+        }
+
+    def reset_stats(self):
+        memset(&self._stats, 0, sizeof(ParserStats))
+
+    @property
+    def profile(self):
+        return {
+            'states': {name: self._state_seconds[state]
+                       for state, name in enumerate(STATE_NAMES)},
+            'headers': self._header_seconds,
+            'targets': {name: dict(zip(TARGET_ACTION_NAMES, seconds))
+                        for name, seconds in self._target_seconds.items()},
+        }
+
+    def reset_profile(self):
+        memset(self._state_seconds, 0, sizeof(self._state_seconds))
+        self._header_seconds = 0
+        self._target_seconds = {}
+
+    # The profile splits the wall clock time spent inside data_received
+    # between parser states, header parsing and target callbacks, so that
+    # the time of a callback is not attributed to the state it was called
+    # from.
+    cdef _profile_flush(self):
+        cdef double now
+
+        now = perf_counter()
+        self._state_seconds[<int> self._profile_state] += \
+            now - self._profile_mark
+        self._profile_mark = now
+        self._profile_state = self.state
+
+    cdef _call_target(self, TargetAction action, object value):
+        cdef double started, elapsed
+        cdef list seconds
+
+        if self.profiling:
+            self._profile_flush()
+
+        started = perf_counter()
+        result = None
+
+        if action == TargetAction.TA_START:
+            self.active_part.start()
+        elif action == TargetAction.TA_DATA_RECEIVED:
+            result = self.active_part.data_received(value)
+        else:
+            self.active_part.finish()
+
+        elapsed = perf_counter() - started
+
+        if self.collect_stats:
+            self._stats.target_seconds += elapsed
+
+        if self.profiling:
+            seconds = self._target_seconds.get(self.active_part.name)
+            if seconds is None:
+                seconds = [0.0, 0.0, 0.0]
+                self._target_seconds[self.active_part.name] = seconds
+            seconds[action] += elapsed
+
+            self._profile_mark = perf_counter()
+
+        return result
+
     def register(self, str name, object target):
         if not self._part_for(name):
-            self.expected_parts.append(Part(name, target))
+            self.expected_parts.append(Part(name, target, True))
+            self._parts_pending += 1
+
+    def register_factory(self, str pattern, object factory):
+        self.factories.append((pattern, factory))
+
+    @property
+    def finished(self):
+        return self.state == ParserState.PS_END
 
-    def set_active_part(self, part, filename):
+    @property
+    def retained(self):
+        # number of received bytes left unparsed while paused
+        if self._retained is None:
+            return 0
+        return self._retained_end - self._retained_index
+
+    cdef set_active_part(self, Part part, str name, filename, dict headers):
         self.active_part = part
+        self._active_name = name
         self.active_part.set_multipart_filename(filename)
-        self.active_part.start()
 
-    def unset_active_part(self):
-        if self.active_part:
-            self.active_part.finish()
+        if self.collect_stats:
+            self._stats.parts += 1
+
+        if self.on_part_begin is not None:
+            self.on_part_begin(name, filename, headers)
+
+        if self.collect_stats or self.profiling:
+            self._call_target(TargetAction.TA_START, None)
+        else:
+            self.active_part.start()
+
+    cdef unset_active_part(self):
+        cdef Part part
+        cdef bint first_time
+
+        part = self.active_part
+
+        if part is not None:
+            first_time = not part.done
+
+            if self.collect_stats or self.profiling:
+                self._call_target(TargetAction.TA_FINISH, None)
+            else:
+                part.finish()
+
+            if self.on_part_end is not None:
+                self.on_part_end(self._active_name, part.target)
+
+            if first_time and part.expected:
+                self._parts_pending -= 1
+
+                if self._parts_pending == 0:
+                    if self.on_all_registered_complete is not None:
+                        self.on_all_registered_complete()
+
+                    if self.stop_when_done:
+                        self.state = ParserState.PS_END
         self.active_part = None
 
-    def on_body(self, bytes value):
-        if self.active_part and len(value) > 0:
-            self.active_part.data_received(value)
+    # Pass the body bytes between start and end on to the active part,
+    # without even creating the bytes object when the part discards them.
+    cdef _emit(self, object chunk, const Byte *chunk_ptr, size_t start,
+               size_t end):
+        if end > start and self.active_part is not None and \
+                not self.active_part.discards():
+            if self._emit_view is not None:
+                self.on_body(self._emit_view[start:end])
+            elif type(chunk) is bytes:
+                # slicing returns the input chunk itself when it is all body
+                # data, instead of a copy
+                self.on_body(chunk[start:end])
+            else:
+                self.on_body(PyBytes_FromStringAndSize(
+                    <const char *> chunk_ptr + start, end - start))
+
+    cdef on_body(self, object value):
+        cdef size_t size
+
+        size = len(value)
+
+        if self.active_part is not None and size > 0:
+            if self.collect_stats:
+                self._stats.body_chunks += 1
+                self._stats.body_bytes += size
+                if self._stats.body_chunk_min == 0 or \
+                        size < self._stats.body_chunk_min:
+                    self._stats.body_chunk_min = size
+                if size > self._stats.body_chunk_max:
+                    self._stats.body_chunk_max = size
+
+            if self.collect_stats or self.profiling:
+                result = self._call_target(TargetAction.TA_DATA_RECEIVED,
+                                           value)
+            else:
+                result = self.active_part.data_received(value)
+
+            if result is not None:
+                self.pause_reason = result
+
+    cdef _on_header(self, str line):
+        value, params = parse_header(line)
+
+        if value.startswith('Content-Disposition') and \
+                value.endswith('form-data'):
+            name = params.get('name')
+            if name:
+                self._part_name = name
+                self._part_filename = params.get('filename')
+
+        key, separator, value = line.partition(':')
+        if separator:
+            self._part_headers[key.strip().lower()] = value.strip()
+
+    cdef Part _new_part(self, str name, filename, dict headers):
+        for pattern, factory in self.factories:
+            if fnmatchcase(name, pattern):
+                return Part(name, factory(name, filename, headers))
+
+        return self.default_part
+
+    cdef Part _part_for(self, name):
+        cdef Part part
 
-    cdef _part_for(self, name):
         for part in self.expected_parts:
             if part.name == name:
                 return part
 
+        return None
+
     def data_received(self, bytes data):
-        if not data:
+        if not data or self.state == ParserState.PS_END:
             return 0
 
-        cdef bytes chunk
+        cdef bytearray leftover
+        cdef object chunk
+        cdef const Byte *chunk_ptr
         cdef size_t index
 
+        self._received += len(data)
+
+        if self.collect_stats:
+            self._stats.bytes_received += len(data)
+
+        if self._carry:
+            self._leftover_buffer = PyByteArray_FromStringAndSize(
+                PyByteArray_AS_STRING(self._read_buffer), self._carry)
+            self._carry = 0
+
+        # The leftover is extended in place instead of being concatenated
+        # with the new data: otherwise a long header line spread over lots of
+        # small chunks would be copied over and over again, which makes the
+        # parsing time quadratic in the line length. It stays the leftover
+        # while being parsed, so that _parse() trims it in place.
         if self._leftover_buffer:
-            chunk = self._leftover_buffer + data
-            index = len(self._leftover_buffer)
-            self._leftover_buffer = None
+            leftover = self._leftover_buffer
+            index = len(leftover)
+            leftover += data
+
+            if self.collect_stats:
+                self._stats.leftover_copies += 1
+                self._stats.leftover_bytes += len(data)
+
+            chunk = leftover
+            chunk_ptr = <const Byte *> PyByteArray_AS_STRING(leftover)
         else:
             chunk = data
+            chunk_ptr = <const Byte *> data
             index = 0
 
-        return self._parse(chunk, index)
+        return self._run(chunk, chunk_ptr, index, 0, len(chunk))
+
+    def get_buffer(self, Py_ssize_t size_hint=-1):
+        """Writable buffer of at least size_hint bytes to read data into,
+        as in asyncio.BufferedProtocol. The data is parsed in place by
+        buffer_updated().
+        """
+
+        cdef size_t size
+        cdef bytearray buffer
+
+        if self._leftover_buffer:
+            # carried over from data_received()
+            self._carry = len(self._leftover_buffer)
+
+        size = self._carry + max(size_hint, Constants.ReadBufferSize)
+
+        # The buffer handed out previously may still be referenced, and so
+        # can't be resized: a new one is allocated instead.
+        if self._read_buffer is None or len(self._read_buffer) < size:
+            buffer = PyByteArray_FromStringAndSize(NULL, size)
+            if self._carry and not self._leftover_buffer:
+                memmove(PyByteArray_AS_STRING(buffer),
+                        PyByteArray_AS_STRING(self._read_buffer), self._carry)
+            self._read_buffer = buffer
+
+        if self._leftover_buffer:
+            self._read_buffer[:self._carry] = self._leftover_buffer
+            self._leftover_buffer = None
+
+        return memoryview(self._read_buffer)[self._carry:]
+
+    def written(self, Py_ssize_t nbytes):
+        """Copy of the nbytes written into the buffer returned by
+        get_buffer(), to be taken before calling buffer_updated().
+        """
+
+        if nbytes <= 0 or self._read_buffer is None:
+            return b''
+
+        nbytes = min(nbytes, len(self._read_buffer) - self._carry)
+
+        return PyBytes_FromStringAndSize(
+            PyByteArray_AS_STRING(self._read_buffer) + self._carry, nbytes)
+
+    def buffer_updated(self, Py_ssize_t nbytes):
+        cdef size_t index
+
+        if nbytes <= 0 or self.state == ParserState.PS_END:
+            return 0
+
+        if self._read_buffer is None or \
+                self._carry + nbytes > len(self._read_buffer):
+            raise ValueError('More bytes than the buffer can hold')
+
+        self._received += nbytes
+
+        if self.collect_stats:
+            self._stats.bytes_received += nbytes
 
-    def _parse(self, bytes chunk, size_t index):
-        cdef size_t idx, buffer_start, chunk_len
+        index = self._carry
+        self._carry = 0
+
+        return self._run(self._read_buffer,
+                         <const Byte *> PyByteArray_AS_STRING(self._read_buffer),
+                         index, 0, index + nbytes)
+
+    def resume(self):
+        """Continue parsing the input retained when a target paused the
+        parser.
+        """
+
+        cdef object chunk
+        cdef bytes data
+        cdef const Byte *chunk_ptr
+        cdef size_t index, end
+
+        self.pause_reason = None
+
+        if self._retained is None:
+            return 0
+
+        chunk = self._retained
+        index = self._retained_index
+        end = self._retained_end
+
+        self._retained = None
+        self._retained_index = 0
+        self._retained_end = 0
+
+        if chunk is self._leftover_buffer or chunk is self._read_buffer:
+            chunk_ptr = <const Byte *> PyByteArray_AS_STRING(chunk)
+        elif type(chunk) is bytes:
+            data = chunk
+            chunk_ptr = <const Byte *> data
+        else:
+            # a buffer given to parse_buffer()
+            return self._parse_buffer(chunk, index, end)
+
+        # everything before index has already been passed on
+        return self._run(chunk, chunk_ptr, index, index, end)
+
+    def parse_buffer(self, object buffer):
+        """Parse the whole content of an object supporting the buffer
+        protocol (e.g. a memory mapped file) at once. The targets receive
+        memoryview slices of the buffer instead of copies.
+        """
+
+        cdef size_t size = len(buffer)
+
+        if size == 0 or self.state == ParserState.PS_END:
+            return 0
+
+        if self._leftover_buffer or self._carry:
+            # the buffer can't be parsed in place after earlier data
+            return self.data_received(bytes(buffer))
+
+        self._received += size
+
+        if self.collect_stats:
+            self._stats.bytes_received += size
+
+        return self._parse_buffer(buffer, 0, size)
+
+    cdef _parse_buffer(self, object buffer, size_t index, size_t end):
+        cdef const Byte[::1] view = buffer
+
+        self._emit_view = memoryview(buffer)
+        try:
+            return self._run(buffer, &view[0], index, index, end)
+        finally:
+            self._emit_view = None
+
+    cdef _run(self, object chunk, const Byte *chunk_ptr, size_t index,
+              size_t buffer_start, size_t chunk_len):
+        if not self.profiling:
+            return self._parse(chunk, chunk_ptr, index, buffer_start,
+                               chunk_len)
+
+        self._profile_state = self.state
+        self._profile_mark = perf_counter()
+
+        result = self._parse(chunk, chunk_ptr, index, buffer_start, chunk_len)
+
+        self._profile_flush()
+
+        return result
+
+    cdef _parse(self, object chunk, const Byte *chunk_ptr, size_t index,
+                size_t buffer_start, size_t chunk_len):
+        # parses chunk[index:chunk_len], chunk[buffer_start:index] being the
+        # data which has not been passed on yet
+        cdef size_t idx
         cdef size_t match_start, skip_count, matched_length
         cdef Byte byte
-        cdef const Byte *chunk_ptr
+        cdef double started = 0, elapsed
 
-        chunk_ptr = chunk
-        chunk_len = len(chunk)
-        buffer_start = 0
+        # offset of the chunk in the request body, which it ends
+        cdef unsigned long long offset = self._received - chunk_len
 
         idx = index
         while idx < chunk_len:
             byte = chunk_ptr[idx]
 
+            if self.profiling and self.state != self._profile_state:
+                self._profile_flush()
+
             if self.state == ParserState.PS_START:
                 if byte != Constants.Hyphen:
                     return ErrorGroup.Delimiting + 1
@@ -211,7 +916,10 @@ cdef class _Parser:
                 if buffer_start != 0:
                     return ErrorGroup.Delimiting + 4
                 # ensure we have read correct starting delimiter
-                if b'\r\n' + chunk[buffer_start: idx + 1] != self.delimiter_finder.target:
+                if b'\r\n' + PyBytes_FromStringAndSize(
+                        <const char *> chunk_ptr + buffer_start,
+                        idx + 1 - buffer_start) != \
+                        self.delimiter_finder.target:
                     return ErrorGroup.Delimiting + 5
 
                 buffer_start = idx + 1
@@ -225,15 +933,25 @@ cdef class _Parser:
                 if byte != Constants.LF:
                     return ErrorGroup.PartHeaders + 1
 
-                value, params = cgi.parse_header(
-                    chunk[buffer_start: idx + 1].decode('utf-8'))
+                if self.profiling:
+                    self._profile_flush()
 
-                if value.startswith('Content-Disposition') and \
-                        value.endswith('form-data'):
-                    name = params.get('name')
-                    if name:
-                        part = self._part_for(name) or self.default_part
-                        self.set_active_part(part, params.get('filename'))
+                if self.collect_stats or self.profiling:
+                    started = perf_counter()
+
+                self._on_header(PyBytes_FromStringAndSize(
+                    <const char *> chunk_ptr + buffer_start,
+                    idx + 1 - buffer_start).decode('utf-8'))
+
+                if self.collect_stats or self.profiling:
+                    elapsed = perf_counter() - started
+
+                    if self.collect_stats:
+                        self._stats.header_seconds += elapsed
+
+                    if self.profiling:
+                        self._header_seconds += elapsed
+                        self._profile_mark = perf_counter()
 
                 buffer_start = idx + 1
 
@@ -248,6 +966,24 @@ cdef class _Parser:
                 if byte != Constants.LF:
                     return ErrorGroup.PartHeaders + 2
 
+                self.body_offset = offset + idx + 1
+
+                # the part starts once all of its headers are known
+                if self._part_name is not None:
+                    part = self._part_for(self._part_name)
+                    if part is None:
+                        part = self._new_part(self._part_name,
+                                              self._part_filename,
+                                              self._part_headers)
+                    self.set_active_part(part, self._part_name,
+                                         self._part_filename,
+                                         self._part_headers)
+
+                    self._part_name = None
+                    self._part_filename = None
+
+                self._part_headers = {}
+
                 buffer_start = idx + 1
 
                 self.state = ParserState.PS_READING_BODY
@@ -256,6 +992,9 @@ cdef class _Parser:
                 self.delimiter_finder.feed(byte)
                 self.ender_finder.feed(byte)
 
+                if self.collect_stats:
+                    self._stats.bytes_fed += 1
+
                 if self.delimiter_finder.found():
                     self.state = ParserState.PS_READING_HEADER
 
@@ -264,14 +1003,29 @@ cdef class _Parser:
                     match_start = idx + 1 - self.delimiter_length
 
                     if match_start >= buffer_start:
-                        self.on_body(chunk[buffer_start: match_start])
+                        self._emit(chunk, chunk_ptr, buffer_start, match_start)
 
                         buffer_start = idx + 1
                     else:
                         return ErrorGroup.Internal + 2
 
+                    self.body_end = offset + match_start
+                    self.part_offset = self.body_end + 2
+
                     self.unset_active_part()
                     self.delimiter_finder.reset()
+                    # the ender shares its prefix with the delimiter and
+                    # must not carry a stale partial match into the next part
+                    self.ender_finder.reset()
+
+                    # the rest of the chunk is kept as it is until resume()
+                    if self.pause_reason is not None and \
+                            self.state != ParserState.PS_END and \
+                            idx + 1 < chunk_len:
+                        self._retained = chunk
+                        self._retained_index = idx + 1
+                        self._retained_end = chunk_len
+                        return 0
 
                 elif self.ender_finder.found():
                     self.state = ParserState.PS_END
@@ -281,10 +1035,12 @@ cdef class _Parser:
                     match_start = idx + 1 - self.ender_length
 
                     if match_start >= buffer_start:
-                         self.on_body(chunk[buffer_start: match_start])
+                        self._emit(chunk, chunk_ptr, buffer_start, match_start)
                     else:
                         return ErrorGroup.Internal + 4
 
+                    self.body_end = offset + match_start
+
                     buffer_start = idx + 1
 
                     self.unset_active_part()
@@ -295,13 +1051,21 @@ cdef class _Parser:
                     # The idea is to skip all data not containing
                     # delimiter starting sequence '\r\n--' when
                     # we are not already in the middle of potential delimiter
+                    # or ender (which goes on after the delimiter fails to
+                    # match at its final '-')
 
-                    if self.delimiter_finder.inactive():
+                    if self.delimiter_finder.inactive() and \
+                            self.ender_finder.inactive():
                         skip_count = self.rewind_fast_forward(
                             chunk_ptr, idx + 1, chunk_len-1)
                         idx += skip_count
 
+                        if self.collect_stats:
+                            self._stats.bytes_skipped += skip_count
+
             elif self.state == ParserState.PS_END:
+                if chunk is self._leftover_buffer:
+                    self._leftover_buffer = None
                 return 0
             else:
                 return ErrorGroup.Internal + 5
@@ -317,12 +1081,39 @@ cdef class _Parser:
             matched_length = max(self.delimiter_finder.matched_length(),
                                  self.ender_finder.matched_length())
             match_start = idx - matched_length
-            if match_start >= buffer_start + Constants.MinFileBodyChunkSize:
-                self.on_body(chunk[buffer_start: match_start])
+            if self.active_part is None or self.active_part.discards():
+                # nothing to keep except a potential partial delimiter
+                buffer_start = match_start
+            elif match_start >= buffer_start + \
+                    Constants.MinFileBodyChunkSize:
+                self._emit(chunk, chunk_ptr, buffer_start, match_start)
                 buffer_start = match_start
 
         if idx - buffer_start > 0:
-            self._leftover_buffer = chunk[buffer_start: idx]
+            if chunk is self._read_buffer:
+                # kept at the front of the read buffer, where the next read
+                # is appended to it
+                memmove(<char *> chunk_ptr, chunk_ptr + buffer_start,
+                        idx - buffer_start)
+                self._carry = idx - buffer_start
+
+                if self.collect_stats:
+                    self._stats.leftover_copies += 1
+                    self._stats.leftover_bytes += idx - buffer_start
+            elif chunk is self._leftover_buffer:
+                # dropping the head of a bytearray does not move its contents
+                del chunk[:buffer_start]
+            else:
+                # the input may be referenced elsewhere, e.g. a bytearray
+                # given to parse_buffer(), and so can't be trimmed
+                self._leftover_buffer = PyByteArray_FromStringAndSize(
+                    <const char *> chunk_ptr + buffer_start, idx - buffer_start)
+
+                if self.collect_stats:
+                    self._stats.leftover_copies += 1
+                    self._stats.leftover_bytes += idx - buffer_start
+        elif chunk is self._leftover_buffer:
+            self._leftover_buffer = None
 
         return 0
 
@@ -0,0 +1,904 @@
+"""Pure Python implementation of the parser engine.
+
+It exposes the same _Parser interface as the Cython engine in _parser.pyx and
+is used on PyPy (where calling into C extensions is slow) or when the compiled
+extension is not available. Instead of feeding the body byte by byte into
+finders it searches for delimiters using bytes.find, which keeps the hot loop
+short and JIT-friendly.
+"""
+
+from fnmatch import fnmatchcase
+from time import perf_counter
+
+from streaming_form_data.targets import NullTarget
+
+
+Hyphen = 45
+CR = 13
+LF = 10
+MinFileBodyChunkSize = 1024
+ReadBufferSize = 65536
+
+# error groups, same values as the Cython engine uses
+Internal = 100
+Delimiting = 200
+PartHeaders = 300
+
+
+(PS_START,
+ PS_STARTING_BOUNDARY, PS_READING_BOUNDARY, PS_ENDING_BOUNDARY,
+ PS_READING_HEADER, PS_ENDING_HEADER, PS_ENDED_HEADER, PS_ENDING_ALL_HEADERS,
+ PS_READING_BODY,
+ PS_END) = range(10)
+
+# names used for reporting, in parser state order
+STATE_NAMES = (
+    'start',
+    'starting_boundary', 'reading_boundary', 'ending_boundary',
+    'reading_header', 'ending_header', 'ended_header', 'ending_all_headers',
+    'reading_body',
+    'end',
+)
+
+TA_START, TA_DATA_RECEIVED, TA_FINISH = range(3)
+
+TARGET_ACTION_NAMES = ('start', 'data_received', 'finish')
+
+STATS_KEYS = (
+    'bytes_received', 'bytes_fed', 'bytes_skipped',
+    'leftover_copies', 'leftover_bytes',
+    'parts', 'body_chunks', 'body_bytes', 'body_chunk_min', 'body_chunk_max',
+    'header_seconds', 'target_seconds',
+)
+
+
+def parse_header(line):
+    """Value and parameters of a header like Content-Type or
+    Content-Disposition, parsed the same way as by cgi.parse_header().
+    """
+
+    if '"' in line:
+        parts = _split_params(line)
+    else:
+        parts = line.split(';')
+
+    params = {}
+    for part in parts[1:]:
+        name, separator, value = part.partition('=')
+        if separator:
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+            params[name.strip().lower()] = value
+
+    return parts[0].strip(), params
+
+
+def _split_params(line):
+    # split the header at the semicolons which are not in quoted strings
+    parts = []
+
+    start = 0
+    while True:
+        end = line.find(';', start)
+        while end > start and (line.count('"', start, end) -
+                               line.count('\\"', start, end)) % 2:
+            end = line.find(';', end + 1)
+
+        if end < 0:
+            parts.append(line[start:])
+            return parts
+
+        parts.append(line[start:end])
+        start = end + 1
+
+
+def find_all(buffer, target, start, end):
+    """Offsets of the occurrences of target starting in [start, end) in a
+    bytes-like object with a find() function. Unlike with the compiled
+    parser, threads searching concurrently don't run in parallel.
+    """
+
+    # occurrences starting before end may continue after it
+    limit = min(end + len(target) - 1, len(buffer))
+    offsets = []
+
+    offset = buffer.find(target, start, limit)
+    while offset >= 0:
+        offsets.append(offset)
+        offset = buffer.find(target, offset + 1, limit)
+
+    return offsets
+
+
+class Part:
+    """One part of a multipart/form-data request
+    """
+
+    def __init__(self, name, target, expected=False):
+        self.name = name
+        self.target = target
+
+        # callable receiving the body chunks, None when they are discarded
+        self._sink = None
+
+        # whether the part has been received completely at least once
+        self.done = False
+
+        # whether the part has been registered, as opposed to parts created
+        # for unexpected names
+        self.expected = expected
+
+    def set_multipart_filename(self, value):
+        self.target.multipart_filename = value
+
+    def start(self):
+        self.target.start()
+        self.target._started = True
+
+        if type(self.target) is NullTarget:
+            self._sink = None
+        else:
+            self._sink = self.target.data_received
+
+    def discards(self):
+        return self._sink is None
+
+    def data_received(self, chunk):
+        # returns the value the target asks the parser to pause with, if any
+        if self._sink is not None:
+            return self._sink(chunk)
+
+    def finish(self):
+        self._sink = None
+
+        self.target.finish()
+        self.target._finished = True
+
+        self.done = True
+
+
+class _Parser:
+    def __init__(self, delimiter, ender, collect_stats=False, profile=False,
+                 stop_when_done=False, on_part_begin=None, on_part_end=None,
+                 on_all_registered_complete=None):
+        if len(delimiter) < 1 or len(ender) < 1:
+            raise ValueError('Empty values not allowed')
+
+        self.delimiter = delimiter
+        self.ender = ender
+
+        self.delimiter_length = len(delimiter)
+        self.ender_length = len(ender)
+
+        # common beginning of the delimiter and the ender: '\r\n--boundary'
+        self.prefix = delimiter[:-2]
+
+        self.state = PS_START
+
+        self.expected_parts = []
+
+        self.active_part = None
+        self.default_part = Part('_default', NullTarget())
+
+        # name the active part has been sent with
+        self._active_name = None
+
+        # part being described by the headers which are currently parsed
+        self._part_name = None
+        self._part_filename = None
+        self._part_headers = {}
+
+        # optional callbacks notified about the progress of the whole request
+        self.on_part_begin = on_part_begin
+        self.on_part_end = on_part_end
+        self.on_all_registered_complete = on_all_registered_complete
+
+        # (pattern, factory) pairs creating a new target for every
+        # occurrence of a part whose name matches the pattern and has not
+        # been registered
+        self.factories = []
+
+        self._leftover_buffer = None
+
+        # buffer handed out by get_buffer() for reading data into, which
+        # starts with the _carry bytes left over from the previous read
+        self._read_buffer = None
+        self._carry = 0
+
+        # whether the buffer being parsed by parse_buffer() is passed on to
+        # the targets in memoryview slices instead of copies
+        self._zero_copy = False
+
+        # stop parsing once every registered part has been received
+        self.stop_when_done = stop_when_done
+        self._parts_pending = 0
+
+        # value returned by a target's data_received to pause the parser,
+        # and the input left unparsed (from _retained_index on) until
+        # resume()
+        self.pause_reason = None
+        self._retained = None
+        self._retained_index = 0
+        self._retained_end = 0
+
+        # offsets in the request body of the delimiter line starting the
+        # current part, of its data and of the end of the data of the last
+        # part
+        self.part_offset = 0
+        self.body_offset = 0
+        self.body_end = 0
+        self._received = 0
+
+        self.collect_stats = collect_stats
+        self.reset_stats()
+
+        self.profiling = profile
+        self.reset_profile()
+
+    def reset(self, delimiter, ender):
+        """Bring the parser back to its initial state, possibly for another
+        delimiter.
+        """
+
+        if len(delimiter) < 1 or len(ender) < 1:
+            raise ValueError('Empty values not allowed')
+
+        self.delimiter = delimiter
+        self.ender = ender
+
+        self.delimiter_length = len(delimiter)
+        self.ender_length = len(ender)
+
+        self.prefix = delimiter[:-2]
+
+        self.state = PS_START
+
+        del self.expected_parts[:]
+        del self.factories[:]
+        self._parts_pending = 0
+
+        self.active_part = None
+        self._active_name = None
+
+        self._part_name = None
+        self._part_filename = None
+        self._part_headers = {}
+
+        self._leftover_buffer = None
+        self._carry = 0
+
+        self.pause_reason = None
+        self._retained = None
+        self._retained_index = 0
+        self._retained_end = 0
+
+        # offsets in the request body of the delimiter line starting the
+        # current part, of its data and of the end of the data of the last
+        # part
+        self.part_offset = 0
+        self.body_offset = 0
+        self.body_end = 0
+        self._received = 0
+
+        self.reset_stats()
+        self.reset_profile()
+
+    @property
+    def stats(self):
+        return dict(self._stats)
+
+    def reset_stats(self):
+        self._stats = dict.fromkeys(STATS_KEYS, 0)
+
+    @property
+    def profile(self):
+        return {
+            'states': dict(zip(STATE_NAMES, self._state_seconds)),
+            'headers': self._header_seconds,
+            'targets': {name: dict(zip(TARGET_ACTION_NAMES, seconds))
+                        for name, seconds in self._target_seconds.items()},
+        }
+
+    def reset_profile(self):
+        self._profile_state = self.state
+        self._profile_mark = 0.0
+        self._state_seconds = [0.0] * len(STATE_NAMES)
+        self._header_seconds = 0.0
+        self._target_seconds = {}
+
+    def _profile_flush(self):
+        now = perf_counter()
+        self._state_seconds[self._profile_state] += now - self._profile_mark
+        self._profile_mark = now
+        self._profile_state = self.state
+
+    def _call_target(self, action, value):
+        if self.profiling:
+            self._profile_flush()
+
+        started = perf_counter()
+        result = None
+
+        if action == TA_START:
+            self.active_part.start()
+        elif action == TA_DATA_RECEIVED:
+            result = self.active_part.data_received(value)
+        else:
+            self.active_part.finish()
+
+        elapsed = perf_counter() - started
+
+        if self.collect_stats:
+            self._stats['target_seconds'] += elapsed
+
+        if self.profiling:
+            seconds = self._target_seconds.get(self.active_part.name)
+            if seconds is None:
+                seconds = [0.0, 0.0, 0.0]
+                self._target_seconds[self.active_part.name] = seconds
+            seconds[action] += elapsed
+
+            self._profile_mark = perf_counter()
+
+        return result
+
+    def register(self, name, target):
+        if not isinstance(name, str):
+            raise TypeError('Part name must be a str')
+
+        if not self._part_for(name):
+            self.expected_parts.append(Part(name, target, True))
+            self._parts_pending += 1
+
+    def register_factory(self, pattern, factory):
+        if not isinstance(pattern, str):
+            raise TypeError('Part name pattern must be a str')
+
+        self.factories.append((pattern, factory))
+
+    @property
+    def finished(self):
+        return self.state == PS_END
+
+    @property
+    def retained(self):
+        # number of received bytes left unparsed while paused
+        if self._retained is None:
+            return 0
+        return self._retained_end - self._retained_index
+
+    def set_active_part(self, part, name, filename, headers):
+        self.active_part = part
+        self._active_name = name
+        self.active_part.set_multipart_filename(filename)
+
+        if self.collect_stats:
+            self._stats['parts'] += 1
+
+        if self.on_part_begin is not None:
+            self.on_part_begin(name, filename, headers)
+
+        if self.collect_stats or self.profiling:
+            self._call_target(TA_START, None)
+        else:
+            self.active_part.start()
+
+    def unset_active_part(self):
+        part = self.active_part
+
+        if part:
+            first_time = not part.done
+
+            if self.collect_stats or self.profiling:
+                self._call_target(TA_FINISH, None)
+            else:
+                part.finish()
+
+            if self.on_part_end is not None:
+                self.on_part_end(self._active_name, part.target)
+
+            if first_time and part.expected:
+                self._parts_pending -= 1
+
+                if self._parts_pending == 0:
+                    if self.on_all_registered_complete is not None:
+                        self.on_all_registered_complete()
+
+                    if self.stop_when_done:
+                        self.state = PS_END
+        self.active_part = None
+
+    def _emit(self, view, start, end):
+        # the bytes object is not even created when the part discards it
+        if end > start and self.active_part and \
+                not self.active_part.discards():
+            if self._zero_copy:
+                self.on_body(view[start:end])
+            else:
+                self.on_body(bytes(view[start:end]))
+
+    def on_body(self, value):
+        size = len(value)
+
+        if self.active_part and size > 0:
+            if self.collect_stats:
+                stats = self._stats
+                stats['body_chunks'] += 1
+                stats['body_bytes'] += size
+                if stats['body_chunk_min'] == 0 or \
+                        size < stats['body_chunk_min']:
+                    stats['body_chunk_min'] = size
+                if size > stats['body_chunk_max']:
+                    stats['body_chunk_max'] = size
+
+            if self.collect_stats or self.profiling:
+                result = self._call_target(TA_DATA_RECEIVED, value)
+            else:
+                result = self.active_part.data_received(value)
+
+            if result is not None:
+                self.pause_reason = result
+
+    def _on_header(self, line):
+        value, params = parse_header(line)
+
+        if value.startswith('Content-Disposition') and \
+                value.endswith('form-data'):
+            name = params.get('name')
+            if name:
+                self._part_name = name
+                self._part_filename = params.get('filename')
+
+        key, separator, value = line.partition(':')
+        if separator:
+            self._part_headers[key.strip().lower()] = value.strip()
+
+    def _new_part(self, name, filename, headers):
+        for pattern, factory in self.factories:
+            if fnmatchcase(name, pattern):
+                return Part(name, factory(name, filename, headers))
+
+        return self.default_part
+
+    def _part_for(self, name):
+        for part in self.expected_parts:
+            if part.name == name:
+                return part
+
+    def data_received(self, data):
+        if not data or self.state == PS_END:
+            return 0
+
+        self._received += len(data)
+
+        if self.collect_stats:
+            self._stats['bytes_received'] += len(data)
+
+        if self._carry:
+            self._leftover_buffer = self._read_buffer[:self._carry]
+            self._carry = 0
+
+        # see _parser.pyx on why the leftover is extended in place
+        if self._leftover_buffer:
+            chunk = self._leftover_buffer
+            index = len(chunk)
+            chunk += data
+
+            if self.collect_stats:
+                self._stats['leftover_copies'] += 1
+                self._stats['leftover_bytes'] += len(data)
+        else:
+            chunk = data
+            index = 0
+
+        return self._run(chunk, index, 0, len(chunk))
+
+    def get_buffer(self, size_hint=-1):
+        """Writable buffer of at least size_hint bytes to read data into,
+        as in asyncio.BufferedProtocol. The data is parsed in place by
+        buffer_updated().
+        """
+
+        if self._leftover_buffer:
+            # carried over from data_received()
+            self._carry = len(self._leftover_buffer)
+
+        size = self._carry + max(size_hint, ReadBufferSize)
+
+        # The buffer handed out previously may still be referenced, and so
+        # can't be resized: a new one is allocated instead.
+        if self._read_buffer is None or len(self._read_buffer) < size:
+            buffer = bytearray(size)
+            if self._carry and not self._leftover_buffer:
+                buffer[:self._carry] = self._read_buffer[:self._carry]
+            self._read_buffer = buffer
+
+        if self._leftover_buffer:
+            self._read_buffer[:self._carry] = self._leftover_buffer
+            self._leftover_buffer = None
+
+        return memoryview(self._read_buffer)[self._carry:]
+
+    def written(self, nbytes):
+        """Copy of the nbytes written into the buffer returned by
+        get_buffer(), to be taken before calling buffer_updated().
+        """
+
+        if nbytes <= 0 or self._read_buffer is None:
+            return b''
+
+        return bytes(self._read_buffer[self._carry:self._carry + nbytes])
+
+    def buffer_updated(self, nbytes):
+        if nbytes <= 0 or self.state == PS_END:
+            return 0
+
+        if self._read_buffer is None or \
+                self._carry + nbytes > len(self._read_buffer):
+            raise ValueError('More bytes than the buffer can hold')
+
+        self._received += nbytes
+
+        if self.collect_stats:
+            self._stats['bytes_received'] += nbytes
+
+        index = self._carry
+        self._carry = 0
+
+        return self._run(self._read_buffer, index, 0, index + nbytes)
+
+    def resume(self):
+        """Continue parsing the input retained when a target paused the
+        parser.
+        """
+
+        self.pause_reason = None
+
+        if self._retained is None:
+            return 0
+
+        chunk = self._retained
+        index = self._retained_index
+        end = self._retained_end
+
+        self._retained = None
+        self._retained_index = 0
+        self._retained_end = 0
+
+        if chunk is not self._leftover_buffer and \
+                chunk is not self._read_buffer and type(chunk) is not bytes:
+            # a buffer given to parse_buffer()
+            return self._parse_buffer(chunk, index, end)
+
+        # everything before index has already been passed on
+        return self._run(chunk, index, index, end)
+
+    def parse_buffer(self, buffer):
+        """Parse the whole content of a bytes-like object with a find()
+        function (e.g. a memory mapped file) at once. The targets receive
+        memoryview slices of the buffer instead of copies.
+        """
+
+        size = len(buffer)
+
+        if size == 0 or self.state == PS_END:
+            return 0
+
+        if self._leftover_buffer or self._carry:
+            # the buffer can't be parsed in place after earlier data
+            return self.data_received(bytes(buffer))
+
+        self._received += size
+
+        if self.collect_stats:
+            self._stats['bytes_received'] += size
+
+        return self._parse_buffer(buffer, 0, size)
+
+    def _parse_buffer(self, buffer, index, end):
+        self._zero_copy = True
+        try:
+            return self._run(buffer, index, index, end)
+        finally:
+            self._zero_copy = False
+
+    def _run(self, chunk, index, start, end):
+        if not self.profiling:
+            return self._parse(chunk, index, start, end)
+
+        self._profile_state = self.state
+        self._profile_mark = perf_counter()
+
+        result = self._parse(chunk, index, start, end)
+
+        self._profile_flush()
+
+        return result
+
+    def _parse(self, chunk, index, start, end):
+        # parses chunk[index:end], chunk[start:index] being the data which
+        # has not been passed on yet
+        if type(chunk) is bytearray:
+            # slices of a memoryview are copied only once into bytes
+            with memoryview(chunk) as view:
+                result, buffer_start = self._parse_view(chunk, view, index,
+                                                        start, end)
+
+            if self._retained is not None:
+                return result
+
+            if result == 0 and buffer_start < end:
+                if chunk is self._read_buffer:
+                    # kept at the front of the read buffer, where the next
+                    # read is appended to it
+                    self._carry = end - buffer_start
+                    chunk[:self._carry] = chunk[buffer_start:end]
+
+                    if self.collect_stats:
+                        self._stats['leftover_copies'] += 1
+                        self._stats['leftover_bytes'] += self._carry
+                elif chunk is self._leftover_buffer:
+                    del chunk[:buffer_start]
+                else:
+                    # see _parser.pyx
+                    self._leftover_buffer = bytearray(chunk[buffer_start:end])
+
+                    if self.collect_stats:
+                        self._stats['leftover_copies'] += 1
+                        self._stats['leftover_bytes'] += end - buffer_start
+            elif chunk is self._leftover_buffer:
+                self._leftover_buffer = None
+            return result
+
+        view = memoryview(chunk) if self._zero_copy else chunk
+        result, buffer_start = self._parse_view(chunk, view, index, start,
+                                                end)
+
+        if self._retained is not None:
+            return result
+
+        if result == 0 and buffer_start < len(chunk):
+            self._leftover_buffer = bytearray(chunk[buffer_start:])
+
+            if self.collect_stats:
+                self._stats['leftover_copies'] += 1
+                self._stats['leftover_bytes'] += len(chunk) - buffer_start
+
+        return result
+
+    def _partial_match(self, chunk, start, end):
+        # Position of the longest suffix of chunk[:end] starting at or after
+        # start which is a beginning of the delimiter, or end.
+        pos = chunk.find(b'\r', start, end)
+        while pos >= 0:
+            if self.prefix.startswith(chunk[pos:end]):
+                return pos
+            pos = chunk.find(b'\r', pos + 1, end)
+        return end
+
+    def _parse_view(self, chunk, view, index, start, chunk_len):
+        # chunk is used for searching, view for slicing out values.
+        # Returns the error code and the start of the unprocessed data.
+
+        buffer_start = start
+
+        # offset of the chunk in the request body, which it ends
+        offset = self._received - chunk_len
+
+        prefix = self.prefix
+        prefix_len = len(prefix)
+
+        pos = index
+
+        if self.state == PS_READING_BODY:
+            # a delimiter may have started at the end of the previous chunk
+            pos = max(0, index - self.ender_length + 1)
+
+        # body bytes before this position have already been counted as
+        # skipped by the scanner
+        counted = index
+
+        while pos < chunk_len:
+            state = self.state
+
+            if self.profiling and state != self._profile_state:
+                self._profile_flush()
+
+            if state == PS_READING_BODY:
+                match_start = chunk.find(prefix, pos, chunk_len)
+
+                if match_start < 0:
+                    # keep the beginning of a delimiter which continues in
+                    # the next chunk
+                    match_start = self._partial_match(
+                        chunk, max(pos, chunk_len - prefix_len + 1),
+                        chunk_len)
+
+                    if self.collect_stats:
+                        self._stats['bytes_skipped'] += \
+                            chunk_len - max(pos, counted)
+
+                    if not self.active_part or \
+                            self.active_part.discards():
+                        buffer_start = max(buffer_start, match_start)
+                    elif match_start >= buffer_start + MinFileBodyChunkSize:
+                        self._emit(view, buffer_start, match_start)
+                        buffer_start = match_start
+
+                    pos = chunk_len
+                    break
+
+                match_end = match_start + prefix_len
+
+                if match_end + 2 > chunk_len:
+                    # not enough data to decide on the delimiter type yet
+                    if self.collect_stats:
+                        self._stats['bytes_skipped'] += \
+                            chunk_len - max(pos, counted)
+
+                    if not self.active_part or \
+                            self.active_part.discards():
+                        buffer_start = match_start
+                    elif match_start >= buffer_start + MinFileBodyChunkSize:
+                        self._emit(view, buffer_start, match_start)
+                        buffer_start = match_start
+
+                    pos = chunk_len
+                    break
+
+                suffix = chunk[match_end:match_end + 2]
+
+                if suffix == b'\r\n':
+                    self.state = PS_READING_HEADER
+                    end = match_end + 2
+                elif suffix == b'--':
+                    self.state = PS_END
+                    end = match_end + 2
+                else:
+                    end = match_start + 1
+
+                if self.collect_stats and end > counted:
+                    self._stats['bytes_skipped'] += end - max(pos, counted)
+                    counted = end
+
+                if self.state == PS_READING_BODY:
+                    pos = end
+                    continue
+
+                self._emit(view, buffer_start, match_start)
+
+                buffer_start = pos = end
+
+                self.body_end = offset + match_start
+                if self.state == PS_READING_HEADER:
+                    self.part_offset = self.body_end + 2
+
+                self.unset_active_part()
+
+                # the rest of the chunk is kept as it is until resume()
+                if self.pause_reason is not None and \
+                        self.state != PS_END and end < chunk_len:
+                    self._retained = chunk
+                    self._retained_index = end
+                    self._retained_end = chunk_len
+                    return 0, end
+
+            elif state == PS_READING_HEADER:
+                pos = chunk.find(b'\r', pos, chunk_len)
+                if pos < 0:
+                    pos = chunk_len
+                    break
+
+                self.state = PS_ENDING_HEADER
+                pos += 1
+
+            elif state == PS_ENDING_HEADER:
+                if chunk[pos] != LF:
+                    return PartHeaders + 1, buffer_start
+
+                if self.profiling:
+                    self._profile_flush()
+
+                if self.collect_stats or self.profiling:
+                    started = perf_counter()
+
+                self._on_header(
+                    bytes(view[buffer_start:pos + 1]).decode('utf-8'))
+
+                if self.collect_stats or self.profiling:
+                    elapsed = perf_counter() - started
+
+                    if self.collect_stats:
+                        self._stats['header_seconds'] += elapsed
+
+                    if self.profiling:
+                        self._header_seconds += elapsed
+                        self._profile_mark = perf_counter()
+
+                buffer_start = pos + 1
+
+                self.state = PS_ENDED_HEADER
+                pos += 1
+
+            elif state == PS_ENDED_HEADER:
+                if chunk[pos] == CR:
+                    self.state = PS_ENDING_ALL_HEADERS
+                else:
+                    self.state = PS_READING_HEADER
+                pos += 1
+
+            elif state == PS_ENDING_ALL_HEADERS:
+                if chunk[pos] != LF:
+                    return PartHeaders + 2, buffer_start
+
+                self.body_offset = offset + pos + 1
+
+                # the part starts once all of its headers are known
+                if self._part_name is not None:
+                    part = self._part_for(self._part_name)
+                    if part is None:
+                        part = self._new_part(self._part_name,
+                                              self._part_filename,
+                                              self._part_headers)
+                    self.set_active_part(part, self._part_name,
+                                         self._part_filename,
+                                         self._part_headers)
+
+                    self._part_name = None
+                    self._part_filename = None
+
+                self._part_headers = {}
+
+                buffer_start = pos + 1
+
+                self.state = PS_READING_BODY
+                pos += 1
+
+            elif state == PS_START:
+                if chunk[pos] != Hyphen:
+                    return Delimiting + 1, buffer_start
+
+                self.state = PS_STARTING_BOUNDARY
+                pos += 1
+
+            elif state == PS_STARTING_BOUNDARY:
+                if chunk[pos] != Hyphen:
+                    return Delimiting + 2, buffer_start
+
+                self.state = PS_READING_BOUNDARY
+                pos += 1
+
+            elif state == PS_READING_BOUNDARY:
+                pos = chunk.find(b'\r', pos, chunk_len)
+                if pos < 0:
+                    pos = chunk_len
+                    break
+
+                self.state = PS_ENDING_BOUNDARY
+                pos += 1
+
+            elif state == PS_ENDING_BOUNDARY:
+                if chunk[pos] != LF:
+                    return Delimiting + 3, buffer_start
+                if buffer_start != 0:
+                    return Delimiting + 4, buffer_start
+                # ensure we have read correct starting delimiter
+                if b'\r\n' + bytes(view[buffer_start:pos + 1]) != \
+                        self.delimiter:
+                    return Delimiting + 5, buffer_start
+
+                buffer_start = pos + 1
+
+                self.state = PS_READING_HEADER
+                pos += 1
+
+            elif state == PS_END:
+                return 0, chunk_len
+            else:
+                return Internal + 5, buffer_start
+
+        if self.state == PS_END:
+            return 0, chunk_len
+
+        return 0, buffer_start
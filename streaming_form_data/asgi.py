@@ -0,0 +1,68 @@
+import inspect
+
+from streaming_form_data.parser import (ParseFailedException,
+                                        StreamingFormDataParser)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def scope_headers(scope):
+    """Request headers of an ASGI HTTP connection scope, as a dictionary."""
+
+    return {key.decode('latin-1'): value.decode('latin-1')
+            for key, value in scope['headers']}
+
+
+def create_parser(scope, **kwargs):
+    """StreamingFormDataParser for the request described by an ASGI scope.
+    Keyword arguments are passed on to StreamingFormDataParser.
+    """
+
+    return StreamingFormDataParser(scope_headers(scope), **kwargs)
+
+
+async def parse_body(receive, parser):
+    """Read the request body from an ASGI receive callable, and pass it on to
+    the parser:
+
+    >>> async def app(scope, receive, send):
+    ...     parser = create_parser(scope)
+    ...     parser.register('file', FileTarget('/tmp/upload.dat'))
+    ...     await parse_body(receive, parser)
+
+    The next message is only received once the parser is done with the
+    previous one, so the memory used does not depend on the size of the
+    request. Targets pausing the parser with an awaitable (which is what
+    calling an async data_received function returns) are waited for before
+    parsing goes on.
+
+    Raises ClientDisconnected if the client goes away before the whole body
+    has been received, and ParseFailedException if the body is invalid or
+    incomplete.
+    """
+
+    while True:
+        message = await receive()
+
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+
+        body = message.get('body')
+        if body:
+            parser.data_received(body)
+
+            while parser.paused:
+                reason = parser.pause_reason
+                if inspect.isawaitable(reason):
+                    await reason
+
+                parser.resume()
+
+        # the rest of the body is not needed once the parser is done
+        if not message.get('more_body', False) or parser.finished:
+            break
+
+    if not parser.finished:
+        raise ParseFailedException('Unexpected end of input')
@@ -0,0 +1,206 @@
+from collections import namedtuple
+import io
+import os
+import stat
+import uuid
+
+
+# Region of a regular file to be sent as is, e.g. using os.sendfile()
+FileSegment = namedtuple('FileSegment', ['file', 'offset', 'count'])
+
+
+def _quote(value):
+    # quoting of the parameters of Content-Disposition, like browsers do
+    return value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+
+def _size(value):
+    # number of bytes left in a value, None if unknown
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+
+    if not hasattr(value, 'read'):
+        return None
+
+    try:
+        return os.fstat(value.fileno()).st_size - value.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+
+    try:
+        position = value.tell()
+        size = value.seek(0, io.SEEK_END) - position
+        value.seek(position)
+        return size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def _fileno(value):
+    # file descriptor of a regular file, None for anything else
+    try:
+        fileno = value.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+    if not stat.S_ISREG(os.fstat(fileno).st_mode):
+        return None
+
+    return fileno
+
+
+class MultipartEncoder:
+    """Streaming multipart/form-data encoder, producing the body of a request
+    in chunks instead of building it in memory.
+
+    fields is a dictionary or a list of (name, value) pairs. A value is either
+    the value of a field, as str or bytes, or a (filename, content) or
+    (filename, content, content_type) tuple for files. The content of a file
+    is either bytes, a file object, read from its current position on, or an
+    iterable of bytes chunks such as a generator.
+
+    >>> encoder = MultipartEncoder({
+    ...     'name': 'hello world',
+    ...     'file': ('file.dat', open('file.dat', 'rb'), 'text/plain'),
+    ... })
+    >>> headers = {'Content-Type': encoder.content_type,
+    ...            'Content-Length': str(encoder.content_length)}
+    >>> for chunk in encoder:
+    ...     ...
+
+    The files and generators are consumed while encoding, so the body can
+    only be produced once.
+    """
+
+    def __init__(self, fields, boundary=None, chunk_size=65536):
+        if isinstance(fields, dict):
+            fields = fields.items()
+
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+
+        # (headers, content) of every part, the headers including the
+        # delimiter preceding them
+        self._parts = []
+
+        delimiter = b'--' + self.boundary.encode('utf-8') + b'\r\n'
+
+        for name, value in fields:
+            filename = content_type = None
+
+            if isinstance(value, tuple):
+                filename, value, *rest = value
+                if rest:
+                    content_type = rest[0]
+
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+
+            disposition = 'form-data; name="{}"'.format(_quote(name))
+            if filename is not None:
+                disposition += '; filename="{}"'.format(_quote(filename))
+
+            headers = 'Content-Disposition: ' + disposition + '\r\n'
+            if content_type is not None:
+                headers += 'Content-Type: ' + content_type + '\r\n'
+
+            self._parts.append(
+                (delimiter + headers.encode('utf-8') + b'\r\n', value))
+
+        self._ender = b'--' + self.boundary.encode('utf-8') + b'--\r\n'
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=' + self.boundary
+
+    @property
+    def content_length(self):
+        """Size of the body in bytes, or None if it is not known in advance
+        because of iterable contents.
+        """
+
+        length = len(self._ender)
+
+        for headers, content in self._parts:
+            size = _size(content)
+            if size is None:
+                return None
+
+            # the content is followed by CRLF
+            length += len(headers) + size + 2
+
+        return length
+
+    def segments(self):
+        """Produce the body as bytes chunks and FileSegments, the latter
+        describing the regions of regular files which can be sent without
+        reading them, e.g. using os.sendfile().
+        """
+
+        for headers, content in self._parts:
+            if isinstance(content, (bytes, bytearray, memoryview)):
+                if len(content) < self.chunk_size:
+                    # small values are sent along with their headers
+                    yield headers + content + b'\r\n'
+                else:
+                    yield headers
+                    yield content
+                    yield b'\r\n'
+                continue
+
+            yield headers
+
+            fileno = _fileno(content) if hasattr(content, 'read') else None
+
+            if fileno is not None:
+                offset = content.tell()
+                count = os.fstat(fileno).st_size - offset
+
+                if count > 0:
+                    yield FileSegment(content, offset, count)
+                    content.seek(offset + count)
+            elif hasattr(content, 'read'):
+                while True:
+                    chunk = content.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            else:
+                for chunk in content:
+                    if chunk:
+                        yield chunk
+
+            yield b'\r\n'
+
+        yield self._ender
+
+    def __iter__(self):
+        for segment in self.segments():
+            if not isinstance(segment, FileSegment):
+                yield segment
+                continue
+
+            segment.file.seek(segment.offset)
+            remaining = segment.count
+
+            while remaining > 0:
+                chunk = segment.file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise ValueError('File shrank while being encoded')
+
+                remaining -= len(chunk)
+                yield chunk
+
+    def to_bytes(self):
+        return b''.join(self)
+
+    def send(self, sock):
+        """Send the body over a connected socket, the regular files being
+        sent using socket.sendfile() (and so os.sendfile() where available).
+        """
+
+        for segment in self.segments():
+            if isinstance(segment, FileSegment):
+                sock.sendfile(segment.file, segment.offset, segment.count)
+            else:
+                sock.sendall(segment)
@@ -0,0 +1,310 @@
+from bisect import bisect_left
+from collections import namedtuple
+import json
+import mmap
+import os
+
+from streaming_form_data.parser import (ParseFailedException, find_all,
+                                        headers_for, parse_content_boundary,
+                                        parse_header)
+
+
+# Location of a single part in a stored request body. header_offset is the
+# offset of the first header line of the part, body_offset the offset of its
+# first byte of data.
+PartRecord = namedtuple('PartRecord', [
+    'name', 'filename', 'content_type', 'header_offset', 'body_offset',
+    'body_length'])
+
+# Value of a part returned by parse_bytes(), along with its filename and
+# headers
+Field = namedtuple('Field', ['value', 'filename', 'headers'])
+
+INDEX_VERSION = 1
+
+# size of the regions of the body searched for delimiters concurrently
+REGION_SIZE = 16 * 1024 * 1024
+
+
+def _part_headers(block):
+    # name, filename and headers of a part, parsed the same way as by the
+    # parser
+    name = filename = None
+    headers = {}
+
+    for line in block.decode('utf-8').split('\r\n'):
+        if line.startswith('Content-Disposition'):
+            value, params = parse_header(line)
+
+            if value.endswith('form-data') and params.get('name'):
+                name = params['name']
+                filename = params.get('filename')
+
+        key, separator, value = line.partition(':')
+        if separator:
+            headers[key.strip().lower()] = value.strip()
+
+    return name, filename, headers
+
+
+def _suffix(buffer, offset):
+    return buffer[offset:offset + 2]
+
+
+def _find_all(source, delimiter, start, end):
+    # offsets of the occurrences of delimiter starting in [start, end) in a
+    # buffer, or in the file at the given path
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file_:
+            with mmap.mmap(file_.fileno(), 0,
+                           access=mmap.ACCESS_READ) as mapping:
+                return find_all(mapping, delimiter, start, end)
+
+    return find_all(source, delimiter, start, end)
+
+
+def _parallel_finder(source, size, delimiter, executor, region_size):
+    # search the regions of the body concurrently, returns a function
+    # working like buffer.find(delimiter, offset)
+    futures = [executor.submit(_find_all, source, delimiter, start,
+                               min(start + region_size, size))
+               for start in range(0, size, region_size)]
+
+    offsets = []
+    for future in futures:
+        offsets.extend(future.result())
+
+    def find(offset):
+        index = bisect_left(offsets, offset)
+        if index == len(offsets):
+            return -1
+        return offsets[index]
+
+    return find
+
+
+def index_buffer(buffer, headers_or_boundary, executor=None,
+                 region_size=REGION_SIZE):
+    """Locate the parts of a request body held by a bytes-like object with a
+    find() function (e.g. a memory mapped file), and return a list of
+    PartRecords. None of the part data is copied: reading a part is a single
+    slice of the buffer, from body_offset to body_offset + body_length.
+
+    If executor (a concurrent.futures.ThreadPoolExecutor) is given, regions
+    of region_size bytes of the buffer are searched for delimiters
+    concurrently. The compiled parser searches without holding the GIL; with
+    the pure Python parser, threads give no speedup and index_file() should
+    be used with a ProcessPoolExecutor instead.
+    """
+
+    return _index(buffer, buffer, headers_or_boundary, executor, region_size)
+
+
+def _index(buffer, source, headers_or_boundary, executor, region_size):
+    boundary = parse_content_boundary(headers_for(headers_or_boundary))
+    delimiter = b'\r\n--' + boundary
+
+    find = None
+    if executor is not None and len(buffer) > region_size:
+        find = _parallel_finder(source, len(buffer), delimiter, executor,
+                                region_size)
+
+    return [PartRecord(name, filename, headers.get('content-type'),
+                       header_offset, body_offset, body_end - body_offset)
+            for name, filename, headers, header_offset, body_offset, body_end
+            in _parts(buffer, delimiter, find)]
+
+
+def _parts(buffer, delimiter, find=None):
+    # yields the name, filename, headers, header offset, body offset and body
+    # end offset of every part of the body
+    if find is None:
+        def find(offset):
+            return buffer.find(delimiter, offset)
+
+    # the body starts with the first delimiter, without its leading CRLF
+    if buffer[:len(delimiter)] != delimiter[2:] + b'\r\n':
+        raise ParseFailedException('Body does not start with the delimiter')
+
+    header_offset = len(delimiter)
+
+    while True:
+        end = find(header_offset)
+
+        # like for the parser, the boundary followed by anything else than
+        # CRLF or the final hyphens is part data
+        while end >= 0 and \
+                _suffix(buffer, end + len(delimiter)) not in (b'\r\n', b'--'):
+            end = find(end + 1)
+
+        if end < 0:
+            raise ParseFailedException('Unexpected end of input')
+
+        if buffer[header_offset:header_offset + 2] == b'\r\n':
+            headers_end = header_offset
+            body_offset = header_offset + 2
+        else:
+            headers_end = buffer.find(b'\r\n\r\n', header_offset, end + 2)
+            body_offset = headers_end + 4
+
+            if headers_end < 0 or body_offset > end:
+                raise ParseFailedException('Part headers are not terminated')
+
+        name, filename, headers = _part_headers(
+            buffer[header_offset:headers_end])
+
+        yield name, filename, headers, header_offset, body_offset, end
+
+        if _suffix(buffer, end + len(delimiter)) == b'--':
+            return
+
+        header_offset = end + len(delimiter) + 2
+
+
+def index_file(path, headers_or_boundary, index_path=None, executor=None,
+               region_size=REGION_SIZE):
+    """Index a request body stored in a file, see index_buffer(). The records
+    are also written to index_path if given, to be read back later using
+    load_index().
+
+    The regions of the file are searched in executor given the path of the
+    file, so a concurrent.futures.ProcessPoolExecutor can be used as well.
+    """
+
+    with open(path, 'rb') as file_:
+        try:
+            mapping = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            raise ParseFailedException('Unexpected end of input')
+
+    try:
+        records = _index(mapping, path, headers_or_boundary, executor,
+                         region_size)
+    finally:
+        mapping.close()
+
+    if index_path is not None:
+        save_index(records, index_path)
+
+    return records
+
+
+def save_index(records, path):
+    with open(path, 'w') as file_:
+        json.dump({'version': INDEX_VERSION,
+                   'parts': [list(record) for record in records]}, file_)
+
+
+def load_index(path):
+    with open(path) as file_:
+        index = json.load(file_)
+
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError('Unsupported index version')
+
+    return [PartRecord(*record) for record in index['parts']]
+
+
+def read_part(path, record):
+    """Read the data of the part described by record from the request body
+    stored in the file at path.
+    """
+
+    with open(path, 'rb') as file_:
+        file_.seek(record.body_offset)
+        return file_.read(record.body_length)
+
+
+def _deliver(buffer, target, records):
+    # pass the parts described by records on to a single target, in order
+    with memoryview(buffer) as view:
+        for record in records:
+            target.multipart_filename = record.filename
+
+            target.start()
+            target._started = True
+
+            if record.body_length:
+                target.data_received(
+                    view[record.body_offset:
+                         record.body_offset + record.body_length])
+
+            target.finish()
+            target._finished = True
+
+
+def dispatch_parts(buffer, records, targets, executor=None):
+    """Pass the parts of the request body held by buffer and described by
+    records on to the targets given in a dictionary by part name, the
+    targets receiving a single memoryview slice of the buffer each.
+
+    If executor (a concurrent.futures.ThreadPoolExecutor) is given, the
+    targets are run concurrently, each of them in a single task receiving
+    its parts in order. Parts without a target are skipped.
+    """
+
+    parts = {}
+    for record in records:
+        target = targets.get(record.name)
+        if target is not None:
+            parts.setdefault(id(target), (target, []))[1].append(record)
+
+    if executor is None:
+        for target, target_records in parts.values():
+            _deliver(buffer, target, target_records)
+        return
+
+    futures = [executor.submit(_deliver, buffer, target, target_records)
+               for target, target_records in parts.values()]
+
+    for future in futures:
+        future.result()
+
+
+def parse_parallel(buffer, headers_or_boundary, targets, executor=None,
+                   region_size=REGION_SIZE):
+    """Parse a complete request body held by buffer (e.g. a memory mapped
+    file) using executor, see index_buffer() and dispatch_parts(). Returns
+    the PartRecords of the body.
+
+    The targets run concurrently only as far as they release the GIL, as
+    when writing to files.
+    """
+
+    records = index_buffer(buffer, headers_or_boundary, executor,
+                           region_size)
+    dispatch_parts(buffer, records, targets, executor)
+
+    return records
+
+
+def parse_bytes(body, content_type):
+    """Parse a small request body received at once, given the value of the
+    Content-Type header of the request, and return a dictionary mapping part
+    names to lists of Fields.
+
+    >>> fields = parse_bytes(body, headers['Content-Type'])
+    >>> fields['name'][0].value.tobytes()
+    b'value'
+
+    No targets are involved: the values are memoryview slices of body, which
+    may be any object supporting the buffer protocol. Parts without a name are
+    skipped, like by the parser.
+    """
+
+    boundary = parse_content_boundary({'Content-Type': content_type})
+
+    fields = {}
+
+    with memoryview(body) as view:
+        # the parts are located using find(), which e.g. memoryviews lack
+        source = body if hasattr(body, 'find') else view.tobytes()
+
+        for name, filename, headers, _, start, end in _parts(
+                source, b'\r\n--' + boundary):
+            if name:
+                fields.setdefault(name, []).append(
+                    Field(view[start:end], filename, headers))
+
+    return fields
@@ -0,0 +1,195 @@
+from collections import deque
+
+from streaming_form_data.parser import (ParseFailedException,
+                                        StreamingFormDataParser)
+from streaming_form_data.targets import BaseTarget
+
+
+# Events queued by the parser while it is consuming one input chunk. Only the
+# data found in the current chunk is ever queued, nothing is buffered beyond
+# it.
+_BEGIN, _DATA, _END = range(3)
+
+
+class _QueueTarget(BaseTarget):
+    def __init__(self, events, part):
+        super().__init__()
+
+        self._events = events
+        self._part = part
+
+    def data_received(self, chunk):
+        self._events.append((_DATA, self._part, chunk))
+
+    def finish(self):
+        self._events.append((_END, self._part, None))
+
+
+class _Stream:
+    """Runs a StreamingFormDataParser on the input pulled by the consumer,
+    turning every part into a target which queues the events instead of
+    handling the data itself.
+    """
+
+    def __init__(self, headers):
+        self.events = deque()
+
+        self.parser = StreamingFormDataParser(headers)
+        self.parser.register_factory('*', self._new_target)
+
+    def _new_target(self, name, filename, headers):
+        part = self.part_class(self, name, filename, headers)
+        self.events.append((_BEGIN, part, None))
+
+        return _QueueTarget(self.events, part)
+
+    def feed(self, chunk):
+        self.parser.data_received(chunk)
+
+    def check_finished(self):
+        if not self.parser.finished:
+            raise ParseFailedException('Unexpected end of input')
+
+
+class _SyncStream(_Stream):
+    def __init__(self, headers, chunks):
+        super().__init__(headers)
+
+        self._chunks = iter(chunks)
+
+    def fill(self):
+        # feed input until there is at least one event to consume, returns
+        # False once the input is exhausted
+        while not self.events:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self.check_finished()
+                return False
+
+            self.feed(chunk)
+
+        return True
+
+    def parts(self):
+        while self.fill():
+            kind, part, _ = self.events.popleft()
+
+            # the remaining chunks of a part the consumer has moved on from
+            # are dropped
+            if kind == _BEGIN:
+                yield part
+
+
+class _AsyncStream(_Stream):
+    def __init__(self, headers, chunks):
+        super().__init__(headers)
+
+        self._chunks = chunks.__aiter__()
+
+    async def fill(self):
+        while not self.events:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self.check_finished()
+                return False
+
+            self.feed(chunk)
+
+        return True
+
+    async def parts(self):
+        while await self.fill():
+            kind, part, _ = self.events.popleft()
+
+            if kind == _BEGIN:
+                yield part
+
+
+class Part:
+    """A single part of the request, as yielded by iter_parts.
+
+    The part data is only available while the part is the current one: once
+    the next part has been requested, its remaining chunks are dropped.
+    """
+
+    def __init__(self, stream, name, filename, headers):
+        self.name = name
+        self.filename = filename
+        self.headers = headers
+
+        self._stream = stream
+        self._done = False
+
+    def _next_event(self):
+        # returns the next chunk of this part, or None at its end
+        events = self._stream.events
+
+        if not events or events[0][1] is not self:
+            self._done = True
+            return None
+
+        kind, _, chunk = events.popleft()
+        if kind == _END:
+            self._done = True
+            return None
+
+        return chunk
+
+    def iter_chunks(self):
+        while not self._done and self._stream.fill():
+            chunk = self._next_event()
+            if chunk is None:
+                return
+
+            yield chunk
+
+    def read(self):
+        return b''.join(self.iter_chunks())
+
+
+class AsyncPart(Part):
+    """A single part of the request, as yielded by aiter_parts."""
+
+    async def iter_chunks(self):
+        while not self._done and await self._stream.fill():
+            chunk = self._next_event()
+            if chunk is None:
+                return
+
+            yield chunk
+
+    async def read(self):
+        return b''.join([chunk async for chunk in self.iter_chunks()])
+
+
+_SyncStream.part_class = Part
+_AsyncStream.part_class = AsyncPart
+
+
+def iter_parts(headers, chunks):
+    """Parse the request body given as an iterable of chunks, yielding its
+    parts one by one.
+
+    >>> for part in iter_parts(headers, chunks):
+    ...     for chunk in part.iter_chunks():
+    ...         ...
+
+    Input is only pulled from the iterable when the consumer asks for more
+    data, so the memory used does not depend on the size of the request.
+    """
+
+    return _SyncStream(headers, chunks).parts()
+
+
+def aiter_parts(headers, chunks):
+    """Asynchronous version of iter_parts, taking an asynchronous iterable of
+    chunks.
+
+    >>> async for part in aiter_parts(headers, chunks):
+    ...     async for chunk in part.iter_chunks():
+    ...         ...
+    """
+
+    return _AsyncStream(headers, chunks).parts()
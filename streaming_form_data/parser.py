@@ -1,24 +1,68 @@
-import cgi
+from collections import deque
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from functools import lru_cache
+import importlib
+import mmap
+import os
+import platform
+import threading
+import warnings
 
-from streaming_form_data._parser import _Parser
+
+# interface version the compiled parser must have, see _parser.pyx
+_INTERFACE_VERSION = 3
+
+
+def _load_engine():
+    # The compiled parser is the fastest option on CPython, but calls into C
+    # extensions are expensive on PyPy, where the pure Python engine (which
+    # the JIT handles well) is preferable. The pure Python engine is also
+    # used when the extension has not been built, and, with a warning, when
+    # it has been built from an older version of the sources.
+    if platform.python_implementation() != 'PyPy':
+        try:
+            _parser = importlib.import_module('streaming_form_data._parser')
+        except ImportError:
+            _parser = None
+
+        if _parser is not None:
+            if getattr(_parser, 'INTERFACE_VERSION', None) == \
+                    _INTERFACE_VERSION:
+                return _parser._Parser, _parser.parse_header, \
+                    _parser.find_all
+
+            warnings.warn(
+                'The streaming_form_data._parser extension is outdated and '
+                'is not used, it needs to be rebuilt', RuntimeWarning)
+
+    _pyparser = importlib.import_module('streaming_form_data._pyparser')
+
+    return _pyparser._Parser, _pyparser.parse_header, _pyparser.find_all
+
+
+_Parser, parse_header, find_all = _load_engine()
 
 
 class ParseFailedException(Exception):
     pass
 
 
-def parse_content_boundary(headers):
-    content_type = None
+def _content_type(headers):
+    content_type = headers.get('Content-Type')
+    if content_type:
+        return content_type
 
     for key in headers:
         if key.lower() == 'content-type':
-            content_type = headers.get(key)
-            break
+            return headers.get(key)
 
-    if not content_type:
-        raise ParseFailedException('Missing Content-Type header')
 
-    value, params = cgi.parse_header(content_type)
+@lru_cache(maxsize=128)
+def _parse_content_type(content_type):
+    # the boundary of a Content-Type header value, cached since many clients
+    # keep sending the same boundary
+    value, params = parse_header(content_type)
 
     if not value or value.lower() != 'multipart/form-data':
         raise ParseFailedException('Content-Type is not multipart/form-data')
@@ -30,19 +74,220 @@ def parse_content_boundary(headers):
     return boundary.encode('utf-8')
 
 
+@lru_cache(maxsize=128)
+def _delimiters(boundary):
+    return b'\r\n--' + boundary + b'\r\n', b'\r\n--' + boundary + b'--'
+
+
+def parse_content_boundary(headers):
+    content_type = _content_type(headers)
+
+    if not content_type:
+        raise ParseFailedException('Missing Content-Type header')
+
+    return _parse_content_type(content_type)
+
+
+def delimiters_for(headers):
+    return _delimiters(parse_content_boundary(headers))
+
+
+def _chain(first, second):
+    # callback calling both callbacks, the second one being optional
+    if second is None:
+        return first
+
+    def chained(*args):
+        first(*args)
+        second(*args)
+
+    return chained
+
+
+class _Passthrough:
+    """Forwards the input of a parser to a sink, leaving out or rewriting the
+    parts whose names match the given rules.
+
+    The input is only held back until it is known whether it belongs to a
+    part which is left out or rewritten: the headers of the part being
+    parsed, and the end of the input which may be the beginning of the next
+    delimiter.
+    """
+
+    def __init__(self, sink, delimiter_length):
+        self.sink = sink
+
+        self.reset(delimiter_length)
+
+    def reset(self, delimiter_length):
+        # (pattern, function) pairs, parts matching a pattern being left out
+        # if function is None and rewritten using function(name, value)
+        # otherwise
+        self.rules = []
+
+        # a delimiter which has not been found yet may start in that many
+        # bytes before the end of the parsed input
+        self._hold = delimiter_length - 1
+
+        # input from _cursor on, which has not been handled yet
+        self._chunks = deque()
+        self._cursor = 0
+        self._received = 0
+
+        # whether the input is being left out, and the name, function and
+        # value chunks of the part being rewritten
+        self._dropping = False
+        self._rewriting = None
+
+    def received(self, data):
+        if data:
+            self._chunks.append(data)
+            self._received += len(data)
+
+    def part_begin(self, parser, name):
+        for pattern, function in self.rules:
+            if fnmatchcase(name, pattern):
+                break
+        else:
+            return
+
+        if function is None:
+            self._advance(parser.part_offset)
+            self._dropping = True
+        else:
+            # the headers are kept
+            self._advance(parser.body_offset)
+            self._rewriting = (name, function, [])
+
+    def part_end(self, parser):
+        if self._dropping:
+            # along with the CRLF preceding the next delimiter line
+            self._advance(parser.body_end + 2)
+            self._dropping = False
+        elif self._rewriting is not None:
+            self._advance(parser.body_end)
+
+            name, function, chunks = self._rewriting
+            self._rewriting = None
+
+            self.sink(function(name, b''.join(chunks)))
+
+    def flush(self, parser):
+        # handle the input which does not depend on the parts to come
+        if parser.finished or not self.rules:
+            limit = self._received
+        elif parser.body_offset > parser.part_offset:
+            # in the data of a part
+            limit = self._received - parser.retained - self._hold
+        else:
+            # the headers of the next part are still being received
+            limit = parser.part_offset
+
+        self._advance(limit)
+
+    def _advance(self, limit):
+        while self._cursor < limit:
+            chunk = self._chunks[0]
+
+            size = min(len(chunk), limit - self._cursor)
+            if size == len(chunk):
+                self._chunks.popleft()
+            else:
+                view = memoryview(chunk)
+                chunk = view[:size]
+                self._chunks[0] = view[size:]
+
+            self._cursor += size
+
+            if self._rewriting is not None:
+                self._rewriting[2].append(chunk)
+            elif not self._dropping:
+                self.sink(chunk)
+
+
 class StreamingFormDataParser:
-    def __init__(self, headers):
+    def __init__(self, headers, collect_stats=False, profile=False,
+                 stop_when_done=False, on_part_begin=None, on_part_end=None,
+                 on_all_registered_complete=None, passthrough=None):
+        # on_part_begin(name, filename, headers) is called when a part starts
+        # (with its headers in a dictionary with lowercased keys), and
+        # on_part_end(name, target) once its target has been finished, for
+        # all parts including the ones which have not been registered.
+        # on_all_registered_complete() is called as soon as every registered
+        # part has been received.
+        #
+        # passthrough(chunk) is called with the whole input of the parser,
+        # in the chunks it has been received in (or slices of them), e.g. to
+        # forward the request to another server, see strip() and rewrite().
         self.headers = headers
 
-        raw_boundary = parse_content_boundary(headers)
+        delimiter, ender = delimiters_for(headers)
+
+        self._passthrough = None
+
+        if passthrough is not None:
+            self._passthrough = _Passthrough(passthrough, len(delimiter))
+
+            on_part_begin = _chain(self._passthrough_part_begin,
+                                   on_part_begin)
+            on_part_end = _chain(self._passthrough_part_end, on_part_end)
+
+        self._parser = _Parser(delimiter, ender, collect_stats, profile,
+                               stop_when_done, on_part_begin, on_part_end,
+                               on_all_registered_complete)
+
+        self._running = False
+
+    def _passthrough_part_begin(self, name, filename, headers):
+        self._passthrough.part_begin(self._parser, name)
+
+    def _passthrough_part_end(self, name, target):
+        self._passthrough.part_end(self._parser)
+
+    @property
+    def finished(self):
+        # True once no more input is needed: either the final boundary has
+        # been seen or, when created with stop_when_done=True, every
+        # registered part has been received. Further data is ignored, so
+        # callers may stop reading the request body.
+        return self._parser.finished
 
-        delimiter = b'\r\n--' + raw_boundary + b'\r\n'
-        ender = b'\r\n--' + raw_boundary + b'--'
+    def reset(self, headers):
+        """Make the parser ready for parsing another request, as if it was
+        created anew with the given headers. Registered targets, statistics
+        and profile are cleared.
+        """
 
-        self._parser = _Parser(delimiter, ender)
+        delimiter, ender = delimiters_for(headers)
+
+        self.headers = headers
+
+        self._parser.reset(delimiter, ender)
+
+        if self._passthrough is not None:
+            self._passthrough.reset(len(delimiter))
 
         self._running = False
 
+    @property
+    def stats(self):
+        # Counters are only updated when the parser has been created with
+        # collect_stats=True, otherwise they all stay at zero.
+        return self._parser.stats
+
+    def reset_stats(self):
+        self._parser.reset_stats()
+
+    @property
+    def profile(self):
+        # Time spent per parser state, in part header parsing, and in each
+        # target's start / data_received / finish. Only gathered when the
+        # parser has been created with profile=True.
+        return self._parser.profile
+
+    def reset_profile(self):
+        self._parser.reset_profile()
+
     def register(self, name, target):
         if self._running:
             raise ParseFailedException(
@@ -50,11 +295,276 @@ class StreamingFormDataParser:
 
         self._parser.register(name, target)
 
+    def register_factory(self, pattern, factory):
+        """Create a new target using factory(name, filename, headers) for
+        every occurrence of a part whose name matches the given pattern (which
+        may contain shell-style wildcards such as '*'), e.g. to store each of
+        several files sent with the same name into its own file. Parts
+        registered by name take precedence, and factories are tried in the
+        order they have been registered.
+        """
+
+        if self._running:
+            raise ParseFailedException(
+                'Registering parts not allowed when parser is running')
+
+        self._parser.register_factory(pattern, factory)
+
+    def strip(self, pattern):
+        """Leave out the parts whose name matches pattern (which may contain
+        shell-style wildcards) from the input passed on to the passthrough
+        callable. They are still parsed and passed on to their targets.
+        """
+
+        self._add_passthrough_rule(pattern, None)
+
+    def rewrite(self, pattern, function):
+        """Replace the data of the parts whose name matches pattern by
+        function(name, data) in the input passed on to the passthrough
+        callable, keeping their headers. The data of these parts is kept in
+        memory until it has been received completely.
+        """
+
+        self._add_passthrough_rule(pattern, function)
+
+    def _add_passthrough_rule(self, pattern, function):
+        if self._passthrough is None:
+            raise ParseFailedException(
+                'Parser has been created without passthrough')
+
+        if self._running:
+            raise ParseFailedException(
+                'Registering parts not allowed when parser is running')
+
+        self._passthrough.rules.append((pattern, function))
+
+    @property
+    def paused(self):
+        return self._parser.pause_reason is not None
+
+    @property
+    def pause_reason(self):
+        # the value returned by the target's data_received which paused the
+        # parser, e.g. an awaitable telling when to resume
+        return self._parser.pause_reason
+
     def data_received(self, data):
+        """Parse the given chunk and return the number of bytes consumed.
+
+        A target pauses the parser by returning a value other than None from
+        data_received. Parsing then stops as soon as the part being received
+        has been finished, and the rest of the chunk is kept (without being
+        copied) until resume() is called. No more data may be passed to the
+        parser while it is paused.
+        """
+
+        if self.paused:
+            raise ParseFailedException(
+                'Parser is paused, resume() has to be called first')
+
         if not self._running:
             self._running = True
 
+        if self._passthrough is not None:
+            self._passthrough.received(data)
+
         retval = self._parser.data_received(data)
         if retval > 0:
             raise ParseFailedException(
                 '_parser.data_received failed with code: ' + str(retval))
+
+        if self._passthrough is not None:
+            self._passthrough.flush(self._parser)
+
+        return len(data) - self._parser.retained
+
+    def parse_buffer(self, buffer):
+        """Parse the whole content of a bytes-like object at once, e.g. a
+        memory mapped file. Instead of copies, the targets receive memoryview
+        slices of the buffer, which is why it must not be modified while they
+        are in use. Returns the number of bytes consumed, like
+        data_received().
+        """
+
+        if self.paused:
+            raise ParseFailedException(
+                'Parser is paused, resume() has to be called first')
+
+        if not self._running:
+            self._running = True
+
+        if self._passthrough is not None:
+            self._passthrough.received(memoryview(buffer))
+
+        retval = self._parser.parse_buffer(buffer)
+        if retval > 0:
+            raise ParseFailedException(
+                '_parser.parse_buffer failed with code: ' + str(retval))
+
+        if self._passthrough is not None:
+            self._passthrough.flush(self._parser)
+
+        return len(buffer) - self._parser.retained
+
+    def get_buffer(self, size_hint=-1):
+        """Return a writable buffer of at least size_hint bytes to read data
+        into, to be followed by a call to buffer_updated() with the number of
+        bytes written. This makes the parser usable as the core of an
+        asyncio.BufferedProtocol: data read from the socket is parsed in
+        place, without a bytes object being created for each read.
+        """
+
+        if self.paused:
+            raise ParseFailedException(
+                'Parser is paused, resume() has to be called first')
+
+        return self._parser.get_buffer(size_hint)
+
+    def buffer_updated(self, nbytes):
+        """Parse the nbytes written into the buffer returned by get_buffer(),
+        and return the number of bytes consumed, like data_received().
+        """
+
+        if not self._running:
+            self._running = True
+
+        if self._passthrough is not None:
+            # the read buffer is reused, so the input has to be copied
+            self._passthrough.received(self._parser.written(nbytes))
+
+        retval = self._parser.buffer_updated(nbytes)
+        if retval > 0:
+            raise ParseFailedException(
+                '_parser.buffer_updated failed with code: ' + str(retval))
+
+        if self._passthrough is not None:
+            self._passthrough.flush(self._parser)
+
+        return nbytes - self._parser.retained
+
+    def resume(self):
+        """Continue parsing after a pause, and return the number of the
+        retained bytes consumed, which may be less than all of them if a
+        target paused the parser again.
+        """
+
+        retained = self._parser.retained
+
+        retval = self._parser.resume()
+        if retval > 0:
+            raise ParseFailedException(
+                '_parser.resume failed with code: ' + str(retval))
+
+        if self._passthrough is not None:
+            self._passthrough.flush(self._parser)
+
+        return retained - self._parser.retained
+
+
+class ParserPool:
+    """Thread-safe pool of reusable parsers.
+
+    Frameworks can borrow a parser per request instead of creating a new one,
+    which saves the parser setup cost for small requests. Keyword arguments
+    are passed on to StreamingFormDataParser when a new parser is needed.
+
+    >>> pool = ParserPool()
+    >>> with pool.parser(headers) as parser:
+    ...     parser.register('name', ValueTarget())
+    ...     parser.data_received(chunk)
+    """
+
+    def __init__(self, max_size=16, **kwargs):
+        self.max_size = max_size
+
+        self._kwargs = kwargs
+        self._parsers = []
+        self._lock = threading.Lock()
+
+    def acquire(self, headers):
+        with self._lock:
+            parser = self._parsers.pop() if self._parsers else None
+
+        if parser is None:
+            return StreamingFormDataParser(headers, **self._kwargs)
+
+        try:
+            parser.reset(headers)
+        except ParseFailedException:
+            # the parser is left untouched when the headers are invalid
+            self.release(parser)
+            raise
+
+        return parser
+
+    def release(self, parser):
+        # The targets and the input of the last request are dropped, so that
+        # the pooled parser does not keep them alive: only the objects which
+        # can be reused, such as the finders and the read buffer, are kept.
+        parser.reset(parser.headers)
+
+        with self._lock:
+            if len(self._parsers) < self.max_size:
+                self._parsers.append(parser)
+
+    @contextmanager
+    def parser(self, headers):
+        parser = self.acquire(headers)
+        try:
+            yield parser
+        finally:
+            self.release(parser)
+
+
+def headers_for(headers_or_boundary):
+    # request headers, given either as such or by the boundary alone
+    if isinstance(headers_or_boundary, bytes):
+        headers_or_boundary = headers_or_boundary.decode('utf-8')
+
+    if isinstance(headers_or_boundary, str):
+        return {'Content-Type':
+                'multipart/form-data; boundary=' + headers_or_boundary}
+
+    return headers_or_boundary
+
+
+def parse_file(path, headers_or_boundary, targets, **kwargs):
+    """Parse a request body stored in a file, passing its parts on to the
+    targets given in a dictionary by part name, and return the parser.
+
+    The file is memory mapped and parsed in a single pass, the targets
+    receiving memoryview slices of the mapping instead of copies. Keyword
+    arguments are passed on to StreamingFormDataParser.
+    """
+
+    parser = StreamingFormDataParser(headers_for(headers_or_boundary),
+                                     **kwargs)
+
+    for name, target in targets.items():
+        parser.register(name, target)
+
+    with open(path, 'rb') as file_:
+        if os.fstat(file_.fileno()).st_size == 0:
+            raise ParseFailedException('Unexpected end of input')
+
+        mapping = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if hasattr(mapping, 'madvise'):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+
+    try:
+        parser.parse_buffer(mapping)
+        while parser.paused:
+            parser.resume()
+    finally:
+        try:
+            mapping.close()
+        except BufferError:
+            # targets keeping slices of the mapping, like ValueTarget, keep
+            # it open until they are gone
+            pass
+
+    if not parser.finished:
+        raise ParseFailedException('Unexpected end of input')
+
+    return parser
@@ -1,4 +1,11 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+import os
+import struct
+import subprocess
+import threading
 
 
 class BaseTarget:
@@ -86,3 +93,611 @@ class SHA256Target(BaseTarget):
     @property
     def value(self):
         return self._hash.hexdigest()
+
+
+class ObjectStorageTarget(BaseTarget):
+    """Uploads the input to S3-compatible object storage using a multipart
+    upload. The input is sliced into parts of part_size bytes, which are sent
+    concurrently by up to max_workers threads while the rest of the input is
+    still being received. When all the threads are busy, data_received blocks
+    until one of them is done, so at most max_workers + 1 parts are held in
+    memory.
+
+    client is expected to provide the multipart upload functions of a boto3
+    S3 client. Its connection pool should allow for at least max_workers
+    connections, e.g. using botocore.config.Config(max_pool_connections=...).
+
+    The upload is completed in finish() and aborted if any part fails. If
+    parsing fails before finish() is reached, abort() should be called to
+    release the parts which have already been uploaded.
+    """
+
+    # minimal size of all the parts but the last one, imposed by S3
+    MinPartSize = 5 * 1024 * 1024
+
+    def __init__(self, client, bucket, key, part_size=8 * 1024 * 1024,
+                 max_workers=4):
+        super().__init__()
+
+        if part_size < self.MinPartSize:
+            raise ValueError(
+                'part_size must be at least {} bytes'.format(self.MinPartSize))
+
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.max_workers = max_workers
+
+        self.upload_id = None
+
+        self._buffer = bytearray()
+        self._executor = None
+        self._slots = None
+        self._futures = []
+        self._error = None
+
+    def start(self):
+        response = self.client.create_multipart_upload(Bucket=self.bucket,
+                                                       Key=self.key)
+        self.upload_id = response['UploadId']
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+
+    def data_received(self, chunk):
+        self._buffer += chunk
+
+        while len(self._buffer) >= self.part_size:
+            self._upload(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def finish(self):
+        try:
+            # S3 needs at least one part, even for an empty object
+            if self._buffer or not self._futures:
+                self._upload(bytes(self._buffer))
+                self._buffer = bytearray()
+
+            parts = [future.result() for future in self._futures]
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.abort()
+            raise
+
+        self._executor.shutdown()
+
+    def abort(self):
+        if self.upload_id is None:
+            return
+
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown()
+
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                           UploadId=self.upload_id)
+        self.upload_id = None
+
+    def _upload(self, data):
+        if self._error is not None:
+            self.abort()
+            raise self._error
+
+        self._slots.acquire()
+
+        future = self._executor.submit(self._upload_part,
+                                       len(self._futures) + 1, data)
+        future.add_done_callback(self._part_done)
+
+        self._futures.append(future)
+
+    def _upload_part(self, number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=data)
+
+        return {'ETag': response['ETag'], 'PartNumber': number}
+
+    def _part_done(self, future):
+        self._slots.release()
+
+        if not future.cancelled() and future.exception() is not None:
+            self._error = future.exception()
+
+
+# Header of the shared memory ring buffer: total number of bytes written,
+# total number of bytes read, and whether the writer is done.
+_RING_POSITION = struct.Struct('<Q')
+_RING_WRITTEN, _RING_READ, _RING_CLOSED, _RING_HEADER_SIZE = 0, 8, 16, 24
+
+
+class SharedMemoryTarget(BaseTarget):
+    """Writes the input into a ring buffer in shared memory, to be consumed by
+    another process, e.g. for CPU-heavy processing which shouldn't run in the
+    parsing thread. The reader is obtained by calling reader() and has to be
+    passed on to the worker process when starting it:
+
+    >>> target = SharedMemoryTarget()
+    >>> worker = Process(target=process_upload, args=(target.reader(),))
+    >>> worker.start()
+    >>> parser.register('file', target)
+
+    data_received blocks while the ring buffer is full, for up to timeout
+    seconds if given. The shared memory is released by close(), once the
+    worker is done with it.
+    """
+
+    def __init__(self, capacity=1024 * 1024, timeout=None):
+        from multiprocessing import Condition, shared_memory
+
+        super().__init__()
+
+        self.capacity = capacity
+        self.timeout = timeout
+
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=_RING_HEADER_SIZE + capacity)
+        self._memory.buf[:_RING_HEADER_SIZE] = bytes(_RING_HEADER_SIZE)
+
+        self._condition = Condition()
+
+    def reader(self):
+        return SharedMemoryReader(self._memory.name, self.capacity,
+                                  self._condition, self.timeout)
+
+    def data_received(self, chunk):
+        buf = self._memory.buf
+        view = memoryview(chunk)
+        offset = 0
+
+        while offset < len(view):
+            with self._condition:
+                if not self._condition.wait_for(self._has_space,
+                                                self.timeout):
+                    raise TimeoutError('Shared memory reader is stalled')
+
+                written = _RING_POSITION.unpack_from(buf, _RING_WRITTEN)[0]
+                read = _RING_POSITION.unpack_from(buf, _RING_READ)[0]
+
+            # the reader never touches the free space, so it is filled
+            # without holding the lock
+            start = written % self.capacity
+            size = min(self.capacity - (written - read),
+                       self.capacity - start, len(view) - offset)
+
+            begin = _RING_HEADER_SIZE + start
+            buf[begin:begin + size] = view[offset:offset + size]
+            offset += size
+
+            with self._condition:
+                _RING_POSITION.pack_into(buf, _RING_WRITTEN, written + size)
+                self._condition.notify_all()
+
+    def finish(self):
+        with self._condition:
+            self._memory.buf[_RING_CLOSED] = 1
+            self._condition.notify_all()
+
+    def close(self):
+        self._memory.close()
+        self._memory.unlink()
+
+    def _has_space(self):
+        buf = self._memory.buf
+        written = _RING_POSITION.unpack_from(buf, _RING_WRITTEN)[0]
+        read = _RING_POSITION.unpack_from(buf, _RING_READ)[0]
+        return written - read < self.capacity
+
+
+class SharedMemoryReader:
+    """Reads the input written by a SharedMemoryTarget, from another process.
+
+    Iterating over the reader yields memoryviews of the shared memory, which
+    are released when the next chunk is requested, so each byte is copied
+    only once, by the target. Iteration ends when the target has been
+    finished, and blocks while no data is available (for up to timeout
+    seconds if given).
+    """
+
+    def __init__(self, name, capacity, condition, timeout=None):
+        self.name = name
+        self.capacity = capacity
+        self.timeout = timeout
+
+        self._condition = condition
+        self._memory = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_memory'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        from multiprocessing import shared_memory
+
+        if self._memory is None:
+            self._memory = shared_memory.SharedMemory(name=self.name)
+
+    def close(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory = None
+
+    def __iter__(self):
+        self.open()
+
+        buf = self._memory.buf
+        consumed = 0
+
+        while True:
+            with self._condition:
+                read = _RING_POSITION.unpack_from(buf, _RING_READ)[0]
+
+                # the previous chunk is handed back to the writer only now
+                if consumed:
+                    read += consumed
+                    _RING_POSITION.pack_into(buf, _RING_READ, read)
+                    self._condition.notify_all()
+
+                if not self._condition.wait_for(self._has_data,
+                                                self.timeout):
+                    raise TimeoutError('Shared memory writer is stalled')
+
+                written = _RING_POSITION.unpack_from(buf, _RING_WRITTEN)[0]
+
+            if written == read:
+                return
+
+            start = read % self.capacity
+            consumed = min(written - read, self.capacity - start)
+
+            begin = _RING_HEADER_SIZE + start
+            chunk = buf[begin:begin + consumed]
+            try:
+                yield chunk
+            finally:
+                chunk.release()
+
+    def read(self):
+        return b''.join(bytes(chunk) for chunk in self)
+
+    def _has_data(self):
+        buf = self._memory.buf
+        written = _RING_POSITION.unpack_from(buf, _RING_WRITTEN)[0]
+        read = _RING_POSITION.unpack_from(buf, _RING_READ)[0]
+        return written > read or buf[_RING_CLOSED]
+
+
+def _read_pipe(pipe, chunks):
+    with pipe:
+        for chunk in iter(lambda: pipe.read1(65536), b''):
+            chunks.append(chunk)
+
+
+class ProcessPipeTarget(BaseTarget):
+    """Pipes the input into the standard input of a command, which is started
+    in start(). Small chunks are batched into writes of up to batch_size
+    bytes, and writing blocks while the pipe is full.
+
+    The output of the command is collected by background threads, and is
+    available together with its exit code once finish() has returned. If the
+    command exits without reading its whole input, the rest of the input is
+    discarded. If parsing fails before finish() is reached, abort() should be
+    called to kill the command.
+    """
+
+    def __init__(self, argv, batch_size=65536):
+        super().__init__()
+
+        self.argv = argv
+        self.batch_size = batch_size
+
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+
+        self._process = None
+        self._threads = []
+        self._stdout_chunks = []
+        self._stderr_chunks = []
+
+    def start(self):
+        self._process = subprocess.Popen(
+            self.argv, bufsize=self.batch_size, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        for pipe, chunks in ((self._process.stdout, self._stdout_chunks),
+                             (self._process.stderr, self._stderr_chunks)):
+            thread = threading.Thread(target=_read_pipe, args=(pipe, chunks),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def data_received(self, chunk):
+        stdin = self._process.stdin
+        if stdin.closed:
+            return
+
+        try:
+            stdin.write(chunk)
+        except BrokenPipeError:
+            self._close_stdin()
+
+    def finish(self):
+        self._close_stdin()
+
+        for thread in self._threads:
+            thread.join()
+
+        self.returncode = self._process.wait()
+        self.stdout = b''.join(self._stdout_chunks)
+        self.stderr = b''.join(self._stderr_chunks)
+
+    def abort(self):
+        if self._process is None or self.returncode is not None:
+            return
+
+        # killed first, since closing stdin flushes the batched input, which
+        # would block if the command has stopped reading
+        self._process.kill()
+        self._close_stdin()
+
+        self.returncode = self._process.wait()
+
+        for thread in self._threads:
+            thread.join()
+
+        self.stdout = b''.join(self._stdout_chunks)
+        self.stderr = b''.join(self._stderr_chunks)
+
+    def _close_stdin(self):
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+class AsyncProcessPipeTarget(BaseTarget):
+    """Version of ProcessPipeTarget for asyncio applications, which never
+    blocks the event loop.
+
+    Chunks are written to the standard input of the command without blocking,
+    and whatever does not fit into the pipe is kept until the command reads
+    it. In that case data_received pauses the parser with a future resolved
+    once the pipe has been drained, so applications should wait for it before
+    resuming the parser, to avoid buffering unlimited amounts of data, and
+    for wait() once the parser is done, which returns the exit code of the
+    command:
+
+    >>> parser.data_received(chunk)
+    >>> while parser.paused:
+    ...     await parser.pause_reason
+    ...     parser.resume()
+    ...
+    >>> returncode = await target.wait()
+
+    The parser may also be run in an executor thread, e.g. by the Tornado
+    mixin with blocking_targets, provided that the target has been created
+    while the event loop is running: the pipe is then still watched by that
+    loop. If parsing fails before finish() is reached, abort() should be
+    called to kill the command.
+    """
+
+    def __init__(self, argv):
+        super().__init__()
+
+        self.argv = argv
+
+        self.returncode = None
+        self.stdout = None
+
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        self._process = None
+        self._stdin_fd = None
+
+        # data not written to the pipe yet
+        self._pending = deque()
+        self._pending_size = 0
+        self._closing = False
+
+        self._drained = None
+        self._stdout_done = None
+        self._stdout_chunks = []
+
+    @property
+    def pending_size(self):
+        return self._pending_size
+
+    def start(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+        self._process = subprocess.Popen(self.argv, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+
+        self._stdin_fd = self._process.stdin.fileno()
+        os.set_blocking(self._stdin_fd, False)
+
+        stdout_fd = self._process.stdout.fileno()
+        os.set_blocking(stdout_fd, False)
+
+        self._stdout_done = self._loop.create_future()
+        self._in_loop(self._loop.add_reader, stdout_fd, self._read_stdout)
+
+    def data_received(self, chunk):
+        if self._process.stdin.closed or not chunk:
+            return
+
+        watch = not self._pending
+
+        if watch:
+            written = self._write(chunk)
+            if written is None or written == len(chunk):
+                return
+
+            chunk = memoryview(chunk)[written:]
+
+        self._pending.append(chunk)
+        self._pending_size += len(chunk)
+
+        drained = self._drained_future()
+
+        if watch:
+            # only once the data is pending, since the loop may drain it
+            # right away when called from another thread
+            self._in_loop(self._loop.add_writer, self._stdin_fd,
+                          self._write_pending)
+
+        return drained
+
+    def finish(self):
+        self._in_loop(self._finish)
+
+    def _finish(self):
+        self._closing = True
+
+        if not self._pending:
+            self._close_stdin()
+
+    def abort(self):
+        self._in_loop(self._abort)
+
+    def _abort(self):
+        if self._process is None or self.returncode is not None:
+            return
+
+        self._process.kill()
+        self._close_stdin()
+
+        stdout = self._process.stdout
+        if not stdout.closed:
+            self._loop.remove_reader(stdout.fileno())
+            stdout.close()
+
+        if not self._stdout_done.done():
+            self._stdout_done.set_result(None)
+
+        self.returncode = self._process.wait()
+        self.stdout = b''.join(self._stdout_chunks)
+
+    def _in_loop(self, function, *args):
+        # call function on the event loop of the target, which is not the
+        # current thread when the parser is run in an executor
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self._loop:
+            function(*args)
+        else:
+            self._loop.call_soon_threadsafe(function, *args)
+
+    async def drain(self):
+        """Wait until all the data received so far has been written to the
+        pipe.
+        """
+
+        if self._pending:
+            await asyncio.shield(self._drained_future())
+
+    async def wait(self):
+        await self.drain()
+        await self._stdout_done
+
+        self.returncode = await self._loop.run_in_executor(
+            None, self._process.wait)
+        self.stdout = b''.join(self._stdout_chunks)
+
+        return self.returncode
+
+    def _write(self, data):
+        # returns the number of bytes written, or None if the pipe is closed
+        try:
+            return os.write(self._stdin_fd, data)
+        except BlockingIOError:
+            return 0
+        except BrokenPipeError:
+            self._close_stdin()
+            return None
+
+    def _write_pending(self):
+        while self._pending:
+            chunk = self._pending[0]
+
+            written = self._write(chunk)
+            if written is None:
+                return
+
+            self._pending_size -= written
+            if written < len(chunk):
+                self._pending[0] = memoryview(chunk)[written:]
+                return
+
+            self._pending.popleft()
+
+        self._loop.remove_writer(self._stdin_fd)
+        self._set_drained()
+
+        if self._closing:
+            self._close_stdin()
+
+    def _close_stdin(self):
+        if self._process.stdin.closed:
+            return
+
+        if self._pending:
+            self._loop.remove_writer(self._stdin_fd)
+            self._pending.clear()
+            self._pending_size = 0
+            self._set_drained()
+
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def _drained_future(self):
+        if self._drained is None or self._drained.cancelled():
+            self._drained = self._loop.create_future()
+
+        return self._drained
+
+    def _set_drained(self):
+        # the future is cancelled when a task awaiting it is, e.g. once the
+        # client has disconnected
+        if self._drained is not None:
+            if not self._drained.done():
+                self._drained.set_result(None)
+            self._drained = None
+
+    def _read_stdout(self):
+        stdout = self._process.stdout
+
+        try:
+            chunk = os.read(stdout.fileno(), 65536)
+        except BlockingIOError:
+            return
+
+        if chunk:
+            self._stdout_chunks.append(chunk)
+            return
+
+        self._loop.remove_reader(stdout.fileno())
+        stdout.close()
+
+        if not self._stdout_done.done():
+            self._stdout_done.set_result(None)
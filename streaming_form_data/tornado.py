@@ -0,0 +1,171 @@
+import functools
+import inspect
+import os
+
+from tornado.ioloop import IOLoop
+from tornado.web import HTTPError
+
+from streaming_form_data.parser import (ParseFailedException,
+                                        StreamingFormDataParser)
+from streaming_form_data.targets import FileTarget
+
+
+class StreamingFormDataMixin:
+    """Mixin for Tornado request handlers decorated with
+    tornado.web.stream_request_body, which parses the request body as it is
+    being received:
+
+    >>> @stream_request_body
+    ... class UploadHandler(StreamingFormDataMixin, RequestHandler):
+    ...     max_body_size = 1024 * 1024 * 1024
+    ...
+    ...     def prepare(self):
+    ...         super().prepare()
+    ...         self.register('file', FileTarget('/tmp/upload.dat'))
+    ...
+    ...     def post(self):
+    ...         ...
+
+    Reading from the connection is paused while the parser is paused by a
+    target (see StreamingFormDataParser.data_received), so slow targets don't
+    make the request body pile up in memory. Setting blocking_targets to True
+    runs the parser, and so the targets, in executor (the default one of the
+    IOLoop if None) instead of on the IOLoop.
+
+    A request whose body ends before the final boundary is rejected with 400
+    before the HTTP method is called. In that case, as when the connection is
+    closed before the request has been received completely, the targets which
+    have been started but not finished are cleaned up: their abort() function
+    is called if they have one, and the partially written files of
+    FileTargets are removed.
+    """
+
+    # largest request body accepted, or None for Tornado's default
+    max_body_size = None
+
+    blocking_targets = False
+    executor = None
+
+    # keyword arguments passed on to StreamingFormDataParser
+    parser_kwargs = {}
+
+    def prepare(self):
+        if self.max_body_size is not None:
+            content_length = self.request.headers.get('Content-Length')
+            if content_length is not None and \
+                    int(content_length) > self.max_body_size:
+                raise HTTPError(413)
+
+            self.request.connection.set_max_body_size(self.max_body_size)
+
+        try:
+            self.parser = StreamingFormDataParser(self.request.headers,
+                                                  **self.parser_kwargs)
+        except ParseFailedException as exc:
+            raise HTTPError(400, str(exc))
+
+        self._form_targets = []
+
+        # parser call running in the executor, if any
+        self._parser_future = None
+        self._connection_closed = False
+
+        # Tornado looks the HTTP method up once the body has been received,
+        # which is the only point where its end is known: the method is
+        # replaced for this request by one checking the body first.
+        name = self.request.method.lower()
+        method = getattr(self, name, None)
+        if method is not None:
+            setattr(self, name, functools.partial(self._checked_method,
+                                                  method))
+
+    def _checked_method(self, method, *args, **kwargs):
+        if self._finished:
+            # the request has already been rejected by data_received
+            return None
+
+        if not self.parser.finished:
+            self._cleanup_targets()
+            raise HTTPError(400, 'Unexpected end of input')
+
+        return method(*args, **kwargs)
+
+    def register(self, name, target):
+        self.parser.register(name, target)
+        self._form_targets.append(target)
+
+    def register_factory(self, pattern, factory):
+        def tracked_factory(name, filename, headers):
+            target = factory(name, filename, headers)
+            self._form_targets.append(target)
+            return target
+
+        self.parser.register_factory(pattern, tracked_factory)
+
+    async def data_received(self, chunk):
+        if not await self._run_parser(self.parser.data_received, chunk):
+            return
+
+        while self.parser.paused:
+            reason = self.parser.pause_reason
+            if inspect.isawaitable(reason):
+                await reason
+
+            if not await self._run_parser(self.parser.resume):
+                return
+
+    async def _run_parser(self, function, *args):
+        # returns False once the request has failed
+        if self._finished or self._connection_closed:
+            return False
+
+        try:
+            if self.blocking_targets:
+                self._parser_future = IOLoop.current().run_in_executor(
+                    self.executor, function, *args)
+                try:
+                    await self._parser_future
+                finally:
+                    self._parser_future = None
+            else:
+                function(*args)
+        except ParseFailedException:
+            # exceptions raised here would only close the connection; Tornado
+            # ignores the rest of the body once the response is finished
+            self.send_error(400)
+            return False
+
+        return True
+
+    def on_connection_close(self):
+        super().on_connection_close()
+
+        parser = getattr(self, 'parser', None)
+        if parser is None or parser.finished:
+            return
+
+        self._connection_closed = True
+
+        if self._parser_future is not None:
+            # the targets may still be in use in the executor
+            self._parser_future.add_done_callback(
+                lambda future: self._cleanup_targets())
+        else:
+            self._cleanup_targets()
+
+    def _cleanup_targets(self):
+        # only once, the connection may be closed after a rejected request
+        targets, self._form_targets = self._form_targets, []
+
+        for target in targets:
+            if target._started and not target._finished:
+                _cleanup(target)
+
+
+def _cleanup(target):
+    abort = getattr(target, 'abort', None)
+    if abort is not None:
+        abort()
+    elif isinstance(target, FileTarget) and target._fd is not None:
+        target._fd.close()
+        os.remove(target.filename)
@@ -0,0 +1,203 @@
+from io import BytesIO
+import os
+import tempfile
+
+from streaming_form_data.parser import (ParseFailedException,
+                                        StreamingFormDataParser)
+from streaming_form_data.targets import FileTarget, ValueTarget
+
+
+# key of the parsed parts in the WSGI environ: a dictionary mapping the part
+# names to the lists of targets which have received them
+ENVIRON_KEY = 'streaming_form_data.parts'
+
+
+def _request_headers(environ):
+    headers = {}
+
+    for key, value in environ.items():
+        if key.startswith('HTTP_'):
+            headers[key[5:].replace('_', '-').title()] = value
+
+    for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        if environ.get(key):
+            headers[key.replace('_', '-').title()] = environ[key]
+
+    return headers
+
+
+def _remove_files(filenames):
+    for filename in filenames:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def _close_targets(parts):
+    # targets left unfinished by a request which has failed
+    for targets in parts.values():
+        for target in targets:
+            if not target._started or target._finished:
+                continue
+
+            abort = getattr(target, 'abort', None)
+            if abort is not None:
+                abort()
+            elif isinstance(target, FileTarget) and target._fd is not None:
+                target._fd.close()
+
+
+class _ClosingIterable:
+    """Response iterable removing the temporary files of the request once
+    the server is done with the response.
+    """
+
+    def __init__(self, iterable, filenames):
+        self._iterable = iterable
+        self._filenames = filenames
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            _remove_files(self._filenames)
+
+
+class StreamingFormDataMiddleware:
+    """WSGI middleware parsing multipart/form-data request bodies before the
+    application is called.
+
+    The parts are passed to targets created by factory(name, filename,
+    headers) for each of them, and the targets are available to the
+    application in environ['streaming_form_data.parts'], as lists of targets
+    by part name. The default factory keeps the values of fields in memory
+    (ValueTarget) and writes files to temporary files (FileTarget), which are
+    removed once the response has been sent. The request body seen by the
+    application is empty.
+
+    paths restricts the parsing to the requests whose path starts with one
+    of the given prefixes. The body is read into a buffer of buffer_size
+    bytes, reused for all reads when the server's input stream supports
+    readinto(). As required by PEP 3333, no more than CONTENT_LENGTH bytes
+    are read, a missing length meaning an empty body unless the server sets
+    wsgi.input_terminated.
+    """
+
+    def __init__(self, app, paths=None, factory=None, buffer_size=65536,
+                 tempdir=None):
+        self.app = app
+        self.paths = tuple(paths) if paths is not None else None
+        self.factory = factory
+        self.buffer_size = buffer_size
+        self.tempdir = tempdir
+
+    def __call__(self, environ, start_response):
+        if not self._should_parse(environ):
+            return self.app(environ, start_response)
+
+        parts = {}
+        filenames = []
+
+        def factory(name, filename, headers):
+            if self.factory is not None:
+                target = self.factory(name, filename, headers)
+            elif filename is None:
+                target = ValueTarget()
+            else:
+                fd, path = tempfile.mkstemp(dir=self.tempdir)
+                os.close(fd)
+                filenames.append(path)
+
+                target = FileTarget(path)
+
+            parts.setdefault(name, []).append(target)
+            return target
+
+        try:
+            parser = StreamingFormDataParser(_request_headers(environ))
+            parser.register_factory('*', factory)
+
+            self._parse(environ, parser)
+        except ParseFailedException:
+            _close_targets(parts)
+            _remove_files(filenames)
+
+            start_response('400 Bad Request',
+                           [('Content-Type', 'text/plain')])
+            return [b'Invalid multipart/form-data request body']
+        except BaseException:
+            _close_targets(parts)
+            _remove_files(filenames)
+            raise
+
+        environ[ENVIRON_KEY] = parts
+        environ['wsgi.input'] = BytesIO()
+        environ['CONTENT_LENGTH'] = '0'
+
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            _remove_files(filenames)
+            raise
+
+        return _ClosingIterable(response, filenames)
+
+    def _should_parse(self, environ):
+        content_type = environ.get('CONTENT_TYPE', '')
+        if not content_type.lower().startswith('multipart/form-data'):
+            return False
+
+        if self.paths is None:
+            return True
+
+        return environ.get('PATH_INFO', '').startswith(self.paths)
+
+    def _parse(self, environ, parser):
+        stream = environ['wsgi.input']
+
+        remaining = environ.get('CONTENT_LENGTH')
+        if remaining:
+            remaining = int(remaining)
+        elif environ.get('wsgi.input_terminated'):
+            # the server signals the end of the body, e.g. for chunked
+            # requests
+            remaining = None
+        else:
+            # reading on could block forever
+            remaining = 0
+
+        readinto = getattr(stream, 'readinto', None)
+
+        while remaining is None or remaining > 0:
+            size = self.buffer_size
+            if remaining is not None:
+                size = min(size, remaining)
+
+            if readinto is not None:
+                with parser.get_buffer(size) as buffer:
+                    count = readinto(buffer[:size])
+
+                if not count:
+                    break
+                parser.buffer_updated(count)
+            else:
+                data = stream.read(size)
+
+                count = len(data)
+                if not count:
+                    break
+                parser.data_received(data)
+
+            # targets are synchronous here, so there is nothing to wait for
+            while parser.paused:
+                parser.resume()
+
+            if remaining is not None:
+                remaining -= count
+
+        if not parser.finished:
+            raise ParseFailedException('Unexpected end of input')
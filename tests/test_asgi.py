@@ -0,0 +1,123 @@
+import asyncio
+from unittest import TestCase
+
+from requests_toolbelt import MultipartEncoder
+
+from streaming_form_data import ParseFailedException
+from streaming_form_data.asgi import ClientDisconnected, create_parser, \
+    parse_body, scope_headers
+from streaming_form_data.targets import BaseTarget, ValueTarget
+
+
+class AsyncTarget(BaseTarget):
+    def __init__(self):
+        super().__init__()
+
+        self.chunks = []
+
+    async def data_received(self, chunk):
+        await asyncio.sleep(0)
+        self.chunks.append(chunk)
+
+
+class FakeReceive:
+    """ASGI receive callable sending the given body in several messages."""
+
+    def __init__(self, body, size, disconnect=False):
+        self.messages = [
+            {'type': 'http.request', 'body': body[index:index + size],
+             'more_body': True}
+            for index in range(0, len(body), size)]
+
+        if disconnect:
+            self.messages.append({'type': 'http.disconnect'})
+        else:
+            self.messages[-1]['more_body'] = False
+
+        self.received = 0
+
+    async def __call__(self):
+        self.received += 1
+        return self.messages.pop(0)
+
+
+def scope_for(encoder):
+    return {
+        'type': 'http',
+        'method': 'POST',
+        'headers': [
+            (b'content-type', encoder.content_type.encode('latin-1')),
+            (b'content-length', str(encoder.len).encode('latin-1')),
+        ],
+    }
+
+
+class ASGITestCase(TestCase):
+    def setUp(self):
+        self.encoder = MultipartEncoder(fields=[
+            ('name', 'hello world'),
+            ('file', ('file.dat', b'x' * 100000)),
+        ])
+        self.body = self.encoder.to_string()
+        self.scope = scope_for(self.encoder)
+
+    def test_scope_headers(self):
+        headers = scope_headers(self.scope)
+
+        self.assertEqual(headers['content-type'], self.encoder.content_type)
+
+    def test_parse_body(self):
+        name = ValueTarget()
+        file_ = AsyncTarget()
+
+        parser = create_parser(self.scope)
+        parser.register('name', name)
+        parser.register('file', file_)
+
+        receive = FakeReceive(self.body, 1000)
+        asyncio.run(parse_body(receive, parser))
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(b''.join(file_.chunks), b'x' * 100000)
+        self.assertTrue(file_._finished)
+        self.assertEqual(receive.messages, [])
+
+    def test_epilogue(self):
+        name = ValueTarget()
+
+        parser = create_parser(self.scope)
+        parser.register('name', name)
+
+        body = self.body + b'epilogue'
+        asyncio.run(parse_body(FakeReceive(body, len(body)), parser))
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertTrue(parser.finished)
+
+    def test_disconnect(self):
+        parser = create_parser(self.scope)
+
+        receive = FakeReceive(self.body[:50000], 1000, disconnect=True)
+
+        with self.assertRaises(ClientDisconnected):
+            asyncio.run(parse_body(receive, parser))
+
+    def test_incomplete_body(self):
+        parser = create_parser(self.scope)
+
+        receive = FakeReceive(self.body[:50000], 1000)
+
+        with self.assertRaises(ParseFailedException):
+            asyncio.run(parse_body(receive, parser))
+
+    def test_stop_when_done(self):
+        name = ValueTarget()
+
+        parser = create_parser(self.scope, stop_when_done=True)
+        parser.register('name', name)
+
+        receive = FakeReceive(self.body, 1000)
+        asyncio.run(parse_body(receive, parser))
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertLess(receive.received, 10)
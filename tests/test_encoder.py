@@ -0,0 +1,163 @@
+from io import BytesIO
+import os.path
+import socket
+import tempfile
+from threading import Thread
+from unittest import TestCase
+
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.encoder import FileSegment, MultipartEncoder
+from streaming_form_data.targets import ValueTarget
+
+
+def parse(encoder, body):
+    parser = StreamingFormDataParser({'Content-Type': encoder.content_type})
+
+    targets = {}
+
+    def factory(name, filename, headers):
+        target = ValueTarget()
+        targets[name] = (filename, headers.get('content-type'), target)
+        return target
+
+    parser.register_factory('*', factory)
+    parser.data_received(body)
+
+    assert parser.finished
+
+    return {name: (filename, content_type, target.value)
+            for name, (filename, content_type, target) in targets.items()}
+
+
+class MultipartEncoderTestCase(TestCase):
+    def setUp(self):
+        self.file_data = os.urandom(200000)
+
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'file.dat')
+
+        with open(self.path, 'wb') as file_:
+            file_.write(self.file_data)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_fields(self):
+        encoder = MultipartEncoder([
+            ('name', 'hello world'),
+            ('bytes', b'\r\n--value'),
+            ('empty', ''),
+        ])
+
+        body = encoder.to_bytes()
+
+        self.assertEqual(len(body), encoder.content_length)
+        self.assertEqual(parse(encoder, body), {
+            'name': (None, None, b'hello world'),
+            'bytes': (None, None, b'\r\n--value'),
+            'empty': (None, None, b''),
+        })
+
+    def test_files(self):
+        with open(self.path, 'rb') as file_:
+            encoder = MultipartEncoder({
+                'file': ('file.dat', file_, 'application/octet-stream'),
+                'memory': ('memory.txt', BytesIO(b'x' * 100000)),
+                'bytes': ('bytes.txt', b'y' * 100000, 'text/plain'),
+            }, chunk_size=4096)
+
+            length = encoder.content_length
+            chunks = list(encoder)
+
+        self.assertTrue(all(len(chunk) <= 100000 for chunk in chunks))
+
+        body = b''.join(chunks)
+
+        self.assertEqual(len(body), length)
+        self.assertEqual(parse(encoder, body), {
+            'file': ('file.dat', 'application/octet-stream', self.file_data),
+            'memory': ('memory.txt', None, b'x' * 100000),
+            'bytes': ('bytes.txt', 'text/plain', b'y' * 100000),
+        })
+
+    def test_file_position(self):
+        with open(self.path, 'rb') as file_:
+            file_.seek(1000)
+
+            encoder = MultipartEncoder({'file': ('file.dat', file_)})
+            length = encoder.content_length
+
+            body = encoder.to_bytes()
+
+        self.assertEqual(len(body), length)
+        self.assertEqual(parse(encoder, body)['file'][2],
+                         self.file_data[1000:])
+
+    def test_generator(self):
+        def chunks():
+            yield b'abc'
+            yield b''
+            yield b'def'
+
+        encoder = MultipartEncoder({'file': ('file.txt', chunks())})
+
+        self.assertIsNone(encoder.content_length)
+        self.assertEqual(parse(encoder, encoder.to_bytes())['file'][2],
+                         b'abcdef')
+
+    def test_quoted_names(self):
+        encoder = MultipartEncoder({'a"b': ('c"d\r\n.txt', b'value')})
+
+        self.assertEqual(parse(encoder, encoder.to_bytes()),
+                         {'a%22b': ('c%22d%0D%0A.txt', None, b'value')})
+
+    def test_boundary(self):
+        encoder = MultipartEncoder({'name': 'value'}, boundary='1234')
+
+        self.assertEqual(encoder.content_type,
+                         'multipart/form-data; boundary=1234')
+        self.assertEqual(encoder.to_bytes(),
+                         b'--1234\r\n'
+                         b'Content-Disposition: form-data; name="name"\r\n'
+                         b'\r\n'
+                         b'value\r\n'
+                         b'--1234--\r\n')
+
+    def test_segments(self):
+        with open(self.path, 'rb') as file_:
+            encoder = MultipartEncoder({'file': ('file.dat', file_)})
+
+            segments = list(encoder.segments())
+
+            self.assertEqual(len(segments), 4)
+            self.assertEqual(segments[1], FileSegment(file_, 0, 200000))
+
+    def test_send(self):
+        reader, writer = socket.socketpair()
+        received = []
+
+        def receive():
+            while True:
+                data = reader.recv(65536)
+                if not data:
+                    break
+                received.append(data)
+
+        thread = Thread(target=receive)
+        thread.start()
+
+        with open(self.path, 'rb') as file_:
+            encoder = MultipartEncoder({
+                'name': 'hello',
+                'file': ('file.dat', file_),
+            })
+            encoder.send(writer)
+
+        writer.close()
+        thread.join()
+        reader.close()
+
+        self.assertEqual(parse(encoder, b''.join(received)), {
+            'name': (None, None, b'hello'),
+            'file': ('file.dat', None, self.file_data),
+        })
@@ -0,0 +1,237 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import os.path
+import tempfile
+from unittest import TestCase
+
+from requests_toolbelt import MultipartEncoder
+
+from streaming_form_data import ParseFailedException, parse_bytes
+from streaming_form_data.index import (PartRecord, dispatch_parts,
+                                       index_buffer, index_file, load_index,
+                                       parse_parallel, read_part)
+from streaming_form_data.targets import SHA256Target, ValueTarget
+
+
+class IndexTestCase(TestCase):
+    def setUp(self):
+        self.file_data = os.urandom(100000)
+
+        self.encoder = MultipartEncoder(fields=[
+            ('metadata', '{"id": 1}'),
+            ('file', ('file.dat', self.file_data, 'application/octet-stream')),
+            ('empty', ''),
+        ])
+        self.body = self.encoder.to_string()
+        self.boundary = self.encoder.boundary_value
+
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'body.dat')
+
+        with open(self.path, 'wb') as file_:
+            file_.write(self.body)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_index_buffer(self):
+        records = index_buffer(self.body, self.boundary)
+
+        self.assertEqual([(record.name, record.filename, record.content_type)
+                          for record in records], [
+            ('metadata', None, None),
+            ('file', 'file.dat', 'application/octet-stream'),
+            ('empty', None, None),
+        ])
+
+        values = [self.body[record.body_offset:
+                            record.body_offset + record.body_length]
+                  for record in records]
+
+        self.assertEqual(values, [b'{"id": 1}', self.file_data, b''])
+
+        self.assertTrue(self.body[records[1].header_offset:].startswith(
+            b'Content-Disposition: form-data; name="file"'))
+
+    def test_headers(self):
+        records = index_buffer(self.body,
+                               {'Content-Type': self.encoder.content_type})
+
+        self.assertEqual(len(records), 3)
+
+    def test_delimiter_like_data(self):
+        body = (b'--1234\r\n'
+                b'Content-Disposition: form-data; name="value"\r\n'
+                b'\r\n'
+                b'abc\r\n--12345\r\n'
+                b'--1234--\r\n')
+
+        record, = index_buffer(body, '1234')
+
+        self.assertEqual(record.body_length, len(b'abc\r\n--12345'))
+
+    def test_part_without_headers(self):
+        record, = index_buffer(b'--1234\r\n\r\nabc\r\n--1234--\r\n', '1234')
+
+        self.assertEqual(record, PartRecord(None, None, None, 8, 10, 3))
+
+    def test_incomplete_body(self):
+        for size in (0, 5, 100, len(self.body) - 10):
+            with self.assertRaises(ParseFailedException):
+                index_buffer(self.body[:size], self.boundary)
+
+    def test_wrong_boundary(self):
+        with self.assertRaises(ParseFailedException):
+            index_buffer(self.body, 'other')
+
+    def test_index_file(self):
+        index_path = self.path + '.index'
+
+        records = index_file(self.path, self.boundary, index_path)
+
+        self.assertEqual(records, index_buffer(self.body, self.boundary))
+        self.assertEqual(load_index(index_path), records)
+
+        self.assertEqual(read_part(self.path, records[0]), b'{"id": 1}')
+        self.assertEqual(read_part(self.path, records[1]), self.file_data)
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+
+        with self.assertRaises(ParseFailedException):
+            index_file(self.path, self.boundary)
+
+
+class ParallelTestCase(TestCase):
+    def setUp(self):
+        self.files = [os.urandom(size) for size in (5000, 1, 20000, 3000)]
+
+        self.encoder = MultipartEncoder(fields=[
+            ('file{}'.format(index), ('file.dat', data))
+            for index, data in enumerate(self.files)
+        ] + [('value', 'hello'), ('value', 'world')])
+
+        self.body = self.encoder.to_string()
+        self.boundary = self.encoder.boundary_value
+
+        self.executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_region_sizes(self):
+        expected = index_buffer(self.body, self.boundary)
+
+        # delimiters straddle the edges of some of the regions
+        for region_size in (1, 7, 100, 1000, 4096):
+            self.assertEqual(index_buffer(self.body, self.boundary,
+                                          self.executor, region_size),
+                             expected)
+
+    def test_parse_parallel(self):
+        targets = {'file{}'.format(index): SHA256Target()
+                   for index in range(len(self.files))}
+        targets['value'] = ValueTarget()
+
+        records = parse_parallel(self.body, self.boundary, targets,
+                                 self.executor, region_size=1000)
+
+        self.assertEqual(len(records), 6)
+
+        for index, data in enumerate(self.files):
+            target = targets['file{}'.format(index)]
+
+            self.assertTrue(target._finished)
+            self.assertEqual(target.value, hashlib.sha256(data).hexdigest())
+
+        # parts with the same name are received in order
+        self.assertEqual(targets['value'].value, b'helloworld')
+
+    def test_dispatch_without_executor(self):
+        records = index_buffer(self.body, self.boundary)
+
+        target = ValueTarget()
+        dispatch_parts(self.body, records, {'file2': target})
+
+        self.assertEqual(target.value, self.files[2])
+
+    def test_target_exception(self):
+        class FailingTarget(ValueTarget):
+            def data_received(self, chunk):
+                raise ValueError()
+
+        with self.assertRaises(ValueError):
+            parse_parallel(self.body, self.boundary,
+                           {'file0': FailingTarget()}, self.executor)
+
+    def test_index_file_processes(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'body.dat')
+
+            with open(path, 'wb') as file_:
+                file_.write(self.body)
+
+            with ProcessPoolExecutor(2) as executor:
+                records = index_file(path, self.boundary, executor=executor,
+                                     region_size=4096)
+
+        self.assertEqual(records, index_buffer(self.body, self.boundary))
+
+
+class ParseBytesTestCase(TestCase):
+    def setUp(self):
+        self.encoder = MultipartEncoder(fields=[
+            ('name', 'hello world'),
+            ('file', ('file.txt', b'x' * 1000, 'text/plain')),
+            ('name', 'again'),
+        ])
+        self.body = self.encoder.to_string()
+
+    def test_parse_bytes(self):
+        fields = parse_bytes(self.body, self.encoder.content_type)
+
+        self.assertEqual(sorted(fields), ['file', 'name'])
+
+        self.assertEqual([field.value for field in fields['name']],
+                         [b'hello world', b'again'])
+
+        field, = fields['file']
+
+        self.assertIsInstance(field.value, memoryview)
+        self.assertEqual(field.value, b'x' * 1000)
+        self.assertEqual(field.filename, 'file.txt')
+        self.assertEqual(field.headers['content-type'], 'text/plain')
+
+    def test_unnamed_part(self):
+        body = (b'--1234\r\n'
+                b'Content-Type: text/plain\r\n'
+                b'\r\n'
+                b'abc\r\n--1234--\r\n')
+
+        self.assertEqual(
+            parse_bytes(body, 'multipart/form-data; boundary=1234'), {})
+
+    def test_bytearray(self):
+        fields = parse_bytes(bytearray(self.body),
+                             self.encoder.content_type)
+
+        self.assertEqual(fields['file'][0].value, b'x' * 1000)
+
+    def test_memoryview(self):
+        body = bytearray(self.body)
+
+        fields = parse_bytes(memoryview(body), self.encoder.content_type)
+
+        self.assertEqual([field.value for field in fields['name']],
+                         [b'hello world', b'again'])
+
+        # the values are still slices of the body
+        body[body.index(b'x' * 1000)] = ord('y')
+        self.assertEqual(fields['file'][0].value, b'y' + b'x' * 999)
+
+    def test_invalid(self):
+        with self.assertRaises(ParseFailedException):
+            parse_bytes(self.body, 'text/plain')
+
+        with self.assertRaises(ParseFailedException):
+            parse_bytes(self.body[:-20], self.encoder.content_type)
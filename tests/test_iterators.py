@@ -0,0 +1,152 @@
+import asyncio
+from unittest import TestCase
+
+from requests_toolbelt import MultipartEncoder
+
+from streaming_form_data import ParseFailedException
+from streaming_form_data.iterators import aiter_parts, iter_parts
+
+
+def encoded_request(fields):
+    encoder = MultipartEncoder(fields=fields)
+    return {'Content-Type': encoder.content_type}, encoder.to_string()
+
+
+def split(data, size):
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+class Chunks:
+    """Iterable over chunks, keeping track of how many have been pulled."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pulled = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.pulled += 1
+            yield chunk
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+
+class IterPartsTestCase(TestCase):
+    def setUp(self):
+        self.headers, self.body = encoded_request([
+            ('name', 'hello world'),
+            ('file', ('file.txt', b'x' * 10000, 'text/plain')),
+            ('other', 'value'),
+        ])
+
+    def test_parts(self):
+        for size in (1, 7, 100, 1024, len(self.body)):
+            result = [(part.name, part.filename, part.read())
+                      for part in iter_parts(self.headers,
+                                             split(self.body, size))]
+
+            self.assertEqual(result, [
+                ('name', None, b'hello world'),
+                ('file', 'file.txt', b'x' * 10000),
+                ('other', None, b'value'),
+            ])
+
+    def test_headers(self):
+        parts = list(iter_parts(self.headers, [self.body]))
+
+        self.assertEqual(parts[1].headers['content-type'], 'text/plain')
+
+    def test_chunks_pulled_lazily(self):
+        # chunks bigger than the minimal body chunk size of the parser
+        chunks = Chunks(split(self.body, 2048))
+
+        parts = iter_parts(self.headers, chunks)
+        part = next(parts)
+
+        self.assertEqual(part.name, 'name')
+        self.assertEqual(chunks.pulled, 1)
+
+        part = next(parts)
+        pulled = chunks.pulled
+
+        chunk = next(part.iter_chunks())
+
+        self.assertTrue(chunk)
+        self.assertLessEqual(chunks.pulled, pulled + 1)
+        self.assertLess(chunks.pulled, len(chunks.chunks))
+
+    def test_skip_part(self):
+        names = []
+        for part in iter_parts(self.headers, split(self.body, 100)):
+            names.append(part.name)
+            if part.name == 'other':
+                self.assertEqual(part.read(), b'value')
+
+        self.assertEqual(names, ['name', 'file', 'other'])
+
+    def test_partially_read_part(self):
+        result = {}
+        for part in iter_parts(self.headers, split(self.body, 100)):
+            result[part.name] = next(part.iter_chunks())
+
+        self.assertEqual(result['name'], b'hello world')
+        self.assertEqual(result['other'], b'value')
+
+    def test_read_twice(self):
+        parts = iter_parts(self.headers, split(self.body, 100))
+        part = next(parts)
+
+        self.assertEqual(part.read(), b'hello world')
+        self.assertEqual(part.read(), b'')
+
+    def test_incomplete_input(self):
+        parts = iter_parts(self.headers, [self.body[:-100]])
+
+        with self.assertRaises(ParseFailedException):
+            for part in parts:
+                part.read()
+
+    def test_invalid_headers(self):
+        with self.assertRaises(ParseFailedException):
+            iter_parts({'Content-Type': 'text/plain'}, [])
+
+
+class AsyncIterPartsTestCase(TestCase):
+    def setUp(self):
+        self.headers, self.body = encoded_request([
+            ('name', 'hello world'),
+            ('file', ('file.txt', b'x' * 10000, 'text/plain')),
+        ])
+
+    def collect(self, chunks):
+        async def collect():
+            result = []
+            async for part in aiter_parts(self.headers, chunks):
+                data = b''
+                async for chunk in part.iter_chunks():
+                    data += chunk
+                result.append((part.name, part.filename, data))
+            return result
+
+        return asyncio.run(collect())
+
+    def test_parts(self):
+        result = self.collect(Chunks(split(self.body, 100)))
+
+        self.assertEqual(result, [
+            ('name', None, b'hello world'),
+            ('file', 'file.txt', b'x' * 10000),
+        ])
+
+    def test_read(self):
+        async def read():
+            return [await part.read() async for part in aiter_parts(
+                self.headers, Chunks([self.body]))]
+
+        self.assertEqual(asyncio.run(read()), [b'hello world', b'x' * 10000])
+
+    def test_incomplete_input(self):
+        with self.assertRaises(ParseFailedException):
+            self.collect(Chunks([self.body[:-100]]))
@@ -1,11 +1,22 @@
+import asyncio
+import gc
+import hashlib
 from io import BytesIO
 from numpy import random
+import os.path
+import tempfile
+from threading import Thread
+from time import sleep
 from unittest import TestCase
+import weakref
 
 from requests_toolbelt import MultipartEncoder
 
-from streaming_form_data import StreamingFormDataParser, ParseFailedException
-from streaming_form_data.targets import ValueTarget
+from streaming_form_data import StreamingFormDataParser, \
+    ParseFailedException, ParserPool, parse_file
+import streaming_form_data.parser
+from streaming_form_data.targets import ValueTarget, FileTarget, \
+    NullTarget, SHA256Target
 
 
 def get_random_bytes(size, seed):
@@ -387,6 +398,34 @@ Foo
         self.assertEqual(target._started, True)
         self.assertEqual(target._finished, True)
 
+    def test_parameter_starts_with_ender(self):
+        data = b'''\
+--1234
+Content-Disposition: form-data; name="first"
+
+Foo
+--1234
+Content-Disposition: form-data; name="second"
+
+--1234--Bar
+--1234--'''.replace(b'\n', b'\r\n')
+
+        first = ValueTarget()
+        second = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'})
+        parser.register('first', first)
+        parser.register('second', second)
+
+        # byte by byte, so that no fast forward hides a stale partial match
+        for index in range(len(data)):
+            parser.data_received(data[index:index + 1])
+
+        self.assertEqual(first.value, b'Foo')
+        self.assertEqual(second.value, b'--1234--Bar')
+        self.assertEqual(second._finished, True)
+
     def test_multiple_files(self):
         txt_filename = 'file.txt'
         png_filename = 'image-600x400.png'
@@ -598,6 +637,30 @@ Foo
 
         self.assertEqual(target.value, b'Foo')
 
+    def test_epilogue(self):
+        data = b'''\
+--1234
+Content-Disposition: form-data; name="value"
+
+hello
+--1234--
+epilogue'''.replace(b'\n', b'\r\n')
+
+        # received at once, and with the epilogue in a separate chunk
+        for index in (len(data), data.index(b'epilogue')):
+            target = ValueTarget()
+
+            parser = StreamingFormDataParser(
+                headers={'Content-Type': 'multipart/form-data; boundary=1234'})
+            parser.register('value', target)
+
+            parser.data_received(data[:index])
+            parser.data_received(data[index:])
+
+            self.assertEqual(target.value, b'hello')
+            self.assertTrue(target._finished)
+            self.assertTrue(parser.finished)
+
     def test_register_after_data_received(self):
         encoder = MultipartEncoder(fields={'name': 'hello'})
 
@@ -645,3 +708,1320 @@ Foo
         parser.data_received(body)
 
         self.assertEqual(target.multipart_filename, filename)
+
+    def test_builtin_targets(self):
+        with open_dataset('1M.dat') as dataset_:
+            expected_value = dataset_.read()
+
+        content_type, body = encoded_dataset('1M.dat')
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'builtin-1M.dat')
+
+            value = ValueTarget()
+            sha256 = SHA256Target()
+            file_ = FileTarget(filename)
+
+            for target in (value, sha256, file_, NullTarget()):
+                parser = StreamingFormDataParser(
+                    headers={'Content-Type': content_type})
+                parser.register('1M.dat', target)
+
+                parser.data_received(body)
+
+                self.assertEqual(target._started, True)
+                self.assertEqual(target._finished, True)
+
+            self.assertEqual(value.value, expected_value)
+            self.assertEqual(sha256.value,
+                             hashlib.sha256(expected_value).hexdigest())
+            with open(filename, 'rb') as file_:
+                self.assertEqual(file_.read(), expected_value)
+
+    def test_target_subclass(self):
+        class UpperTarget(ValueTarget):
+            def data_received(self, chunk):
+                super().data_received(chunk.upper())
+
+        target = UpperTarget()
+
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('value', target)
+
+        parser.data_received(encoder.to_string())
+
+        self.assertEqual(target.value, b'HELLO WORLD')
+
+    def test_reset(self):
+        first_encoder = MultipartEncoder(fields={'value': 'hello world'})
+        second_encoder = MultipartEncoder(fields={'value': 'second value'})
+
+        self.assertNotEqual(first_encoder.boundary, second_encoder.boundary)
+
+        first = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': first_encoder.content_type},
+            collect_stats=True)
+        parser.register('value', first)
+
+        body = first_encoder.to_string()
+        parser.data_received(body[:-10])
+
+        second = ValueTarget()
+
+        parser.reset(headers={'Content-Type': second_encoder.content_type})
+        self.assertEqual(parser.stats['bytes_received'], 0)
+
+        parser.register('value', second)
+        parser.data_received(second_encoder.to_string())
+
+        self.assertTrue(first._started)
+        self.assertFalse(first._finished)
+        self.assertEqual(second.value, b'second value')
+        self.assertTrue(second._finished)
+
+    def test_reset_same_boundary(self):
+        data = b'''\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234--'''.replace(b'\n', b'\r\n')
+
+        headers = {'Content-Type': 'multipart/form-data; boundary=1234'}
+
+        parser = StreamingFormDataParser(headers=headers)
+
+        for _ in range(3):
+            target = ValueTarget()
+
+            parser.register('files', target)
+            parser.data_received(data)
+
+            self.assertEqual(target.value, b'Foo')
+
+            parser.reset(headers)
+
+    def test_reset_invalid_headers(self):
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+
+        target = ValueTarget()
+        parser.register('value', target)
+
+        self.assertRaises(ParseFailedException, parser.reset,
+                          {'Content-Type': 'multipart/form-data'})
+
+        parser.data_received(encoder.to_string())
+
+        self.assertEqual(target.value, b'hello world')
+
+    def test_unregistered_part_skipped(self):
+        with open_dataset('1M.dat') as dataset_:
+            encoder = MultipartEncoder(fields={
+                'name': 'hello world',
+                'unexpected': ('1M.dat', dataset_, 'binary/octet-stream'),
+                'value': 'foo',
+            })
+            body = encoder.to_string()
+
+        name = ValueTarget()
+        value = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type},
+            collect_stats=True)
+        parser.register('name', name)
+        parser.register('value', value)
+
+        size = 1000
+        for index in range(0, len(body), size):
+            parser.data_received(body[index:index + size])
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(value.value, b'foo')
+
+        stats = parser.stats
+
+        self.assertEqual(stats['parts'], 3)
+        self.assertEqual(stats['body_chunks'], 2)
+        self.assertEqual(stats['body_bytes'], len(b'hello world' b'foo'))
+        # the discarded body is not carried over between chunks
+        self.assertLess(stats['leftover_bytes'], 1000 * 10)
+
+    def test_finished(self):
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+
+        body = encoder.to_string()
+
+        parser.data_received(body[:-10])
+        self.assertFalse(parser.finished)
+
+        parser.data_received(body[-10:])
+        self.assertTrue(parser.finished)
+
+    def test_stop_when_done(self):
+        encoder = MultipartEncoder(fields={
+            'first': 'foo',
+            'second': 'bar',
+            'third': 'baz',
+        })
+
+        body = encoder.to_string()
+        index = body.index(b'name="third"')
+
+        first = ValueTarget()
+        second = ValueTarget()
+        third = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type},
+            stop_when_done=True)
+        parser.register('first', first)
+        parser.register('second', second)
+
+        parser.data_received(body[:index])
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(first.value, b'foo')
+        self.assertEqual(second.value, b'bar')
+
+        # anything else, even broken input, is ignored
+        parser.data_received(b'garbage')
+        parser.data_received(body[index:])
+
+        self.assertFalse(third._started)
+
+    def test_stop_when_done_not_reached(self):
+        encoder = MultipartEncoder(fields={'first': 'foo'})
+
+        first = ValueTarget()
+        missing = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type},
+            stop_when_done=True)
+        parser.register('first', first)
+        parser.register('missing', missing)
+
+        parser.data_received(encoder.to_string())
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(first.value, b'foo')
+        self.assertFalse(missing._started)
+
+    def test_factory_per_occurrence(self):
+        encoder = MultipartEncoder(fields=[
+            ('files', ('a.txt', b'first', 'text/plain')),
+            ('files', ('b.txt', b'second', 'text/plain')),
+            ('name', 'hello world'),
+        ])
+
+        created = []
+
+        def factory(name, filename, headers):
+            target = ValueTarget()
+            created.append((name, filename, headers['content-type'], target))
+            return target
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register_factory('files', factory)
+
+        parser.data_received(encoder.to_string())
+
+        self.assertEqual(
+            [(name, filename, content_type, target.value)
+             for name, filename, content_type, target in created],
+            [('files', 'a.txt', 'text/plain', b'first'),
+             ('files', 'b.txt', 'text/plain', b'second')])
+
+        for _, _, _, target in created:
+            self.assertTrue(target._finished)
+
+    def test_factory_pattern(self):
+        encoder = MultipartEncoder(fields=[
+            ('file1', 'foo'),
+            ('file2', 'bar'),
+            ('name', 'hello world'),
+            ('other', 'baz'),
+        ])
+
+        targets = {}
+
+        def factory(name, filename, headers):
+            targets[name] = ValueTarget()
+            return targets[name]
+
+        name = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('name', name)
+        parser.register_factory('file*', factory)
+        parser.register_factory('*', lambda *args: NullTarget())
+
+        parser.data_received(encoder.to_string())
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(sorted(targets), ['file1', 'file2'])
+        self.assertEqual(targets['file1'].value, b'foo')
+        self.assertEqual(targets['file2'].value, b'bar')
+
+    def test_factory_while_running(self):
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'})
+        parser.data_received(b'--1234')
+
+        self.assertRaises(ParseFailedException, parser.register_factory, '*',
+                          lambda *args: ValueTarget())
+
+    def test_pause(self):
+        class PausingTarget(ValueTarget):
+            def data_received(self, chunk):
+                super().data_received(chunk)
+                return 'pause'
+
+        encoder = MultipartEncoder(fields=[
+            ('first', 'foo'),
+            ('second', 'bar'),
+            ('third', 'baz'),
+        ])
+        body = encoder.to_string()
+
+        first = PausingTarget()
+        second = ValueTarget()
+        third = PausingTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('first', first)
+        parser.register('second', second)
+        parser.register('third', third)
+
+        consumed = parser.data_received(body)
+
+        self.assertLess(consumed, len(body))
+        self.assertTrue(parser.paused)
+        self.assertEqual(parser.pause_reason, 'pause')
+        self.assertEqual(first.value, b'foo')
+        self.assertEqual(second.value, b'')
+
+        self.assertRaises(ParseFailedException, parser.data_received, b'x')
+
+        # the third part pauses the parser again, at the end of the input
+        consumed += parser.resume()
+
+        self.assertEqual(consumed, len(body))
+        self.assertTrue(parser.paused)
+        self.assertEqual(second.value, b'bar')
+        self.assertEqual(third.value, b'baz')
+        self.assertTrue(parser.finished)
+
+        self.assertEqual(parser.resume(), 0)
+        self.assertFalse(parser.paused)
+
+    def test_pause_leftover(self):
+        class PausingTarget(ValueTarget):
+            def data_received(self, chunk):
+                super().data_received(chunk)
+                return True
+
+        encoder = MultipartEncoder(fields=[
+            ('first', 'foo'),
+            ('second', 'bar'),
+        ])
+        body = encoder.to_string()
+
+        for size in (1, 7, 13):
+            first = PausingTarget()
+            second = ValueTarget()
+
+            parser = StreamingFormDataParser(
+                headers={'Content-Type': encoder.content_type})
+            parser.register('first', first)
+            parser.register('second', second)
+
+            for index in range(0, len(body), size):
+                chunk = body[index:index + size]
+
+                consumed = parser.data_received(chunk)
+                while parser.paused:
+                    consumed += parser.resume()
+
+                self.assertEqual(consumed, len(chunk))
+
+            self.assertEqual(first.value, b'foo')
+            self.assertEqual(second.value, b'bar')
+            self.assertTrue(parser.finished)
+
+    def test_resume_not_paused(self):
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'})
+
+        self.assertFalse(parser.paused)
+        self.assertEqual(parser.resume(), 0)
+
+    def feed_buffers(self, parser, body, sizes):
+        index = 0
+        while index < len(body):
+            for size in sizes:
+                buffer = parser.get_buffer(size)
+                self.assertGreaterEqual(len(buffer), size)
+
+                data = body[index:index + size]
+                buffer[:len(data)] = data
+                del buffer
+
+                parser.buffer_updated(len(data))
+                index += len(data)
+
+    def test_get_buffer(self):
+        with open_dataset('file.txt') as dataset_:
+            expected_value = dataset_.read()
+
+        encoder = MultipartEncoder(fields=[
+            ('name', 'hello world'),
+            ('file', ('file.txt', expected_value, 'text/plain')),
+            ('other', 'foo'),
+        ])
+        body = encoder.to_string()
+
+        for sizes in ((1,), (7, 100, 3), (1000,), (len(body),)):
+            name = ValueTarget()
+            file_ = ValueTarget()
+            other = ValueTarget()
+
+            parser = StreamingFormDataParser(
+                headers={'Content-Type': encoder.content_type})
+            parser.register('name', name)
+            parser.register('file', file_)
+            parser.register('other', other)
+
+            self.feed_buffers(parser, body, sizes)
+
+            self.assertEqual(name.value, b'hello world')
+            self.assertEqual(file_.value, expected_value)
+            self.assertEqual(other.value, b'foo')
+            self.assertTrue(parser.finished)
+
+    def test_get_buffer_mixed_with_data_received(self):
+        encoder = MultipartEncoder(fields=[
+            ('name', 'hello world'),
+            ('file', ('file.dat', b'x' * 100000)),
+        ])
+        body = encoder.to_string()
+
+        name = ValueTarget()
+        file_ = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('name', name)
+        parser.register('file', file_)
+
+        for index in range(0, len(body), 200):
+            data = body[index:index + 200]
+            if index % 400:
+                parser.data_received(data)
+            else:
+                buffer = parser.get_buffer(len(data))
+                buffer[:len(data)] = data
+                parser.buffer_updated(len(data))
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(file_.value, b'x' * 100000)
+        self.assertTrue(parser.finished)
+
+    def test_buffer_updated_pause(self):
+        class PausingTarget(ValueTarget):
+            def data_received(self, chunk):
+                super().data_received(chunk)
+                return True
+
+        encoder = MultipartEncoder(fields=[
+            ('first', 'foo'),
+            ('second', 'bar'),
+        ])
+        body = encoder.to_string()
+
+        first = PausingTarget()
+        second = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('first', first)
+        parser.register('second', second)
+
+        buffer = parser.get_buffer(len(body))
+        buffer[:len(body)] = body
+
+        consumed = parser.buffer_updated(len(body))
+
+        self.assertLess(consumed, len(body))
+        self.assertTrue(parser.paused)
+        self.assertRaises(ParseFailedException, parser.get_buffer)
+
+        self.assertEqual(consumed + parser.resume(), len(body))
+        self.assertEqual(first.value, b'foo')
+        self.assertEqual(second.value, b'bar')
+        self.assertTrue(parser.finished)
+
+    def test_buffer_updated_too_large(self):
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'})
+
+        buffer = parser.get_buffer(10)
+
+        self.assertRaises(ValueError, parser.buffer_updated, len(buffer) + 1)
+
+    def test_buffered_protocol(self):
+        encoder = MultipartEncoder(fields=[
+            ('name', 'hello world'),
+            ('file', ('file.dat', get_random_bytes(1000000, 42))),
+        ])
+        body = encoder.to_string()
+
+        name = ValueTarget()
+        file_ = SHA256Target()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('name', name)
+        parser.register('file', file_)
+
+        class Protocol(asyncio.BufferedProtocol):
+            def __init__(self, done):
+                self.done = done
+
+            def get_buffer(self, size_hint):
+                return parser.get_buffer(size_hint)
+
+            def buffer_updated(self, nbytes):
+                parser.buffer_updated(nbytes)
+
+            def eof_received(self):
+                self.done.set_result(None)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+
+            server = await loop.create_server(lambda: Protocol(done),
+                                              '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(body)
+            await writer.drain()
+            writer.write_eof()
+
+            await done
+
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(run())
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(file_.value, hashlib.sha256(
+            get_random_bytes(1000000, 42)).hexdigest())
+        self.assertTrue(parser.finished)
+
+    def test_part_hooks(self):
+        data = b'''\
+--1234
+Content-Disposition: form-data; name="first"; filename="ab.txt"
+Content-Type: text/plain
+
+Foo
+--1234
+Content-Disposition: form-data; name="unexpected"
+
+Bar
+--1234
+Content-Disposition: form-data; name="second"
+
+Baz
+--1234--'''.replace(b'\n', b'\r\n')
+
+        first = ValueTarget()
+        second = ValueTarget()
+
+        events = []
+
+        def on_part_begin(name, filename, headers):
+            events.append(('begin', name, filename, headers))
+
+        def on_part_end(name, target):
+            events.append(('end', name, getattr(target, 'value', None)))
+
+        def on_all_registered_complete():
+            events.append(('complete',))
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'},
+            on_part_begin=on_part_begin, on_part_end=on_part_end,
+            on_all_registered_complete=on_all_registered_complete)
+        parser.register('first', first)
+        parser.register('second', second)
+
+        parser.data_received(data)
+
+        self.assertEqual(events, [
+            ('begin', 'first', 'ab.txt', {
+                'content-disposition':
+                    'form-data; name="first"; filename="ab.txt"',
+                'content-type': 'text/plain',
+            }),
+            ('end', 'first', b'Foo'),
+            ('begin', 'unexpected', None, {
+                'content-disposition': 'form-data; name="unexpected"',
+            }),
+            ('end', 'unexpected', None),
+            ('begin', 'second', None, {
+                'content-disposition': 'form-data; name="second"',
+            }),
+            ('end', 'second', b'Baz'),
+            ('complete',),
+        ])
+
+    def test_part_begin_before_start(self):
+        class StartTarget(ValueTarget):
+            def __init__(self, events):
+                super().__init__()
+                self.events = events
+
+            def start(self):
+                self.events.append('start')
+
+            def finish(self):
+                self.events.append('finish')
+
+        events = []
+
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type},
+            on_part_begin=lambda *args: events.append('begin'),
+            on_part_end=lambda *args: events.append('end'))
+        parser.register('value', StartTarget(events))
+
+        parser.data_received(encoder.to_string())
+
+        self.assertEqual(events, ['begin', 'start', 'finish', 'end'])
+
+    def test_all_registered_complete_once(self):
+        data = b'''\
+--1234
+Content-Disposition: form-data; name="files"
+
+Foo
+--1234
+Content-Disposition: form-data; name="files"
+
+Bar
+--1234--'''.replace(b'\n', b'\r\n')
+
+        completed = []
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'},
+            on_all_registered_complete=lambda: completed.append(True))
+        parser.register('files', ValueTarget())
+
+        index = data.index(b'Bar')
+
+        parser.data_received(data[:index])
+        self.assertEqual(completed, [True])
+
+        parser.data_received(data[index:])
+        self.assertEqual(completed, [True])
+
+    def test_stats_disabled(self):
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('value', ValueTarget())
+
+        parser.data_received(encoder.to_string())
+
+        self.assertTrue(all(value == 0 for value in parser.stats.values()))
+
+    def test_stats(self):
+        with open_dataset('1M.dat') as dataset_:
+            expected_value = dataset_.read()
+
+        content_type, body = encoded_dataset('1M.dat')
+
+        target = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': content_type}, collect_stats=True)
+        parser.register('1M.dat', target)
+
+        size = 32 * 1024
+        for index in range(0, len(body), size):
+            parser.data_received(body[index:index + size])
+
+        self.assertEqual(target.value, expected_value)
+
+        stats = parser.stats
+
+        self.assertEqual(stats['bytes_received'], len(body))
+        self.assertEqual(stats['parts'], 1)
+        self.assertEqual(stats['body_bytes'], len(expected_value))
+        self.assertGreater(stats['body_chunks'], 1)
+        self.assertLessEqual(stats['body_chunk_min'],
+                             stats['body_chunk_max'])
+        self.assertLessEqual(stats['body_chunk_max'], size)
+        self.assertGreater(stats['bytes_skipped'], stats['bytes_fed'])
+        self.assertEqual(stats['bytes_skipped'] + stats['bytes_fed'],
+                         len(expected_value) + len(b'\r\n--') +
+                         len(content_type.split('boundary=')[1]) + 2)
+        self.assertGreater(stats['target_seconds'], 0)
+
+        parser.reset_stats()
+
+        self.assertTrue(all(value == 0 for value in parser.stats.values()))
+
+    def test_stats_leftover(self):
+        data = b'''\
+--1234
+Content-Disposition: form-data; name="files"; filename="ab.txt"
+
+Foo
+--1234--'''.replace(b'\n', b'\r\n')
+
+        target = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'},
+            collect_stats=True)
+        parser.register('files', target)
+
+        index = data.index(b'ab.txt')
+
+        parser.data_received(data[:index])
+        parser.data_received(data[index:])
+
+        self.assertEqual(target.value, b'Foo')
+
+        stats = parser.stats
+
+        self.assertEqual(stats['leftover_copies'], 2)
+        self.assertEqual(stats['leftover_bytes'],
+                         len(data) - index +
+                         len(b'Content-Disposition: form-data; '
+                             b'name="files"; filename="'))
+        self.assertGreater(stats['header_seconds'], 0)
+
+    def test_profile(self):
+        class SlowTarget(ValueTarget):
+            def data_received(self, chunk):
+                super().data_received(chunk)
+                sleep(0.01)
+
+        encoder = MultipartEncoder(fields={
+            'name': 'hello world',
+            'slow': 'slow value',
+        })
+
+        name = ValueTarget()
+        slow = SlowTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type}, profile=True)
+        parser.register('name', name)
+        parser.register('slow', slow)
+
+        parser.data_received(encoder.to_string())
+
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(slow.value, b'slow value')
+
+        profile = parser.profile
+
+        self.assertEqual(set(profile['targets']), {'name', 'slow'})
+        self.assertEqual(set(profile['targets']['slow']),
+                         {'start', 'data_received', 'finish'})
+        self.assertGreaterEqual(profile['targets']['slow']['data_received'],
+                                0.01)
+        self.assertLess(profile['targets']['name']['data_received'], 0.01)
+
+        # time spent inside targets is not attributed to parser states
+        self.assertLess(sum(profile['states'].values()), 0.01)
+        self.assertGreater(profile['states']['reading_header'], 0)
+        self.assertGreater(profile['headers'], 0)
+
+        parser.reset_profile()
+
+        profile = parser.profile
+        self.assertEqual(profile['targets'], {})
+        self.assertEqual(profile['headers'], 0)
+        self.assertTrue(all(value == 0
+                            for value in profile['states'].values()))
+
+    def test_profile_disabled(self):
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': encoder.content_type})
+        parser.register('value', ValueTarget())
+
+        parser.data_received(encoder.to_string())
+
+        profile = parser.profile
+        self.assertEqual(profile['targets'], {})
+        self.assertTrue(all(value == 0
+                            for value in profile['states'].values()))
+
+    def test_body_chunk_not_copied(self):
+        data = b'x' * 100000
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': 'multipart/form-data; boundary=1234'})
+
+        target = ValueTarget()
+        parser.register('file', target)
+
+        parser.data_received(
+            b'--1234\r\n'
+            b'Content-Disposition: form-data; name="file"\r\n'
+            b'\r\n')
+        parser.data_received(data)
+        parser.data_received(b'\r\n--1234--\r\n')
+
+        # a chunk made of body data only is passed on as it is
+        self.assertIs(target._values[0], data)
+        self.assertEqual(target.value, data)
+
+
+class ParserPoolTestCase(TestCase):
+    def test_reuse(self):
+        pool = ParserPool()
+
+        for value in ('first', 'second', 'third'):
+            encoder = MultipartEncoder(fields={'value': value})
+
+            target = ValueTarget()
+
+            with pool.parser({'Content-Type': encoder.content_type}) \
+                    as parser:
+                parser.register('value', target)
+                parser.data_received(encoder.to_string())
+
+            self.assertEqual(target.value, value.encode('utf-8'))
+
+        self.assertEqual(len(pool._parsers), 1)
+
+    def test_max_size(self):
+        pool = ParserPool(max_size=2)
+
+        headers = {'Content-Type': 'multipart/form-data; boundary=1234'}
+
+        parsers = [pool.acquire(headers) for _ in range(3)]
+        self.assertEqual(len(set(map(id, parsers))), 3)
+
+        for parser in parsers:
+            pool.release(parser)
+
+        self.assertEqual(len(pool._parsers), 2)
+        self.assertIn(pool.acquire(headers), parsers)
+
+    def test_release(self):
+        pool = ParserPool()
+
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+        body = encoder.to_string()
+
+        target = ValueTarget()
+        reference = weakref.ref(target)
+
+        with pool.parser({'Content-Type': encoder.content_type}) as parser:
+            parser.register('value', target)
+            parser.data_received(body[:-10])
+
+        del target
+        gc.collect()
+
+        # neither the target nor the leftover of the request are kept
+        self.assertIsNone(reference())
+
+        target = ValueTarget()
+
+        with pool.parser({'Content-Type': encoder.content_type}) as parser:
+            parser.register('value', target)
+            parser.data_received(body)
+
+            self.assertTrue(parser.finished)
+
+        self.assertEqual(target.value, b'hello world')
+
+    def test_invalid_headers(self):
+        pool = ParserPool()
+
+        headers = {'Content-Type': 'multipart/form-data; boundary=1234'}
+        pool.release(pool.acquire(headers))
+
+        self.assertRaises(ParseFailedException, pool.acquire, {})
+        self.assertEqual(len(pool._parsers), 1)
+
+    def test_parser_arguments(self):
+        pool = ParserPool(collect_stats=True)
+
+        encoder = MultipartEncoder(fields={'value': 'hello world'})
+        body = encoder.to_string()
+
+        with pool.parser({'Content-Type': encoder.content_type}) as parser:
+            parser.data_received(body)
+
+            self.assertEqual(parser.stats['bytes_received'], len(body))
+
+    def test_threads(self):
+        pool = ParserPool(max_size=4)
+
+        errors = []
+
+        def worker(index):
+            try:
+                for iteration in range(50):
+                    value = '{}-{}'.format(index, iteration)
+                    encoder = MultipartEncoder(fields={'value': value})
+                    target = ValueTarget()
+
+                    with pool.parser(
+                            {'Content-Type': encoder.content_type}) as parser:
+                        parser.register('value', target)
+                        parser.data_received(encoder.to_string())
+
+                    if target.value != value.encode('utf-8'):
+                        errors.append(value)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=worker, args=(index,))
+                   for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(pool._parsers), 4)
+
+
+class ParseFileTestCase(TestCase):
+    def setUp(self):
+        self.file_data = get_random_bytes(1000000, 7)
+        self.encoder = MultipartEncoder(fields=[
+            ('name', 'hello world'),
+            ('file', ('file.dat', self.file_data)),
+        ])
+
+        self.body = self.encoder.to_string()
+
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'body.dat')
+
+        with open(self.path, 'wb') as file_:
+            file_.write(self.body)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_parse_file(self):
+        name = ValueTarget()
+        file_ = SHA256Target()
+
+        parser = parse_file(self.path,
+                            {'Content-Type': self.encoder.content_type},
+                            {'name': name, 'file': file_})
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(file_.value,
+                         hashlib.sha256(self.file_data).hexdigest())
+
+    def test_boundary(self):
+        file_ = ValueTarget()
+
+        parse_file(self.path, self.encoder.boundary_value, {'file': file_})
+
+        self.assertEqual(file_.value, self.file_data)
+
+    def test_zero_copy(self):
+        file_ = ValueTarget()
+
+        parser = parse_file(self.path, self.encoder.boundary_value,
+                            {'file': file_}, collect_stats=True)
+
+        self.assertEqual(parser.stats['body_chunks'], 1)
+        self.assertIsInstance(file_._values[0], memoryview)
+
+    def test_truncated_file(self):
+        with open(self.path, 'r+b') as file_:
+            file_.truncate(500000)
+
+        with self.assertRaises(ParseFailedException):
+            parse_file(self.path, self.encoder.boundary_value,
+                       {'file': ValueTarget()})
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+
+        with self.assertRaises(ParseFailedException):
+            parse_file(self.path, self.encoder.boundary_value, {})
+
+    def test_parse_buffer(self):
+        name = ValueTarget()
+        file_ = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': self.encoder.content_type})
+        parser.register('name', name)
+        parser.register('file', file_)
+
+        # data carried over from data_received
+        parser.data_received(self.body[:1000])
+        parser.parse_buffer(memoryview(self.body)[1000:])
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(file_.value, self.file_data)
+
+    def test_parse_bytearray(self):
+        file_ = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': self.encoder.content_type})
+        parser.register('file', file_)
+
+        # the data left over at the end of the buffer is copied, the buffer
+        # itself being still referenced by the target
+        buffer = bytearray(self.body[:-10])
+        parser.parse_buffer(buffer)
+        parser.data_received(self.body[-10:])
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(file_.value, self.file_data)
+        self.assertEqual(buffer, self.body[:-10])
+
+    def test_parse_bytearray_paused(self):
+        class PausingTarget(ValueTarget):
+            def data_received(self, chunk):
+                super().data_received(chunk)
+                return 'pause'
+
+        name = PausingTarget()
+        file_ = ValueTarget()
+
+        parser = StreamingFormDataParser(
+            headers={'Content-Type': self.encoder.content_type})
+        parser.register('name', name)
+        parser.register('file', file_)
+
+        buffer = bytearray(self.body[:-10])
+        parser.parse_buffer(buffer)
+
+        self.assertTrue(parser.paused)
+
+        parser.resume()
+        parser.data_received(self.body[-10:])
+
+        self.assertTrue(parser.finished)
+        self.assertEqual(name.value, b'hello world')
+        self.assertEqual(file_.value, self.file_data)
+
+        # the rest of the buffer is still parsed in place
+        self.assertIsInstance(file_._values[0], memoryview)
+        self.assertEqual(buffer, self.body[:-10])
+
+
+class ParseHeaderTestCase(TestCase):
+    def parse_header(self, line):
+        return streaming_form_data.parser.parse_header(line)
+
+    def test_content_type(self):
+        self.assertEqual(
+            self.parse_header('multipart/form-data; boundary=----1234'),
+            ('multipart/form-data', {'boundary': '----1234'}))
+
+        self.assertEqual(self.parse_header('text/plain'), ('text/plain', {}))
+
+    def test_content_disposition(self):
+        self.assertEqual(
+            self.parse_header(
+                'form-data; Name="file"; filename="file; name.txt"'),
+            ('form-data', {'name': 'file', 'filename': 'file; name.txt'}))
+
+    def test_escapes(self):
+        self.assertEqual(
+            self.parse_header(r'form-data; name="a\"b"; filename="C:\\x"'),
+            ('form-data', {'name': 'a"b', 'filename': 'C:\\x'}))
+
+        # unescaped backslashes are kept, as sent by some browsers
+        self.assertEqual(
+            self.parse_header(r'form-data; filename="C:\dir\file.txt"'),
+            ('form-data', {'filename': r'C:\dir\file.txt'}))
+
+    def test_whitespace_and_empty_params(self):
+        self.assertEqual(self.parse_header(' a ;; b = c ; d ;'),
+                         ('a', {'b': 'c'}))
+
+    def test_cached_delimiters(self):
+        headers = {'content-type': 'multipart/form-data; boundary=1234'}
+
+        first = streaming_form_data.parser.delimiters_for(headers)
+        second = streaming_form_data.parser.delimiters_for(dict(headers))
+
+        self.assertEqual(first, (b'\r\n--1234\r\n', b'\r\n--1234--'))
+        self.assertIs(first, second)
+
+
+class FindAllTestCase(TestCase):
+    def find_all(self, buffer, target, start, end):
+        return streaming_form_data.parser.find_all(buffer, target, start, end)
+
+    def test_find_all(self):
+        buffer = b'--ab--ab-abab--'
+
+        self.assertEqual(self.find_all(buffer, b'ab', 0, len(buffer)),
+                         [2, 6, 9, 11])
+        self.assertEqual(self.find_all(buffer, b'--', 0, len(buffer)),
+                         [0, 4, 13])
+        self.assertEqual(self.find_all(buffer, b'x', 0, len(buffer)), [])
+        self.assertEqual(self.find_all(b'', b'ab', 0, 0), [])
+
+    def test_regions(self):
+        buffer = bytes(random.choice(list(b'-\r\nab'), 5000))
+        target = b'\r\n--'
+
+        expected = []
+        offset = buffer.find(target)
+        while offset >= 0:
+            expected.append(offset)
+            offset = buffer.find(target, offset + 1)
+
+        # occurrences straddling the end of a region are found in it
+        for size in (1, 3, 100, 1000):
+            offsets = []
+            for start in range(0, len(buffer), size):
+                offsets.extend(self.find_all(buffer, target, start,
+                                             start + size))
+
+            self.assertEqual(offsets, expected)
+
+    def test_bytearray(self):
+        buffer = bytearray(b'a\r\n--b\r\n--')
+
+        self.assertEqual(self.find_all(buffer, b'\r\n--', 0, len(buffer)),
+                         [1, 6])
+
+
+class PassthroughTestCase(TestCase):
+    def setUp(self):
+        self.file_data = get_random_bytes(100000, 11)
+
+        self.encoder = MultipartEncoder(fields=[
+            ('token', 'secret'),
+            ('file', ('file.dat', self.file_data)),
+            ('tenant', 'acme'),
+            ('other', 'value'),
+        ])
+        self.body = self.encoder.to_string()
+        self.headers = {'Content-Type': self.encoder.content_type}
+
+    def fields(self, body):
+        # values of the parts of a forwarded body
+        values = {}
+
+        parser = StreamingFormDataParser(self.headers)
+        parser.register_factory(
+            '*', lambda name, *args: values.setdefault(name, ValueTarget()))
+        parser.data_received(body)
+
+        self.assertTrue(parser.finished)
+
+        return {name: target.value for name, target in values.items()}
+
+    def test_passthrough(self):
+        for size in (1, 7, 100, 4096, len(self.body)):
+            chunks = []
+            token = ValueTarget()
+
+            parser = StreamingFormDataParser(self.headers,
+                                             passthrough=chunks.append)
+            parser.register('token', token)
+
+            for index in range(0, len(self.body), size):
+                parser.data_received(self.body[index:index + size])
+
+            self.assertEqual(b''.join(chunks), self.body)
+            self.assertEqual(token.value, b'secret')
+
+    def test_zero_copy(self):
+        chunks = []
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=chunks.append)
+        parser.data_received(self.body)
+
+        self.assertEqual(len(chunks), 1)
+        self.assertIs(chunks[0], self.body)
+
+    def test_strip_and_rewrite(self):
+        for size in (1, 7, 100, 4096, len(self.body)):
+            chunks = []
+            token = ValueTarget()
+
+            parser = StreamingFormDataParser(self.headers,
+                                             passthrough=chunks.append)
+            parser.register('token', token)
+            parser.strip('tok*')
+            parser.rewrite('tenant', lambda name, value: value.upper())
+
+            for index in range(0, len(self.body), size):
+                parser.data_received(self.body[index:index + size])
+
+            self.assertEqual(token.value, b'secret')
+            self.assertEqual(self.fields(b''.join(chunks)), {
+                'file': self.file_data,
+                'tenant': b'ACME',
+                'other': b'value',
+            })
+
+    def test_strip_last_part(self):
+        chunks = []
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=chunks.append)
+        parser.strip('other')
+        parser.data_received(self.body)
+
+        self.assertEqual(self.fields(b''.join(chunks)), {
+            'token': b'secret',
+            'file': self.file_data,
+            'tenant': b'acme',
+        })
+
+    def test_stripped_data_not_held(self):
+        chunks = []
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=chunks.append)
+        parser.strip('file')
+
+        index = self.body.index(self.file_data[:100])
+        parser.data_received(self.body[:index + 50000])
+
+        # only the tail which could start a delimiter is held back
+        delimiter = b'\r\n--' + self.encoder.boundary_value.encode()
+        held = sum(len(chunk) for chunk in parser._passthrough._chunks)
+
+        self.assertLess(held, 2 * len(delimiter))
+        self.assertEqual(b''.join(chunks), self.body[:index].rsplit(
+            b'\r\n--', 1)[0] + b'\r\n')
+
+    def test_read_buffer(self):
+        chunks = []
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=chunks.append)
+        parser.strip('token')
+
+        for index in range(0, len(self.body), 1000):
+            data = self.body[index:index + 1000]
+
+            buffer = parser.get_buffer(len(data))
+            buffer[:len(data)] = data
+            parser.buffer_updated(len(data))
+
+        self.assertEqual(self.fields(b''.join(chunks)), {
+            'file': self.file_data,
+            'tenant': b'acme',
+            'other': b'value',
+        })
+
+    def test_released_read_buffer(self):
+        chunks = []
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=chunks.append)
+
+        for index in range(0, len(self.body), 1000):
+            data = self.body[index:index + 1000]
+
+            with parser.get_buffer(len(data)) as buffer:
+                buffer[:len(data)] = data
+            parser.buffer_updated(len(data))
+
+        self.assertEqual(b''.join(chunks), self.body)
+
+    def test_parse_buffer(self):
+        chunks = []
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=chunks.append)
+        parser.rewrite('other', lambda name, value: b'')
+        parser.parse_buffer(self.body)
+
+        self.assertEqual(self.fields(b''.join(chunks)), {
+            'token': b'secret',
+            'file': self.file_data,
+            'tenant': b'acme',
+            'other': b'',
+        })
+
+    def test_pause(self):
+        class PausingTarget(ValueTarget):
+            def data_received(self, chunk):
+                super().data_received(chunk)
+                return 'pause'
+
+        chunks = []
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=chunks.append)
+        parser.register('token', PausingTarget())
+        parser.strip('tenant')
+
+        parser.data_received(self.body)
+        while parser.paused:
+            parser.resume()
+
+        self.assertEqual(self.fields(b''.join(chunks)), {
+            'token': b'secret',
+            'file': self.file_data,
+            'other': b'value',
+        })
+
+    def test_rules(self):
+        parser = StreamingFormDataParser(self.headers)
+
+        self.assertRaises(ParseFailedException, parser.strip, 'token')
+
+        parser = StreamingFormDataParser(self.headers,
+                                         passthrough=lambda chunk: None)
+        parser.data_received(self.body[:10])
+
+        self.assertRaises(ParseFailedException, parser.strip, 'token')
+
+        # rules are cleared when the parser is reset
+        parser.reset(self.headers)
+        parser.strip('token')
+        parser.reset(self.headers)
+
+        self.assertEqual(parser._passthrough.rules, [])
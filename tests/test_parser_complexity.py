@@ -0,0 +1,125 @@
+from time import perf_counter
+from unittest import TestCase
+
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import ValueTarget
+
+
+BOUNDARY = b'b0undaryb0undaryb0undary'
+CONTENT_TYPE = 'multipart/form-data; boundary=' + BOUNDARY.decode('utf-8')
+
+# Input sizes grow by a factor of 2 between consecutive measurements, so
+# linear algorithms keep the time spent per byte roughly constant while
+# quadratic ones double it on every step.
+SIZE_STEPS = 4
+
+# Maximum allowed ratio between the largest and the smallest per-byte cost.
+# Quadratic behavior yields 2 ** (SIZE_STEPS - 1) = 8, which is far above it.
+MAX_COST_RATIO = 3.0
+
+REPEATS = 3
+
+
+def part_header(name, filename=None):
+    header = b'Content-Disposition: form-data; name="' + name + b'"'
+    if filename is not None:
+        header += b'; filename="' + filename + b'"'
+    return header + b'\r\n\r\n'
+
+
+def single_part_body(header, value):
+    return b'--' + BOUNDARY + b'\r\n' + header + value + \
+        b'\r\n--' + BOUNDARY + b'--\r\n'
+
+
+def near_miss_boundaries(size):
+    """Body value consisting of delimiters which differ from the real one
+    only in the last byte."""
+    near_miss = b'\r\n--' + BOUNDARY[:-1] + b'X'
+    value = near_miss * (size // len(near_miss))
+    return single_part_body(part_header(b'file'), value), 4096
+
+
+def partial_delimiter_at_chunk_edges(size):
+    """Every chunk ends in the middle of a potential delimiter, so the parser
+    has to keep a leftover and re-scan it with the next chunk."""
+    chunk_size = 64
+    header = b'--' + BOUNDARY + b'\r\n' + part_header(b'file')
+
+    # pad the header so that the body starts at a chunk edge
+    pad = chunk_size - len(header) % chunk_size
+    header = header[:-4] + b' ' * pad + b'\r\n\r\n'
+
+    partial = b'\r\n--' + BOUNDARY[:len(BOUNDARY) // 2]
+    filler = b'x' * (chunk_size - len(partial))
+    value = (filler + partial) * (size // chunk_size)
+
+    body = header + value + b'\r\n--' + BOUNDARY + b'--\r\n'
+    return body, chunk_size
+
+
+def long_header_line(size):
+    """A single header line spanning a lot of small chunks."""
+    header = part_header(b'file', b'a' * size)
+    return single_part_body(header, b'foo'), 16
+
+
+def many_empty_parts(size):
+    """Lots of parts without any content."""
+    count = size // 64
+    parts = []
+    for index in range(count):
+        name = ('field{}'.format(index)).encode('utf-8')
+        parts.append(b'--' + BOUNDARY + b'\r\n' + part_header(name))
+        parts.append(b'\r\n')
+    body = b''.join(parts) + b'--' + BOUNDARY + b'--\r\n'
+    return body, 1024
+
+
+def many_header_lines(size):
+    """A single part with a huge number of short header lines."""
+    count = size // 16
+    header = b'X-Header: value\r\n' * count + part_header(b'file')
+    return single_part_body(header, b'foo'), 1000
+
+
+def parse(body, chunk_size):
+    parser = StreamingFormDataParser(headers={'Content-Type': CONTENT_TYPE})
+    parser.register('file', ValueTarget())
+
+    begin = perf_counter()
+    for offset in range(0, len(body), chunk_size):
+        parser.data_received(body[offset:offset + chunk_size])
+    return perf_counter() - begin
+
+
+def cost_per_byte(generator, size):
+    body, chunk_size = generator(size)
+    elapsed = min(parse(body, chunk_size) for _ in range(REPEATS))
+    return elapsed / len(body)
+
+
+class ComplexityTestCase(TestCase):
+    def assertLinear(self, generator, base_size):
+        costs = [cost_per_byte(generator, base_size * 2 ** step)
+                 for step in range(SIZE_STEPS)]
+
+        ratio = costs[-1] / max(min(costs), 1e-12)
+        self.assertLess(ratio, MAX_COST_RATIO,
+                        '{}: time per byte grows with input size: {}'.format(
+                            generator.__name__, costs))
+
+    def test_near_miss_boundaries(self):
+        self.assertLinear(near_miss_boundaries, 256 * 1024)
+
+    def test_partial_delimiter_at_chunk_edges(self):
+        self.assertLinear(partial_delimiter_at_chunk_edges, 128 * 1024)
+
+    def test_long_header_line(self):
+        self.assertLinear(long_header_line, 256 * 1024)
+
+    def test_many_empty_parts(self):
+        self.assertLinear(many_empty_parts, 128 * 1024)
+
+    def test_many_header_lines(self):
+        self.assertLinear(many_header_lines, 64 * 1024)
@@ -0,0 +1,161 @@
+import importlib
+import random
+import sys
+import types
+from unittest import mock, skipIf, TestCase
+
+import test_parser
+import test_parser_complexity
+import test_parser_stress
+
+from streaming_form_data import _pyparser
+from streaming_form_data.parser import _delimiters, _load_engine
+from streaming_form_data.targets import ValueTarget
+
+try:
+    _parser = importlib.import_module('streaming_form_data._parser')
+except ImportError:
+    _parser = None
+
+
+# Run the parser test suites against the pure Python engine as well
+
+class PyParserMixin:
+    def setUp(self):
+        super().setUp()
+
+        for name in ('_Parser', 'parse_header', 'find_all'):
+            patcher = mock.patch('streaming_form_data.parser.' + name,
+                                 getattr(_pyparser, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class PyParserStreamingFormDataParserTestCase(
+        PyParserMixin, test_parser.StreamingFormDataParserTestCase):
+    pass
+
+
+class PyParserComplexityTestCase(
+        PyParserMixin, test_parser_complexity.ComplexityTestCase):
+    pass
+
+
+class PyParserDifferentFileSizesTestCase(
+        PyParserMixin, test_parser_stress.DifferentFileSizesTestCase):
+    pass
+
+
+class PyParserParseFileTestCase(PyParserMixin, test_parser.ParseFileTestCase):
+    pass
+
+
+class PyParserParseHeaderTestCase(PyParserMixin,
+                                  test_parser.ParseHeaderTestCase):
+    pass
+
+
+class PyParserFindAllTestCase(PyParserMixin, test_parser.FindAllTestCase):
+    pass
+
+
+class PyParserPassthroughTestCase(PyParserMixin,
+                                  test_parser.PassthroughTestCase):
+    pass
+
+
+class EngineTestCase(TestCase):
+    def test_outdated_extension(self):
+        # as built from the sources of an earlier release
+        module = types.ModuleType('streaming_form_data._parser')
+        module._Parser = object
+
+        with mock.patch.dict(sys.modules,
+                             {'streaming_form_data._parser': module}):
+            with self.assertWarns(RuntimeWarning):
+                engine = _load_engine()
+
+        self.assertEqual(engine, (_pyparser._Parser, _pyparser.parse_header,
+                                  _pyparser.find_all))
+
+    def test_missing_extension(self):
+        with mock.patch.dict(sys.modules,
+                             {'streaming_form_data._parser': None}):
+            self.assertEqual(_load_engine(),
+                             (_pyparser._Parser, _pyparser.parse_header,
+                              _pyparser.find_all))
+
+
+@skipIf(_parser is None, 'extension not built')
+class CrossEngineTestCase(TestCase):
+    """Both engines parse the same bodies, received in the same chunks,
+    the same way."""
+
+    def setUp(self):
+        self.random = random.Random(42)
+
+    def body(self, boundary):
+        # parts holding pieces of delimiters, followed by an epilogue
+        pieces = [b'\r\n', b'--', boundary, b'-', b'\r', b'\n', b'data',
+                  b'\r\n--' + boundary]
+
+        def noise(count):
+            return b''.join(self.random.choice(pieces)
+                            for _ in range(self.random.randint(0, count)))
+
+        body = b''.join(
+            b'--' + boundary + b'\r\n'
+            b'Content-Disposition: form-data; name="part%d"\r\n\r\n' %
+            index + noise(12) + b'\r\n'
+            for index in range(self.random.randint(0, 3)))
+        body += b'--' + boundary + b'--' + noise(6)
+
+        if self.random.random() < 0.2:
+            body = body[:self.random.randint(0, len(body))]
+
+        return body
+
+    def chunk_sizes(self, length):
+        sizes = []
+        while length > 0:
+            sizes.append(self.random.choice([1, 2, 3, 5, 8, 64, length]))
+            length -= sizes[-1]
+        return sizes
+
+    def parse(self, engine, boundary, body, sizes):
+        parser = engine(*_delimiters(boundary))
+
+        targets = []
+
+        def factory(name, filename, headers):
+            targets.append((name, ValueTarget()))
+            return targets[-1][1]
+
+        parser.register_factory('*', factory)
+
+        results = []
+        index = 0
+        for size in sizes:
+            results.append(parser.data_received(body[index:index + size]))
+            index += size
+
+            if results[-1]:
+                break
+
+        return (results,
+                [(name, target.value, target._finished)
+                 for name, target in targets],
+                parser.finished)
+
+    def test_same_results(self):
+        for _ in range(2000):
+            boundary = b'XyZ' + bytes(
+                self.random.choice(b'ab-')
+                for _ in range(self.random.randint(0, 3)))
+            body = self.body(boundary)
+            sizes = self.chunk_sizes(len(body))
+
+            self.assertEqual(
+                self.parse(_parser._Parser, boundary, body, sizes),
+                self.parse(_pyparser._Parser, boundary, body, sizes),
+                (body, sizes))
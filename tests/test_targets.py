@@ -1,9 +1,21 @@
+import asyncio
+import hashlib
+from multiprocessing import Process, Queue
 import os.path
+import signal
+import sys
 import tempfile
+import threading
+from time import sleep
 from unittest import TestCase
 
+from requests_toolbelt import MultipartEncoder
+
+from streaming_form_data import StreamingFormDataParser
 from streaming_form_data.targets \
-    import BaseTarget, NullTarget, ValueTarget, FileTarget
+    import BaseTarget, NullTarget, ValueTarget, FileTarget, \
+    ObjectStorageTarget, SharedMemoryTarget, ProcessPipeTarget, \
+    AsyncProcessPipeTarget
 
 
 class NullTargetTestCase(TestCase):
@@ -141,3 +153,403 @@ class CustomTargetTestCase(TestCase):
         target = CustomTarget()
         self.assertEqual(target.value, b'')
         self.assertTrue(target.multipart_filename is None)
+
+
+class FakeStorageClient:
+    """In-memory stand-in for the multipart upload API of a boto3 S3 client.
+    """
+
+    def __init__(self, fail_part=None):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+        self._fail_part = fail_part
+        self._lock = threading.Lock()
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = 'upload{}'.format(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+
+        sleep(0.01)
+
+        with self._lock:
+            self.concurrent -= 1
+
+        if PartNumber == self._fail_part:
+            raise IOError('upload failed')
+
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': 'etag{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(parts)
+
+        self.objects[(Bucket, Key)] = b''.join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(UploadId)
+
+
+class SmallPartsObjectStorageTarget(ObjectStorageTarget):
+    MinPartSize = 1
+
+
+class ObjectStorageTargetTestCase(TestCase):
+    def test_basic(self):
+        client = FakeStorageClient()
+        target = SmallPartsObjectStorageTarget(
+            client, 'bucket', 'key', part_size=10, max_workers=3)
+
+        data = bytes(range(256)) * 4
+
+        target.start()
+        for index in range(0, len(data), 7):
+            target.data_received(data[index:index + 7])
+        target.finish()
+
+        self.assertEqual(client.objects[('bucket', 'key')], data)
+        self.assertEqual(client.uploads, {})
+        self.assertGreater(client.max_concurrent, 1)
+        self.assertLessEqual(client.max_concurrent, 3)
+
+    def test_empty(self):
+        client = FakeStorageClient()
+        target = ObjectStorageTarget(client, 'bucket', 'key')
+
+        target.start()
+        target.finish()
+
+        self.assertEqual(client.objects[('bucket', 'key')], b'')
+
+    def test_part_size_too_small(self):
+        with self.assertRaises(ValueError):
+            ObjectStorageTarget(FakeStorageClient(), 'bucket', 'key',
+                                part_size=1024)
+
+    def test_failed_part(self):
+        client = FakeStorageClient(fail_part=2)
+        target = SmallPartsObjectStorageTarget(
+            client, 'bucket', 'key', part_size=10, max_workers=2)
+
+        target.start()
+
+        with self.assertRaises(IOError):
+            for _ in range(100):
+                target.data_received(b'x' * 10)
+            target.finish()
+
+        self.assertEqual(client.aborted, ['upload0'])
+        self.assertEqual(client.objects, {})
+
+    def test_abort(self):
+        client = FakeStorageClient()
+        target = SmallPartsObjectStorageTarget(
+            client, 'bucket', 'key', part_size=10)
+
+        target.start()
+        target.data_received(b'x' * 25)
+        target.abort()
+
+        self.assertEqual(client.aborted, ['upload0'])
+        self.assertEqual(client.uploads, {})
+
+
+def hash_shared_memory(reader, results):
+    digest = hashlib.sha256()
+    with reader:
+        for chunk in reader:
+            digest.update(chunk)
+    results.put(digest.hexdigest())
+
+
+class SharedMemoryTargetTestCase(TestCase):
+    def test_worker_process(self):
+        # much more data than fits into the ring buffer, in chunks which do
+        # not divide its capacity
+        data = os.urandom(100000)
+
+        target = SharedMemoryTarget(capacity=4096, timeout=10)
+        results = Queue()
+
+        worker = Process(target=hash_shared_memory,
+                         args=(target.reader(), results))
+        worker.start()
+
+        try:
+            target.start()
+            for index in range(0, len(data), 1000):
+                target.data_received(data[index:index + 1000])
+            target.finish()
+
+            self.assertEqual(results.get(timeout=10),
+                             hashlib.sha256(data).hexdigest())
+        finally:
+            worker.join()
+            target.close()
+
+    def test_thread(self):
+        target = SharedMemoryTarget(capacity=10, timeout=10)
+        result = []
+
+        def read():
+            with target.reader() as reader:
+                result.append(reader.read())
+
+        thread = threading.Thread(target=read)
+        thread.start()
+
+        target.start()
+        target.data_received(b'hello world, hello world')
+        target.data_received(b'')
+        target.data_received(b'!')
+        target.finish()
+
+        thread.join()
+        target.close()
+
+        self.assertEqual(result, [b'hello world, hello world!'])
+
+    def test_empty(self):
+        target = SharedMemoryTarget(capacity=10)
+        target.start()
+        target.finish()
+
+        with target.reader() as reader:
+            self.assertEqual(reader.read(), b'')
+
+        target.close()
+
+    def test_full(self):
+        target = SharedMemoryTarget(capacity=10, timeout=0.1)
+        target.start()
+
+        target.data_received(b'x' * 10)
+        with self.assertRaises(TimeoutError):
+            target.data_received(b'x')
+
+        target.close()
+
+
+# reads the whole input, then prints its hash and its size on stderr
+HASH_COMMAND = [sys.executable, '-c', """
+import hashlib, sys
+data = sys.stdin.buffer.read()
+sys.stdout.write(hashlib.sha256(data).hexdigest())
+sys.stderr.write(str(len(data)))
+sys.exit(3)
+"""]
+
+# exits without reading its input
+EXIT_COMMAND = [sys.executable, '-c', 'import sys; sys.exit(1)']
+
+
+class ProcessPipeTargetTestCase(TestCase):
+    def test_basic(self):
+        data = os.urandom(1000000)
+
+        target = ProcessPipeTarget(HASH_COMMAND, batch_size=4096)
+
+        target.start()
+        for index in range(0, len(data), 1000):
+            target.data_received(data[index:index + 1000])
+        target.finish()
+
+        self.assertEqual(target.returncode, 3)
+        self.assertEqual(target.stdout.decode(),
+                         hashlib.sha256(data).hexdigest())
+        self.assertEqual(target.stderr, b'1000000')
+
+    def test_command_exits_early(self):
+        target = ProcessPipeTarget(EXIT_COMMAND)
+
+        target.start()
+        for _ in range(100):
+            target.data_received(b'x' * 65536)
+        target.finish()
+
+        self.assertEqual(target.returncode, 1)
+        self.assertEqual(target.stdout, b'')
+
+    def test_abort(self):
+        target = ProcessPipeTarget(HASH_COMMAND)
+
+        target.start()
+        target.data_received(os.urandom(100000))
+        target.abort()
+
+        self.assertEqual(target.returncode, -signal.SIGKILL)
+        self.assertFalse(any(thread.is_alive() for thread in target._threads))
+
+        # once the command has been killed
+        target.abort()
+
+
+class AsyncProcessPipeTargetTestCase(TestCase):
+    def test_basic(self):
+        data = os.urandom(1000000)
+
+        async def run():
+            target = AsyncProcessPipeTarget(HASH_COMMAND)
+
+            target.start()
+            for index in range(0, len(data), 100000):
+                target.data_received(data[index:index + 100000])
+                self.assertLessEqual(target.pending_size, 100000)
+                await target.drain()
+                self.assertEqual(target.pending_size, 0)
+            target.finish()
+
+            return target, await target.wait()
+
+        target, returncode = asyncio.run(run())
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(target.returncode, 3)
+        self.assertEqual(target.stdout.decode(),
+                         hashlib.sha256(data).hexdigest())
+
+    def test_pause_parser(self):
+        data = os.urandom(1000000)
+        encoder = MultipartEncoder(fields={'file': ('file.dat', data)})
+        body = encoder.to_string()
+
+        async def run():
+            target = AsyncProcessPipeTarget(HASH_COMMAND)
+
+            parser = StreamingFormDataParser(
+                headers={'Content-Type': encoder.content_type})
+            parser.register('file', target)
+
+            pauses = 0
+            for index in range(0, len(body), 100000):
+                parser.data_received(body[index:index + 100000])
+                while parser.paused:
+                    pauses += 1
+                    await parser.pause_reason
+                    self.assertEqual(target.pending_size, 0)
+                    parser.resume()
+
+            await target.wait()
+            return target, pauses
+
+        target, pauses = asyncio.run(run())
+
+        self.assertGreater(pauses, 0)
+        self.assertEqual(target.stdout.decode(),
+                         hashlib.sha256(data).hexdigest())
+
+    def test_finish_with_pending_data(self):
+        data = os.urandom(1000000)
+
+        async def run():
+            target = AsyncProcessPipeTarget(HASH_COMMAND)
+
+            target.start()
+            target.data_received(data)
+            self.assertGreater(target.pending_size, 0)
+            target.finish()
+
+            await target.wait()
+            return target
+
+        target = asyncio.run(run())
+
+        self.assertEqual(target.stdout.decode(),
+                         hashlib.sha256(data).hexdigest())
+
+    def test_command_exits_early(self):
+        async def run():
+            target = AsyncProcessPipeTarget(EXIT_COMMAND)
+
+            target.start()
+            for _ in range(100):
+                target.data_received(b'x' * 65536)
+                await target.drain()
+            target.finish()
+
+            return await target.wait()
+
+        self.assertEqual(asyncio.run(run()), 1)
+
+    def test_parser_in_executor(self):
+        data = os.urandom(1000000)
+        encoder = MultipartEncoder(fields={'file': ('file.dat', data)})
+        body = encoder.to_string()
+
+        async def run():
+            loop = asyncio.get_running_loop()
+
+            target = AsyncProcessPipeTarget(HASH_COMMAND)
+
+            parser = StreamingFormDataParser(
+                headers={'Content-Type': encoder.content_type})
+            parser.register('file', target)
+
+            for index in range(0, len(body), 100000):
+                await loop.run_in_executor(
+                    None, parser.data_received, body[index:index + 100000])
+                while parser.paused:
+                    await parser.pause_reason
+                    await loop.run_in_executor(None, parser.resume)
+
+            await asyncio.wait_for(target.wait(), 10)
+            return target
+
+        target = asyncio.run(run())
+
+        self.assertEqual(target.stdout.decode(),
+                         hashlib.sha256(data).hexdigest())
+
+    def test_cancelled_pause(self):
+        async def run():
+            target = AsyncProcessPipeTarget(HASH_COMMAND)
+
+            target.start()
+            reason = target.data_received(os.urandom(1000000))
+
+            # like a request handler waiting to resume the parser when the
+            # client disconnects
+            task = asyncio.ensure_future(reason)
+            await asyncio.sleep(0)
+            task.cancel()
+
+            target.finish()
+
+            return await asyncio.wait_for(target.wait(), 10)
+
+        self.assertEqual(asyncio.run(run()), 3)
+
+    def test_abort(self):
+        async def run():
+            target = AsyncProcessPipeTarget(HASH_COMMAND)
+
+            target.start()
+            reason = target.data_received(os.urandom(1000000))
+            self.assertGreater(target.pending_size, 0)
+
+            target.abort()
+
+            # a parser paused on the target can resume
+            await asyncio.wait_for(reason, 10)
+            self.assertEqual(target.pending_size, 0)
+
+            return target, await asyncio.wait_for(target.wait(), 10)
+
+        target, returncode = asyncio.run(run())
+
+        self.assertEqual(returncode, -signal.SIGKILL)
+        self.assertEqual(target.returncode, -signal.SIGKILL)
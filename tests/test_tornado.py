@@ -0,0 +1,272 @@
+import asyncio
+import os.path
+import tempfile
+import threading
+
+from requests_toolbelt import MultipartEncoder
+from tornado.tcpclient import TCPClient
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler, stream_request_body
+
+from streaming_form_data.targets import FileTarget, ValueTarget
+from streaming_form_data.tornado import StreamingFormDataMixin
+
+
+class SlowTarget(ValueTarget):
+    """Pauses the parser for every chunk."""
+
+    def __init__(self):
+        super().__init__()
+
+        self.pauses = 0
+
+    def data_received(self, chunk):
+        super().data_received(chunk)
+
+        self.pauses += 1
+        return asyncio.sleep(0)
+
+
+@stream_request_body
+class UploadHandler(StreamingFormDataMixin, RequestHandler):
+    max_body_size = 1024 * 1024
+
+    def prepare(self):
+        super().prepare()
+
+        self.value = ValueTarget()
+        self.file_ = SlowTarget()
+        self.files = []
+
+        self.register('name', self.value)
+        self.register('file', self.file_)
+        self.register_factory('files', self.new_file)
+
+    def new_file(self, name, filename, headers):
+        self.files.append(ValueTarget())
+        return self.files[-1]
+
+    def post(self):
+        self.write({
+            'name': self.value.value.decode(),
+            'file': len(self.file_.value),
+            'pauses': self.file_.pauses,
+            'files': [target.value.decode() for target in self.files],
+        })
+
+
+@stream_request_body
+class BlockingUploadHandler(StreamingFormDataMixin, RequestHandler):
+    blocking_targets = True
+
+    def prepare(self):
+        super().prepare()
+
+        self.file_ = FileTarget(self.application.settings['filename'])
+        self.register('file', self.file_)
+
+    def post(self):
+        self.write({'file': os.path.getsize(self.file_.filename)})
+
+
+class WaitingFileTarget(FileTarget):
+    """Blocks in data_received until the event is set."""
+
+    def __init__(self, filename, event):
+        super().__init__(filename)
+
+        self.event = event
+        self.waiting = threading.Event()
+
+    def data_received(self, chunk):
+        super().data_received(chunk)
+
+        self.waiting.set()
+        self.event.wait()
+
+
+@stream_request_body
+class WaitingUploadHandler(StreamingFormDataMixin, RequestHandler):
+    blocking_targets = True
+
+    def prepare(self):
+        super().prepare()
+
+        settings = self.application.settings
+
+        self.file_ = WaitingFileTarget(settings['filename'],
+                                       settings['event'])
+        settings['requests'].append(self)
+
+        self.register('file', self.file_)
+
+    def post(self):
+        self.write({})
+
+
+class TornadoTestCase(AsyncHTTPTestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'upload.dat')
+
+        self.event = threading.Event()
+        self.requests = []
+
+        super().setUp()
+
+    def tearDown(self):
+        self.event.set()
+
+        super().tearDown()
+
+        self.tempdir.cleanup()
+
+    def get_app(self):
+        return Application([
+            (r'/upload', UploadHandler),
+            (r'/blocking', BlockingUploadHandler),
+            (r'/waiting', WaitingUploadHandler),
+        ], filename=self.filename, event=self.event, requests=self.requests)
+
+    def post(self, path, fields):
+        encoder = MultipartEncoder(fields=fields)
+        return self.fetch(path, method='POST', body=encoder.to_string(),
+                          headers={'Content-Type': encoder.content_type})
+
+    def test_upload(self):
+        response = self.post('/upload', [
+            ('name', 'hello world'),
+            ('file', ('file.dat', os.urandom(200000))),
+            ('files', ('a.txt', b'first')),
+            ('files', ('b.txt', b'second')),
+        ])
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body.count(b'"file": 200000'), 1)
+        self.assertIn(b'"name": "hello world"', response.body)
+        self.assertIn(b'"files": ["first", "second"]', response.body)
+        self.assertNotIn(b'"pauses": 0', response.body)
+
+    def test_epilogue(self):
+        encoder = MultipartEncoder(fields={'name': 'hello world'})
+        response = self.fetch('/upload', method='POST',
+                              body=encoder.to_string() + b'epilogue',
+                              headers={'Content-Type': encoder.content_type})
+
+        self.assertEqual(response.code, 200)
+        self.assertIn(b'"name": "hello world"', response.body)
+
+    def test_blocking_targets(self):
+        response = self.post('/blocking', {
+            'file': ('file.dat', os.urandom(200000)),
+        })
+
+        self.assertEqual(response.code, 200)
+        self.assertIn(b'"file": 200000', response.body)
+
+    def test_body_too_large(self):
+        response = self.post('/upload', {
+            'file': ('file.dat', b'x' * (2 * 1024 * 1024)),
+        })
+
+        self.assertEqual(response.code, 413)
+
+    def test_not_multipart(self):
+        response = self.fetch('/upload', method='POST', body=b'hello',
+                              headers={'Content-Type': 'text/plain'})
+
+        self.assertEqual(response.code, 400)
+
+    def test_invalid_body(self):
+        encoder = MultipartEncoder(fields={'name': 'hello'})
+        response = self.fetch('/upload', method='POST', body=b'invalid',
+                              headers={'Content-Type': encoder.content_type})
+
+        self.assertEqual(response.code, 400)
+
+    def test_incomplete_body(self):
+        encoder = MultipartEncoder(fields={
+            'file': ('file.dat', os.urandom(200000)),
+        })
+
+        response = self.fetch('/blocking', method='POST',
+                              body=encoder.to_string()[:100000],
+                              headers={'Content-Type': encoder.content_type})
+
+        self.assertEqual(response.code, 400)
+        self.assertFalse(os.path.exists(self.filename))
+
+    @gen_test
+    async def test_connection_closed_while_parsing(self):
+        encoder = MultipartEncoder(fields={
+            'file': ('file.dat', os.urandom(200000)),
+        })
+        body = encoder.to_string()
+
+        stream = await self.create_stream()
+        await stream.write(
+            b'POST /waiting HTTP/1.1\r\n'
+            b'Host: 127.0.0.1\r\n'
+            b'Content-Type: ' + encoder.content_type.encode() + b'\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' +
+            body[:100000])
+
+        for _ in range(100):
+            if self.requests and self.requests[0].file_.waiting.is_set():
+                break
+            await asyncio.sleep(0.01)
+
+        handler = self.requests[0]
+        self.assertTrue(handler.file_.waiting.is_set())
+
+        # as reported by Tornado while the parser is running in the executor
+        handler.on_connection_close()
+        await asyncio.sleep(0.1)
+
+        # the target is still being written to
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertFalse(handler.file_._fd.closed)
+
+        self.event.set()
+
+        for _ in range(100):
+            if not os.path.exists(self.filename):
+                break
+            await asyncio.sleep(0.01)
+        self.assertFalse(os.path.exists(self.filename))
+
+        stream.close()
+
+    @gen_test
+    async def test_connection_closed(self):
+        encoder = MultipartEncoder(fields={
+            'file': ('file.dat', os.urandom(200000)),
+        })
+        body = encoder.to_string()
+
+        stream = await self.create_stream()
+        await stream.write(
+            b'POST /blocking HTTP/1.1\r\n'
+            b'Host: 127.0.0.1\r\n'
+            b'Content-Type: ' + encoder.content_type.encode() + b'\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' +
+            body[:100000])
+
+        # wait for the file to be created and written to
+        for _ in range(100):
+            if os.path.exists(self.filename) and \
+                    os.path.getsize(self.filename) > 0:
+                break
+            await asyncio.sleep(0.01)
+        self.assertTrue(os.path.exists(self.filename))
+
+        stream.close()
+
+        for _ in range(100):
+            if not os.path.exists(self.filename):
+                break
+            await asyncio.sleep(0.01)
+        self.assertFalse(os.path.exists(self.filename))
+
+    async def create_stream(self):
+        return await TCPClient().connect('127.0.0.1', self.get_http_port())
@@ -0,0 +1,199 @@
+from io import BytesIO
+import os.path
+import tempfile
+from unittest import TestCase
+
+from requests_toolbelt import MultipartEncoder
+
+from streaming_form_data.targets import FileTarget, SHA256Target, \
+    ValueTarget
+from streaming_form_data.wsgi import StreamingFormDataMiddleware
+
+
+class ReadOnlyStream:
+    """Input stream without readinto()."""
+
+    def __init__(self, data):
+        self._stream = BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+class FailingStream:
+    """Input stream raising once size bytes have been read."""
+
+    def __init__(self, data, size):
+        self._stream = BytesIO(data)
+        self._size = size
+
+    def read(self, size=-1):
+        if self._stream.tell() >= self._size:
+            raise OSError('Connection reset')
+        return self._stream.read(size)
+
+
+class WSGITestCase(TestCase):
+    def setUp(self):
+        self.encoder = MultipartEncoder(fields=[
+            ('name', 'hello world'),
+            ('file', ('file.dat', b'x' * 100000)),
+            ('file', ('other.dat', b'y' * 1000)),
+        ])
+        self.body = self.encoder.to_string()
+
+        self.environ = None
+        self.files = None
+
+    def app(self, environ, start_response):
+        self.environ = environ
+
+        parts = environ.get('streaming_form_data.parts')
+        if parts is not None and 'file' in parts:
+            self.files = []
+            for target in parts['file']:
+                if hasattr(target, 'filename'):
+                    with open(target.filename, 'rb') as file_:
+                        self.files.append(
+                            (target.filename, target.multipart_filename,
+                             file_.read()))
+
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [environ['wsgi.input'].read()]
+
+    def request(self, middleware, stream=None, path='/upload',
+                content_type=None, extra=None):
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': path,
+            'CONTENT_TYPE': content_type or self.encoder.content_type,
+            'CONTENT_LENGTH': str(len(self.body)),
+            'wsgi.input': stream or BytesIO(self.body + b'trailing'),
+        }
+        environ.update(extra or {})
+        status = []
+
+        def start_response(status_, headers):
+            status.append(status_)
+
+        response = middleware(environ, start_response)
+        body = b''.join(response)
+        if hasattr(response, 'close'):
+            response.close()
+
+        return status[0], body
+
+    def test_parts(self):
+        for stream in (None, ReadOnlyStream(self.body)):
+            middleware = StreamingFormDataMiddleware(self.app, buffer_size=7)
+
+            status, body = self.request(middleware, stream)
+
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(body, b'')
+
+            parts = self.environ['streaming_form_data.parts']
+
+            self.assertEqual(parts['name'][0].value, b'hello world')
+            self.assertEqual(
+                [(filename, content) for _, filename, content in self.files],
+                [('file.dat', b'x' * 100000), ('other.dat', b'y' * 1000)])
+
+            # the temporary files are removed after the response
+            for path, _, _ in self.files:
+                self.assertFalse(os.path.exists(path))
+
+    def test_epilogue(self):
+        body = self.body + b'epilogue'
+        middleware = StreamingFormDataMiddleware(self.app)
+
+        status, _ = self.request(middleware, BytesIO(body),
+                                 extra={'CONTENT_LENGTH': str(len(body))})
+
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(
+            self.environ['streaming_form_data.parts']['name'][0].value,
+            b'hello world')
+
+    def test_factory(self):
+        def factory(name, filename, headers):
+            return SHA256Target()
+
+        middleware = StreamingFormDataMiddleware(self.app, factory=factory)
+
+        self.request(middleware)
+
+        parts = self.environ['streaming_form_data.parts']
+
+        self.assertEqual(len(parts['file']), 2)
+        self.assertTrue(all(isinstance(target, SHA256Target)
+                            for targets in parts.values()
+                            for target in targets))
+
+    def test_paths(self):
+        middleware = StreamingFormDataMiddleware(self.app, paths=['/upload'])
+
+        status, body = self.request(middleware, path='/other')
+
+        self.assertEqual(status, '200 OK')
+        self.assertNotIn('streaming_form_data.parts', self.environ)
+        self.assertTrue(body.startswith(self.body))
+
+    def test_not_multipart(self):
+        middleware = StreamingFormDataMiddleware(self.app)
+
+        status, body = self.request(middleware, content_type='text/plain')
+
+        self.assertNotIn('streaming_form_data.parts', self.environ)
+
+    def test_invalid_body(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            middleware = StreamingFormDataMiddleware(self.app,
+                                                     tempdir=tempdir)
+
+            status, _ = self.request(middleware, BytesIO(self.body[:50000]))
+
+            self.assertEqual(status, '400 Bad Request')
+            self.assertIsNone(self.environ)
+            self.assertEqual(os.listdir(tempdir), [])
+
+    def test_missing_content_length(self):
+        middleware = StreamingFormDataMiddleware(self.app)
+
+        # the stream is not read past the (missing) length
+        status, _ = self.request(middleware, FailingStream(self.body, 0),
+                                 extra={'CONTENT_LENGTH': ''})
+
+        self.assertEqual(status, '400 Bad Request')
+
+        status, _ = self.request(middleware, BytesIO(self.body),
+                                 extra={'CONTENT_LENGTH': '',
+                                        'wsgi.input_terminated': True})
+
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(
+            self.environ['streaming_form_data.parts']['name'][0].value,
+            b'hello world')
+
+    def test_read_error(self):
+        targets = []
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            def factory(name, filename, headers):
+                if filename is None:
+                    return ValueTarget()
+
+                targets.append(FileTarget(os.path.join(tempdir, filename)))
+                return targets[-1]
+
+            for factory_ in (None, factory):
+                middleware = StreamingFormDataMiddleware(
+                    self.app, factory=factory_, tempdir=tempdir,
+                    buffer_size=1000)
+
+                with self.assertRaises(OSError):
+                    self.request(middleware, FailingStream(self.body, 50000))
+
+            # temporary files are removed, other files are closed
+            self.assertEqual(os.listdir(tempdir), ['file.dat'])
+            self.assertTrue(targets[0]._fd.closed)
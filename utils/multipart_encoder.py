@@ -1,7 +1,8 @@
 from argparse import ArgumentParser
 import mimetypes
+import sys
 
-from requests_toolbelt import MultipartEncoder
+from streaming_form_data.encoder import MultipartEncoder
 
 
 def parse_args():
@@ -24,12 +25,11 @@ def main():
             'file': (args.filename, file_, content_type)
         }
 
-        body = MultipartEncoder(fields=fields).to_string()
-
-        if args.decode:
-            print(body.decode('utf-8'))
-        else:
-            print(body)
+        for chunk in MultipartEncoder(fields):
+            if args.decode:
+                sys.stdout.write(chunk.decode('utf-8'))
+            else:
+                sys.stdout.buffer.write(chunk)
 
 
 if __name__ == '__main__':
@@ -71,6 +71,9 @@ def parse_args():
                         type=int, required=False,
                         help='Size of generated data' +
                         ' to be used instead of real file')
+    parser.add_argument('--parser-profile', action='store_true',
+                        help='Use the parser built-in timing profile' +
+                        ' instead of cProfile')
     return parser.parse_args()
 
 
@@ -88,21 +91,44 @@ def open_data(args):
                     'please specify --filename or --data_size argument')
 
 
-@c_profile()
-def main():
-    args = parse_args()
+def print_parser_profile(profile):
+    print('Parser states:')
+    for name, seconds in sorted(profile['states'].items(),
+                                key=lambda item: -item[1]):
+        print('  %-20s %.6f sec' % (name, seconds))
+
+    print('Header parsing: %.6f sec' % profile['headers'])
 
+    print('Targets:')
+    for name, actions in sorted(profile['targets'].items()):
+        for action, seconds in actions.items():
+            print('  %-20s %-15s %.6f sec' % (name, action, seconds))
+
+
+def run(args, profile=False):
     with open_data(args) as fd:
         encoder = MultipartEncoder(fields={
             'file': ('file', fd, args.content_type)
         })
 
         parser = StreamingFormDataParser(
-            headers={'Content-Type': encoder.content_type})
+            headers={'Content-Type': encoder.content_type}, profile=profile)
         parser.register('file', ValueTarget())
 
         parser.data_received(encoder.to_string())
 
+    return parser
+
+
+def main():
+    args = parse_args()
+
+    if args.parser_profile:
+        parser = run(args, profile=True)
+        print_parser_profile(parser.profile)
+    else:
+        c_profile()(run)(args)
+
 
 if __name__ == '__main__':
     main()
@@ -1,9 +1,9 @@
 from io import BytesIO
 from numpy import random
-from requests_toolbelt import MultipartEncoder
+from streaming_form_data.encoder import MultipartEncoder
 from streaming_form_data.parser import StreamingFormDataParser
 from streaming_form_data.targets import NullTarget, BaseTarget
-from time import time
+from time import perf_counter, time
 
 
 class DummyTarget(BaseTarget):
@@ -45,14 +45,17 @@ def main():
 
     filedata = fill_bytes_random(filedata_size)
 
-    with BytesIO(filedata) as fd:
-        content_type = 'binary/octet-stream'
+    defaultChunksize = 32 * kibibyte
+
+    # the body is produced while it is being parsed, instead of being
+    # built in memory beforehand
+    content_type = 'binary/octet-stream'
 
-        encoder = MultipartEncoder(fields={
-            'file': ('file', fd, content_type)
-        })
-        headers = {'Content-Type': encoder.content_type}
-        body = encoder.to_string()
+    encoder = MultipartEncoder(fields={
+        'file': ('file', BytesIO(filedata), content_type)
+    }, chunk_size=defaultChunksize)
+    headers = {'Content-Type': encoder.content_type}
+    body_length = encoder.content_length
 
     print_report = False
     gather_data = False
@@ -65,11 +68,6 @@ def main():
     parser.register('lines', NullTarget())
     parser.register('file', target)
 
-    defaultChunksize = 32 * kibibyte
-    position = 0
-    body_length = len(body)
-    remaining = body_length
-
     end_time = time()
     print('Data prepared')
     time_diff = end_time - begin_time
@@ -80,12 +78,14 @@ def main():
 
     print('Begin test...')
 
+    # only the parser calls are timed, the time spent producing the body
+    # being reported separately
+    parse_time = 0
     begin_time = time()
-    while remaining > 0:
-        chunksize = min(defaultChunksize, remaining)
-        parser.data_received(body[position: position + chunksize])
-        remaining -= chunksize
-        position += chunksize
+    for chunk in encoder:
+        parse_begin_time = perf_counter()
+        parser.data_received(chunk)
+        parse_time += perf_counter() - parse_begin_time
     end_time = time()
 
     print('End test')
@@ -102,11 +102,12 @@ def main():
             print('ERROR! Data decoding is not complete!')
             print('-------------------------------------------')
 
-    time_diff = end_time - begin_time
     print('Test took: %.3f sec; speed: %.3f MB/s; body size: %.3f MB' %
-          (time_diff,
-           (body_length / time_diff / mebibyte if time_diff > 0 else 0),
+          (parse_time,
+           (body_length / parse_time / mebibyte if parse_time > 0 else 0),
            body_length / mebibyte))
+    print('Encoder took: %.3f sec' %
+          (end_time - begin_time - parse_time))
 
 
 if __name__ == '__main__':